@@ -1,24 +1,88 @@
+import os
+
+import click
+from catalog_feed import CHUNK_ROWS
 from flask import Flask, render_template
+from werkzeug.middleware.proxy_fix import ProxyFix
 from database import (
     get_engine,
     DATABASE_URL,
     init_db,
     populate_country_table,
+    stream_catalog,
 )
 from dotenv import load_dotenv
 from blueprints import (
     register_blueprints,
 )  # Import the function to register blueprints
+from blueprints.utils import (
+    overhead_table,
+    prewarm_images,
+    warm_autocomplete,
+)
 
 load_dotenv()
 app = Flask(__name__)
 
+# Number of reverse proxies in front of the app whose X-Forwarded-For
+# entries are trusted for the client address; none by default
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # configure production database
 engine = get_engine(DATABASE_URL)
 
 # Register all blueprints
 register_blueprints(app)
 
+
+@app.before_request
+def start_background_jobs():
+    # Start refreshing the satellites above each country once serving,
+    # and build the search autocompletes
+    if not app.testing:
+        overhead_table.start()
+        warm_autocomplete()
+
+
+@app.cli.command("prewarm-images")
+@click.option("--limit", type=int, default=None, help="Most names to look up")
+@click.option(
+    "--delay", type=float, default=1.0, help="Seconds between searches"
+)
+def prewarm_images_command(limit, delay):
+    """Look up and store the image of every satellite in the catalog"""
+    if not os.getenv("GOOGLE_API_KEY") or not os.getenv("GOOGLE_CX"):
+        raise click.ClickException("GOOGLE_API_KEY and GOOGLE_CX must be set")
+    init_db(DATABASE_URL)
+    count = prewarm_images(limit=limit, delay=delay)
+    click.echo(f"Looked up images for {count} satellites")
+
+
+@app.cli.command("ingest-catalog")
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--group", default=None, help="Group to record satellites in")
+@click.option(
+    "--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows per chunk"
+)
+def ingest_catalog_command(paths, group, chunk_rows):
+    """Stream CSV, OMM JSON or OMM XML catalog feeds (optionally
+    gzipped) into the database in bounded chunks"""
+    init_db(DATABASE_URL)
+    for path in paths:
+        try:
+            stats = stream_catalog(path, engine, group, chunk_rows)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(
+            f"{path}: read {stats['rows']} rows, rejected "
+            f"{stats['rejected']}, wrote {stats['written']} "
+            f"in {stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} "
+            f"rows/s, peak RSS {stats['peak_rss_mb']:.0f} MiB)"
+        )
+
+
 if __name__ == "__main__":
     init_db(DATABASE_URL)
     populate_country_table("csvfiles/countries.csv", engine)
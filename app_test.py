@@ -1,3 +1,5 @@
+import gzip
+import json
 from unittest.mock import patch, MagicMock
 
 import requests
@@ -8,19 +10,72 @@ from database import (
     init_db,
     get_engine,
     populate_country_table,
+    save_satellite_image,
+    find_satellites_by_name,
+    search_satellites,
+    get_catalog_version,
+    add_satellite_to_user,
+    add_country_to_user,
+    delete_satellite_from_user,
+    delete_country_from_user,
+    get_account,
+    get_tracked_satellites,
+    track_group,
+    track_satellites,
+    untrack_group,
+    untrack_satellites,
+    MIGRATIONS,
+    migrate,
+    get_satellite_id_by_name,
+    get_satellite_by_id,
+    get_country_by_name,
+    check_username_exists,
+    process_multiple_csv,
+    stream_catalog,
 )
 import pytest
-from sqlalchemy import inspect, select
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.exc import OperationalError
 import polars as pl
 import os
 from models import satellite_table as get_satellite_table
 from models import country_table as get_country_table
+from models import user_table as get_user_table
 from blueprints.utils import (
     process_query,
     get_satellite_data,
     fetch_satellite_image,
     generateSatData,
+    get_local_tle_data,
+    fetch_concurrently,
+    tle_cache,
+    orbit_cache,
+    tle_cache_ttl,
+    image_cache,
+    prewarm_images,
+    get_geocoder,
+    getlocation,
+    get_observer_location,
+    observer_cache,
+    account_cache,
 )
+from cache import TTLCache
+import threading
+import time
+import tracemalloc
+from propagation import tle_from_elements, is_stale, SatelliteCatalog
+import ephem
+import math
+from overhead import OverheadTable, SubpointIndex
+from passes import PassPredictor, PassCache
+from propagation import satrec_from_elements
+from upstream import UpstreamClient
+from geocoder import OCEAN
+from autocomplete import Autocomplete, satellite_autocomplete
+from catalog_feed import iter_chunks, pool_size
+from blueprints import utils as blueprint_utils
+import numpy as np
+from datetime import datetime, timezone
 
 
 def test_knows_about_moon():
@@ -36,13 +91,33 @@ def client():
         yield client
 
 
-# Mock database connection for tests
+# Module-level response caches must not leak between tests
+@pytest.fixture(autouse=True)
+def clear_caches():
+    yield
+    tle_cache.clear()
+    orbit_cache.clear()
+    image_cache.clear()
+    observer_cache.clear()
+    account_cache.clear()
+
+
+# Image URL store in a temporary database
+@pytest.fixture
+def image_store(tmp_path):
+    url = f"sqlite:///{tmp_path / 'images.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    with patch("blueprints.utils._image_engine", engine):
+        yield engine
+
+
+# Mock database connection for tests, returning the query result
 @pytest.fixture
 def mock_db(mocker):
-    mock_conn = mocker.patch("sqlite3.connect")
-    mock_cursor = MagicMock()
-    mock_conn.return_value.cursor.return_value = mock_cursor
-    return mock_cursor
+    mock_engine = mocker.patch("database.read_engine")
+    mock_connection = mock_engine.connect.return_value.__enter__.return_value
+    return mock_connection.execute.return_value
 
 
 def test_homepage(client):
@@ -76,8 +151,8 @@ def test_clickable_satellite(client, mock_db):
     assert b"HST" in response.data
 
 
-@patch("requests.get")
-def test_clickable_country(mock_requests_get, client, mock_db):
+@patch("blueprints.country.satellites_above")
+def test_clickable_country(mock_satellites_above, client, mock_db):
     """test the clicking on a country in user page"""
     # Mock database response
     mock_db.fetchone.return_value = (
@@ -89,11 +164,8 @@ def test_clickable_country(mock_requests_get, client, mock_db):
         500,
     )  # Country, lat, lng, radius
 
-    # Mock API response
-    mock_requests_get.return_value.status_code = 200
-    mock_requests_get.return_value.json.return_value = {
-        "above": [{"satid": 12345, "satname": "HST"}]
-    }
+    # Mock the locally propagated satellites
+    mock_satellites_above.return_value = [{"id": 12345, "name": "HST"}]
 
     # Send the request
     response = client.get("/country/?country=USA")
@@ -103,6 +175,7 @@ def test_clickable_country(mock_requests_get, client, mock_db):
     assert response.status_code == 200
     assert b"Satellites Over" in response.data
     assert b"HST" in response.data
+    mock_satellites_above.assert_called_once_with(40.7128, -74.0060, 500)
 
 
 def test_login_valid_user(client):
@@ -123,7 +196,7 @@ def test_login_invalid_user(client):
     assert b"User does not exist" in response.data
 
 
-@patch("requests.get")
+@patch("upstream.get")
 def test_api_satellite(mock_get):
     """Mock Test the N2Y0 API"""
     # set up the mock to return a fake response
@@ -260,28 +333,26 @@ def test_country_table_population(tmp_path, engine):
     ), "Expected country above_angle to be populated"
 
 
-@patch("sqlite3.connect")
-def test_satellite_missing_name(mock_connect, client):
+@patch("blueprints.satellites.get_satellite_id_by_name")
+def test_satellite_missing_name(mock_lookup, client):
     """Test for missing satellite name."""
     response = client.get("/satellites/?name=")
     assert response.status_code == 400
     assert b"Satellite name is required" in response.data
 
 
-@patch("requests.get")
+@patch("upstream.get")
 @patch("blueprints.utils.get_observer_location")
-@patch("sqlite3.connect")
+@patch("blueprints.satellites.get_satellite_id_by_name")
 def test_satellite_not_found(
-    mock_connect, mock_get_observer_location, mock_requests_get, client
+    mock_lookup, mock_get_observer_location, mock_requests_get, client
 ):
     """Test for satellite not found in the database."""
     mock_get_observer_location.return_value = (
         10.0,
         20.0,
     )  # Mock observer location
-    mock_cursor = MagicMock()
-    mock_connect.return_value.cursor.return_value = mock_cursor
-    mock_cursor.fetchone.return_value = None  # No satellite found
+    mock_lookup.return_value = None  # No satellite found
 
     response = client.get("/satellite/?name=NonExistentSatellite")
     assert response.status_code == 404
@@ -289,7 +360,7 @@ def test_satellite_not_found(
 
 
 @patch("os.getenv")
-@patch("requests.get")
+@patch("upstream.get")
 def test_fetch_satellite_image_curated(mock_requests_get, mock_getenv):
     """Test fetching curated satellite image."""
     # Test with a curated image (e.g., "HST")
@@ -301,7 +372,7 @@ def test_fetch_satellite_image_curated(mock_requests_get, mock_getenv):
 
 
 @patch("os.getenv")
-@patch("requests.get")
+@patch("upstream.get")
 def test_fetch_satellite_image_missing_api_key(mock_requests_get, mock_getenv):
     """Test fetching satellite image when Google API key is missing."""
     mock_getenv.side_effect = lambda key: None  # Mock missing API keys
@@ -313,9 +384,9 @@ def test_fetch_satellite_image_missing_api_key(mock_requests_get, mock_getenv):
 
 
 @patch("os.getenv")
-@patch("requests.get")
+@patch("upstream.get")
 def test_fetch_satellite_image_google_api_success(
-    mock_requests_get, mock_getenv
+    mock_requests_get, mock_getenv, image_store
 ):
     """Test fetching satellite image with Google API success."""
     # Mock Google API Key and CX
@@ -336,9 +407,9 @@ def test_fetch_satellite_image_google_api_success(
 
 
 @patch("os.getenv")
-@patch("requests.get")
+@patch("upstream.get")
 def test_fetch_satellite_image_google_api_failure(
-    mock_requests_get, mock_getenv
+    mock_requests_get, mock_getenv, image_store
 ):
     """Test fetching satellite image with Google API failure."""
     # Mock Google API Key and CX
@@ -375,3 +446,1404 @@ def test_generateSatData_empty_tle():
     assert result["id"] == 12345
     assert result["image_url"] == image_url
     assert "location" not in result  # Location should be absent
+
+
+ISS_ELEMENTS = {
+    "id": 25544,
+    "name": "ISS (ZARYA)",
+    "object_id": "1998-067A",
+    "epoch": "2024-11-28T23:03:32.393376",
+    "mean_motion": 15.50011369,
+    "eccentricity": 0.0006779,
+    "inclination": 51.6398,
+    "ra_of_asc_node": 219.0558,
+    "arg_of_pericenter": 277.6674,
+    "mean_anomaly": 199.7958,
+    "ephemeris_type": 0,
+    "classification_type": "U",
+    "element_set_no": 999,
+    "rev_at_epoch": 48410,
+    "bstar": 0.00041427,
+    "mean_motion_dot": 0.00023281,
+    "mean_motion_ddot": 0.0,
+}
+
+
+def test_csv_import_stores_elements(engine, tmp_path):
+    """Test that the orbital elements are stored with each satellite"""
+    csv_path = tmp_path / "elements.csv"
+    pl.DataFrame(
+        {
+            "OBJECT_NAME": ["CALSPHERE 1"],
+            "OBJECT_ID": ["1964-063C"],
+            "EPOCH": ["2024-11-28T17:32:14.753184"],
+            "MEAN_MOTION": [13.75621458],
+            "ECCENTRICITY": [0.0026022],
+            "INCLINATION": [90.2120],
+            "RA_OF_ASC_NODE": [58.9317],
+            "ARG_OF_PERICENTER": [199.4143],
+            "MEAN_ANOMALY": [332.0399],
+            "EPHEMERIS_TYPE": [0],
+            "CLASSIFICATION_TYPE": ["U"],
+            "NORAD_CAT_ID": [900],
+            "ELEMENT_SET_NO": [999],
+            "REV_AT_EPOCH": [99364],
+            "BSTAR": [0.0019913],
+            "MEAN_MOTION_DOT": [0.00001933],
+            "MEAN_MOTION_DDOT": [0.0],
+        }
+    ).write_csv(csv_path)
+
+    read_and_insert_csv(csv_path, engine)
+
+    with engine.connect() as connection:
+        row = (
+            connection.execute(
+                select(get_satellite_table).where(
+                    get_satellite_table.c.id == 900
+                )
+            )
+            .mappings()
+            .one()
+        )
+    assert row["name"] == "CALSPHERE 1"
+    assert row["epoch"] == "2024-11-28T17:32:14.753184"
+    assert row["mean_motion"] == 13.75621458
+    assert row["bstar"] == 0.0019913
+
+
+def test_tle_from_elements():
+    """Test that stored elements are converted back into a valid TLE"""
+    name, line1, line2 = tle_from_elements(ISS_ELEMENTS)
+    assert name == "ISS (ZARYA)"
+    assert line1 == (
+        "1 25544U 98067A   24333.96079159  .00023281  00000-0  41427-3 0  9998"
+    )
+    assert line2 == (
+        "2 25544  51.6398 219.0558 0006779 277.6674 199.7958 15.50011369484108"
+    )
+
+
+def test_is_stale():
+    """Test that old element sets are flagged as stale"""
+    near_epoch = datetime(2024, 11, 30, tzinfo=timezone.utc)
+    long_after = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    assert not is_stale(ISS_ELEMENTS, near_epoch)
+    assert is_stale(ISS_ELEMENTS, long_after)
+
+
+@patch("blueprints.utils.is_stale", return_value=False)
+def test_get_local_tle_data(mock_is_stale, mock_db):
+    """Test that TLE data is built from the stored elements"""
+    mock_db.fetchone.return_value = tuple(ISS_ELEMENTS.values())
+    result = get_local_tle_data(25544)
+    assert result["info"] == {"satid": 25544, "satname": "ISS (ZARYA)"}
+    line1, line2 = result["tle"].split("\r\n")
+    assert line1.startswith("1 25544U")
+    assert line2.startswith("2 25544")
+
+
+def test_get_local_tle_data_without_elements(mock_db):
+    """Test that satellites without elements fall back to N2YO"""
+    mock_db.fetchone.return_value = (20580, "HST")
+    assert get_local_tle_data(20580) is None
+
+
+def test_catalog_propagation_matches_ephem():
+    """Test batch propagation against ephem for the same element set"""
+    catalog = SatelliteCatalog([ISS_ELEMENTS])
+    when = datetime(2024, 11, 30, 12, 0, tzinfo=timezone.utc)
+    result = catalog.propagate(when)
+
+    sat = ephem.readtle(*tle_from_elements(ISS_ELEMENTS))
+    sat.compute("2024/11/30 12:00:00")
+
+    assert list(catalog.ids) == [25544]
+    assert result["valid"][0]
+    assert result["lon"][0] == pytest.approx(
+        math.degrees(sat.sublong), abs=0.01
+    )
+    assert result["alt"][0] == pytest.approx(sat.elevation / 1000, abs=1)
+    # ephem reports geocentric latitude, the catalog geodetic latitude
+    assert result["lat"][0] == pytest.approx(
+        math.degrees(sat.sublat), abs=0.3
+    )
+    assert result["ground_speed"][0] == pytest.approx(7.18, abs=0.01)
+
+
+def test_catalog_marks_stale_element_sets_invalid():
+    """Test that stale sets are invalid, as on the satellite page"""
+    catalog = SatelliteCatalog([ISS_ELEMENTS])
+    when = datetime(2025, 3, 1, tzinfo=timezone.utc)
+    assert is_stale(ISS_ELEMENTS, when)
+    assert not catalog.propagate(when)["valid"][0]
+    assert list(catalog.above(0, 0, 90, when=when)) == []
+
+
+def test_catalog_skips_rows_without_elements():
+    """Test that satellites without elements are left out of the catalog"""
+    catalog = SatelliteCatalog([{"id": 20580, "name": "HST"}])
+    assert len(catalog) == 0
+    assert catalog.propagate()["lat"].shape == (0,)
+
+
+def test_catalog_above():
+    """Test the local equivalent of N2YO's /above/ search"""
+    catalog = SatelliteCatalog([ISS_ELEMENTS])
+    when = datetime(2024, 11, 30, 12, 0, tzinfo=timezone.utc)
+    state = catalog.propagate(when)
+    lat, lon = state["lat"][0], state["lon"][0]
+
+    # Directly below the ISS it is at the zenith
+    assert list(catalog.above(lat, lon, 5, when=when)) == [0]
+    # From the other side of the Earth it is below the horizon
+    assert list(catalog.above(-lat, lon + 180, 90, when=when)) == []
+
+
+def test_overhead_table_refresh():
+    """Test that the overhead table is computed for every country"""
+    catalog = SatelliteCatalog([ISS_ELEMENTS])
+    when = datetime(2024, 11, 30, 12, 0, tzinfo=timezone.utc)
+    state = catalog.propagate(when)
+    countries = [
+        {
+            "name": "BELOW",
+            "latitude": state["lat"][0],
+            "longitude": state["lon"][0],
+            "above_angle": 5.0,
+        },
+        {
+            "name": "OPPOSITE",
+            "latitude": -state["lat"][0],
+            "longitude": state["lon"][0] + 180,
+            "above_angle": 90.0,
+        },
+    ]
+    table = OverheadTable(lambda: catalog, lambda: countries)
+    assert table.get("BELOW") is None
+
+    table.refresh(when)
+
+    assert table.get("BELOW") == [{"id": 25544, "name": "ISS (ZARYA)"}]
+    assert table.get("OPPOSITE") == []
+    assert table.updated_at is not None
+
+
+@patch("blueprints.country.get_country_by_name")
+@patch("blueprints.country.overhead_table")
+def test_country_served_from_overhead_table(mock_table, mock_lookup, client):
+    """Test that a computed country is served without the database"""
+    mock_table.get.return_value = [{"id": 25544, "name": "ISS (ZARYA)"}]
+
+    response = client.get("/country/?country=USA")
+
+    assert response.status_code == 200
+    assert b"ISS (ZARYA)" in response.data
+    mock_lookup.assert_not_called()
+
+
+def test_subpoint_index_query():
+    """Test radius queries across the antimeridian and near a pole"""
+    lat = np.array([10.0, 10.0, -10.0, 89.0, 89.0, 0.0])
+    lon = np.array([179.5, -179.5, 179.0, 0.0, 180.0, 0.0])
+    index = SubpointIndex(lat, lon, np.arange(6))
+
+    assert sorted(index.query(10.0, 180.0, 1.0)) == [0, 1]
+    assert sorted(index.query(10.0, 180.0, 25.0)) == [0, 1, 2]
+    assert sorted(index.query(90.0, 0.0, 2.0)) == [3, 4]
+    assert list(index.query(0.0, 0.0, 0.5)) == [5]
+
+    # Rebuilding from the previous tick gives the same answers
+    moved = SubpointIndex(lat + 0.1, lon, np.arange(6), previous=index)
+    assert sorted(moved.query(10.0, 180.0, 1.0)) == [0, 1]
+
+
+@patch("blueprints.above.overhead_table")
+def test_above_route(mock_table, client):
+    """Test the arbitrary observer radius search"""
+    mock_table.near.return_value = [
+        {"id": 25544, "name": "ISS (ZARYA)", "lat": 1, "lon": 2, "alt": 420}
+    ]
+    response = client.get("/above?lat=51.5&lon=-0.1&radius_deg=10")
+
+    assert response.status_code == 200
+    assert response.get_json()[0]["name"] == "ISS (ZARYA)"
+    mock_table.near.assert_called_once_with(51.5, -0.1, 10.0)
+
+
+def test_above_route_requires_coordinates(client):
+    """Test that missing or invalid coordinates are rejected"""
+    assert client.get("/above?lat=51.5").status_code == 400
+    assert client.get("/above?lat=x&lon=0&radius_deg=1").status_code == 400
+    assert client.get("/above?lat=95&lon=0&radius_deg=1").status_code == 400
+    for lon in ("nan", "inf", "-inf", "1e300", "181"):
+        response = client.get(f"/above?lat=0&lon={lon}&radius_deg=1")
+        assert response.status_code == 400
+
+
+def test_pass_prediction_matches_ephem():
+    """Test local pass prediction against ephem's next_pass"""
+    start = datetime(2024, 11, 29, tzinfo=timezone.utc)
+    predictor = PassPredictor(satrec_from_elements(ISS_ELEMENTS), 51.5, -0.1)
+    first = predictor.passes(start.timestamp(), 86400)[0]
+
+    observer = ephem.Observer()
+    observer.lat, observer.lon = "51.5", "-0.1"
+    observer.pressure = 0
+    observer.date = start.strftime("%Y/%m/%d")
+    rise, _, peak, peak_el, end, _ = observer.next_pass(
+        ephem.readtle(*tle_from_elements(ISS_ELEMENTS))
+    )
+
+    def timestamp(date):
+        return date.datetime().replace(tzinfo=timezone.utc).timestamp()
+
+    assert first["startUTC"] == pytest.approx(timestamp(rise), abs=2)
+    assert first["maxUTC"] == pytest.approx(timestamp(peak), abs=5)
+    assert first["endUTC"] == pytest.approx(timestamp(end), abs=2)
+    assert first["maxEl"] == pytest.approx(math.degrees(peak_el), abs=0.1)
+
+
+def test_visual_passes_are_in_darkness():
+    """Test that visual passes only happen when the observer is dark"""
+    start = datetime(2024, 11, 29, tzinfo=timezone.utc).timestamp()
+    predictor = PassPredictor(satrec_from_elements(ISS_ELEMENTS), 51.5, -0.1)
+    all_passes = predictor.passes(start, 3 * 86400)
+    visual = predictor.visual_passes(start, 3 * 86400, min_visibility=60)
+
+    assert 0 < len(visual) < len(all_passes)
+    for info in visual:
+        hour = datetime.fromtimestamp(info["startUTC"], timezone.utc).hour
+        assert hour < 7 or hour >= 16  # London in late November
+        assert info["duration"] >= 60
+
+
+def test_pass_cache_shares_observer_cells():
+    """Test that nearby observers on the same day share cached passes"""
+    cache = PassCache(maxsize=1)
+    satrec = satrec_from_elements(ISS_ELEMENTS)
+    now = datetime(2024, 11, 29, 12, tzinfo=timezone.utc)
+
+    first = cache.visual_passes(25544, satrec, 51.51, -0.11, 2, now=now)
+    with patch("passes.PassPredictor") as mock_predictor:
+        second = cache.visual_passes(25544, satrec, 51.6, -0.2, 2, now=now)
+        mock_predictor.assert_not_called()
+    assert first == second
+
+    # A different cell evicts the only entry
+    cache.visual_passes(25544, satrec, 40.0, -74.0, 2, now=now)
+    assert len(cache.entries) == 1
+
+
+def test_orbit_timeline_matches_ephem():
+    """Test the local orbit timeline against ephem"""
+    start = datetime(2024, 11, 29, 17, 30, tzinfo=timezone.utc)
+    predictor = PassPredictor(satrec_from_elements(ISS_ELEMENTS), 51.5, -0.1)
+    timeline = predictor.timeline(start.timestamp(), 600, 60)
+
+    assert len(timeline) == 10
+    assert timeline[1]["timestamp"] - timeline[0]["timestamp"] == 60
+
+    observer = ephem.Observer()
+    observer.lat, observer.lon = "51.5", "-0.1"
+    observer.pressure = 0
+    observer.date = "2024/11/29 17:30:00"
+    sat = ephem.readtle(*tle_from_elements(ISS_ELEMENTS))
+    sat.compute(observer)
+
+    first = timeline[0]
+    assert first["azimuth"] == pytest.approx(math.degrees(sat.az), abs=0.05)
+    assert first["elevation"] == pytest.approx(
+        math.degrees(sat.alt), abs=0.05
+    )
+    assert first["ra"] == pytest.approx(math.degrees(sat.ra), abs=0.05)
+    assert first["dec"] == pytest.approx(math.degrees(sat.dec), abs=0.05)
+    assert first["eclipsed"] == bool(sat.eclipsed)
+
+
+def test_fetch_concurrently_runs_independent_tasks_in_parallel():
+    """Test that independent tasks overlap and dependencies are passed"""
+    # Each task waits for the other, so they only finish if they overlap
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(value):
+        barrier.wait()
+        return value
+
+    results, timings = fetch_concurrently(
+        {
+            "a": (lambda: meet(1), []),
+            "b": (lambda: meet(2), []),
+            "total": (lambda a, b: a + b, ["a", "b"]),
+        }
+    )
+
+    assert results == {"a": 1, "b": 2, "total": 3}
+    assert set(timings) == {"a", "b", "total"}
+
+
+@patch("blueprints.satellites.get_local_orbit")
+@patch("blueprints.satellites.get_local_passes")
+@patch("blueprints.satellites.generateSatData")
+@patch("blueprints.satellites.fetch_satellite_image")
+@patch("blueprints.satellites.get_local_tle_data")
+@patch("blueprints.satellites.get_observer_location")
+def test_satellite_page_reports_timings(
+    mock_location,
+    mock_tle,
+    mock_image,
+    mock_sat_data,
+    mock_passes,
+    mock_orbit,
+    client,
+):
+    """Test the satellite page fan-out and its Server-Timing header"""
+    mock_location.return_value = (51.5, -0.1)
+    mock_tle.return_value = {"tle": "", "info": {}}
+    mock_image.return_value = "http://example.com/hst.jpg"
+    mock_sat_data.return_value = {
+        "name": "HST",
+        "id": 20580,
+        "lat": "1:0:0",
+        "long": "2:0:0",
+    }
+    mock_passes.return_value = [{"startUTC": 1732901365}]
+    mock_orbit.return_value = {"positions": []}
+
+    response = client.get("/satellites/20580/HST")
+
+    assert response.status_code == 200
+    assert b"HST" in response.data
+    assert b"1732901365" in response.data
+    timing = response.headers["Server-Timing"]
+    for name in ["observer", "tle_data", "image_url", "satellite"]:
+        assert f"{name};dur=" in timing
+    mock_passes.assert_called_once_with(20580, 51.5, -0.1, 10, 300)
+
+
+@patch("blueprints.satellites.get_observer_location", return_value=None)
+def test_satellite_page_without_observer(mock_location, client):
+    """Test that a missing observer location fails the page"""
+    with patch("blueprints.satellites.fetch_tle_data"), patch(
+        "blueprints.satellites.fetch_satellite_image"
+    ), patch("blueprints.satellites.generateSatData"):
+        response = client.get("/satellites/20580/HST")
+    assert response.status_code == 500
+    assert b"Could not determine observer location" in response.data
+
+
+def test_upstream_client_defaults_and_metrics():
+    """Test that upstream calls get a timeout and are counted per host"""
+    upstream_client = UpstreamClient()
+    with patch.object(upstream_client.session, "get") as mock_get:
+        mock_get.return_value.status_code = 200
+        upstream_client.get("https://api.n2yo.com/rest/v1/satellite/tle/1")
+        mock_get.return_value.status_code = 503
+        upstream_client.get("https://api.n2yo.com/rest/v1/satellite/tle/2")
+        upstream_client.get("http://ip-api.com/json", timeout=1)
+
+    assert mock_get.call_args_list[0].kwargs["timeout"] == (3.05, 10)
+    assert mock_get.call_args_list[2].kwargs["timeout"] == 1
+    metrics = upstream_client.metrics()
+    assert metrics["api.n2yo.com"]["requests"] == 2
+    assert metrics["api.n2yo.com"]["failures"] == 1
+    assert metrics["ip-api.com"]["requests"] == 1
+
+
+def test_upstream_client_records_connection_errors():
+    """Test that failed connections are counted and re-raised"""
+    upstream_client = UpstreamClient()
+    with patch.object(
+        upstream_client.session,
+        "get",
+        side_effect=requests.ConnectionError("refused"),
+    ):
+        with pytest.raises(requests.ConnectionError):
+            upstream_client.get("https://www.googleapis.com/customsearch/v1")
+
+    assert upstream_client.metrics()["www.googleapis.com"]["failures"] == 1
+
+
+def test_metrics_route(client):
+    """Test that the metrics endpoint reports upstream metrics"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    metrics = response.get_json()
+    assert "upstream" in metrics
+    assert set(metrics["caches"]) == {"tle", "orbit", "passes", "accounts"}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Test LRU eviction and the hit/miss counters"""
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+
+def test_ttl_cache_expires_entries():
+    """Test that entries expire and get_or_set reloads them"""
+    cache = TTLCache(ttl=60)
+    load = MagicMock(return_value={"tle": "x"})
+    with patch("cache.time.time", return_value=1000.0):
+        cache.get_or_set(25544, load)
+        cache.get_or_set(25544, load)
+    assert load.call_count == 1
+    with patch("cache.time.time", return_value=1061.0):
+        cache.get_or_set(25544, load)
+    assert load.call_count == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_ttl_cache_persists_entries(tmp_path):
+    """Test that a persisted cache is reloaded on start-up"""
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(path=path)
+    cache.set((25544, 51.25, -0.25), {"positions": []})
+    cache.set("expired", 1, ttl=-1)
+
+    reloaded = TTLCache(path=path)
+    assert reloaded.get((25544, 51.25, -0.25)) == {"positions": []}
+    assert len(reloaded) == 1
+
+
+def test_tle_cache_ttl_follows_epoch():
+    """Test that TLE data is cached until a new element set is due"""
+    line1, _ = tle_from_elements(ISS_ELEMENTS)[1:]
+    tle_data = {"tle": line1 + "\r\n"}
+    epoch = datetime.fromisoformat(ISS_ELEMENTS["epoch"]).replace(
+        tzinfo=timezone.utc
+    )
+    now = epoch.timestamp() + 10 * 3600
+
+    assert abs(tle_cache_ttl(tle_data, now) - 2 * 3600) < 1
+    assert tle_cache_ttl(tle_data, now + 86400) == 15 * 60
+    assert tle_cache_ttl(tle_data, now - 86400) == 6 * 3600
+    assert tle_cache_ttl({"tle": ""}) == 15 * 60
+
+
+@patch("blueprints.satellites.get_local_tle_data")
+def test_tle_data_is_cached(mock_tle):
+    """Test that repeat TLE lookups for a satellite hit the cache"""
+    from blueprints.satellites import fetch_tle_data
+
+    mock_tle.return_value = {"info": {"satid": 25544}, "tle": ""}
+    assert fetch_tle_data(25544) == fetch_tle_data(25544)
+    mock_tle.assert_called_once_with(25544)
+    assert tle_cache.stats()["hits"] >= 1
+
+
+@patch("os.getenv")
+@patch("upstream.get")
+def test_fetch_satellite_image_is_stored(
+    mock_requests_get, mock_getenv, image_store
+):
+    """Test that searched images, and searches without a result, are
+    stored and served again without calling the search API"""
+    mock_getenv.side_effect = lambda key: "test"
+    mock_requests_get.side_effect = [
+        MagicMock(json=lambda: {"items": [{"link": "http://a.com/1.jpg"}]}),
+        MagicMock(json=lambda: {"items": []}),
+    ]
+
+    assert fetch_satellite_image("Sat One") == "http://a.com/1.jpg"
+    fallback = fetch_satellite_image("Sat Two")
+    assert fallback.endswith("AdobeStock_580430822.jpeg")
+
+    # Served from memory, then from the store after a restart
+    assert fetch_satellite_image("SAT ONE") == "http://a.com/1.jpg"
+    image_cache.clear()
+    assert fetch_satellite_image("Sat One") == "http://a.com/1.jpg"
+    assert fetch_satellite_image("Sat Two") == fallback
+    assert mock_requests_get.call_count == 2
+
+
+@patch("blueprints.utils.fetch_satellite_image")
+def test_prewarm_images(mock_fetch, image_store, sample_csv):
+    """Test that pre-warming only looks up names without a fresh image"""
+    read_and_insert_csv(sample_csv, image_store)
+    save_satellite_image("ISS (ZARYA)", "http://a.com/iss.jpg", True,
+                         time.time(), image_store)
+
+    assert prewarm_images() == 1
+    mock_fetch.assert_called_once_with("STARLINK-1")
+
+
+def test_reverse_geocoder_batch():
+    """Test batched country lookups, including the ocean fallback"""
+    locations = get_geocoder().locate_many(
+        [51.5, 40.7, 0.0, -33.9, 10.0], [-0.1, -74.0, -30.0, 151.2, 190.0]
+    )
+    assert locations == [
+        "United Kingdom",
+        "United States",  # just off the simplified coastline
+        OCEAN,
+        "Australia",
+        OCEAN,
+    ]
+
+
+@patch("upstream.get")
+def test_generateSatData_locates_offline(mock_get):
+    """Test that the subpoint is named without calling an upstream API"""
+    tle = tle_from_elements(ISS_ELEMENTS)
+    satellite_data = {
+        "tle": f"{tle[1]}\r\n{tle[2]}",
+        "info": {"satname": "ISS (ZARYA)", "satid": 25544},
+    }
+    with patch("ephem.now", return_value=ephem.Date("2024/11/29 00:00")):
+        result = generateSatData(None, satellite_data)
+
+    expected = getlocation(
+        math.degrees(result["lat"]), math.degrees(result["long"])
+    )
+    assert result["location"] == expected
+    mock_get.assert_not_called()
+
+
+@patch("blueprints.satellites.get_local_orbit")
+@patch("blueprints.satellites.get_local_passes", return_value=[])
+@patch("blueprints.satellites.generateSatData")
+@patch("blueprints.satellites.fetch_satellite_image")
+@patch("blueprints.satellites.get_local_tle_data")
+@patch("blueprints.satellites.get_observer_location")
+def test_satellite_page_uses_explicit_observer(
+    mock_location,
+    mock_tle,
+    mock_image,
+    mock_sat_data,
+    mock_passes,
+    mock_orbit,
+    client,
+):
+    """Test that given coordinates are used and remembered in a cookie"""
+    mock_tle.return_value = {"tle": "", "info": {}}
+    mock_sat_data.return_value = {"name": "HST", "lat": "0", "long": "0"}
+    mock_orbit.return_value = {"positions": []}
+
+    response = client.get("/satellites/20580/HST?lat=10&lon=20")
+    assert response.status_code == 200
+    assert "observer=10.0:20.0" in response.headers["Set-Cookie"]
+    mock_passes.assert_called_once_with(20580, 10.0, 20.0, 10, 300)
+
+    # The cookie is used on the next page
+    client.get("/satellites/20580/HST")
+    assert mock_passes.call_args.args[1:3] == (10.0, 20.0)
+    mock_location.assert_not_called()
+
+
+@patch("blueprints.satellites.get_local_orbit")
+@patch("blueprints.satellites.get_local_passes", return_value=[])
+@patch("blueprints.satellites.generateSatData")
+@patch("blueprints.satellites.fetch_satellite_image")
+@patch("blueprints.satellites.get_local_tle_data")
+@patch("blueprints.satellites.get_observer_location")
+def test_satellite_page_ignores_forwarded_for(
+    mock_location,
+    mock_tle,
+    mock_image,
+    mock_sat_data,
+    mock_passes,
+    mock_orbit,
+    client,
+):
+    """Test that a client can't choose its IP with X-Forwarded-For"""
+    mock_location.return_value = (10.0, 20.0)
+    mock_tle.return_value = {"tle": "", "info": {}}
+    mock_sat_data.return_value = {"name": "HST", "lat": "0", "long": "0"}
+    mock_orbit.return_value = {"positions": []}
+
+    response = client.get(
+        "/satellites/20580/HST",
+        headers={"X-Forwarded-For": "81.2.69.160"},
+        environ_base={"REMOTE_ADDR": "203.0.113.7"},
+    )
+    assert response.status_code == 200
+    mock_location.assert_called_once_with("203.0.113.7")
+
+
+@patch("upstream.get")
+def test_observer_location_is_cached_per_client(mock_get):
+    """Test that each client IP is looked up once, and private addresses
+    fall back to the server's location"""
+    mock_get.return_value.json.return_value = {
+        "status": "success",
+        "lat": 51.5,
+        "lon": -0.1,
+    }
+
+    assert get_observer_location("81.2.69.160") == (51.5, -0.1)
+    assert get_observer_location("81.2.69.160") == (51.5, -0.1)
+    get_observer_location("192.168.0.10")
+
+    urls = [call.args[0] for call in mock_get.call_args_list]
+    assert urls == [
+        "http://ip-api.com/json/81.2.69.160",
+        "http://ip-api.com/json",
+    ]
+
+
+def test_search_index_ranks_and_stays_in_sync(tmp_path):
+    """Test the trigram name search ordering and its sync triggers"""
+    database = str(tmp_path / "search.db")
+    init_db(f"sqlite:///{database}")
+    engine = get_engine(f"sqlite:///{database}")
+    csv_path = tmp_path / "search.csv"
+    pl.DataFrame(
+        {
+            "NORAD_CAT_ID": [1, 2, 3, 4],
+            "OBJECT_NAME": ["COSMOS 2251", "AISSAT 1", "ISS (ZARYA)", "ISS"],
+        }
+    ).write_csv(csv_path)
+    read_and_insert_csv(csv_path, engine)
+
+    names = [row[1] for row in find_satellites_by_name("iss", engine)]
+    assert names == ["ISS", "ISS (ZARYA)", "AISSAT 1"]
+    assert find_satellites_by_name("os", engine)[0][1] == "COSMOS 2251"
+
+    with engine.begin() as connection:
+        connection.execute(
+            get_satellite_table.update()
+            .where(get_satellite_table.c.id == 4)
+            .values(name="TIANGONG")
+        )
+        connection.execute(
+            get_satellite_table.delete().where(get_satellite_table.c.id == 2)
+        )
+    names = [row[1] for row in find_satellites_by_name("iss", engine)]
+    assert names == ["ISS (ZARYA)"]
+    assert find_satellites_by_name("tiangong", engine)[0][0] == 4
+
+
+def test_pooled_engines_are_tuned_and_shared(tmp_path):
+    """Test the engine pools, their pragmas and the read-only pool"""
+    url = f"sqlite:///{tmp_path / 'pool.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    assert get_engine(url) is engine
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == (
+            "wal"
+        )
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+
+    read_engine = get_engine(url, read_only=True)
+    assert read_engine is not engine
+    with read_engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("DELETE FROM satellite"))
+
+
+def test_autocomplete_ranking():
+    """Test prefix, substring and id matches and their ordering"""
+    rows = [
+        (25544, "ISS (ZARYA)"),
+        (40075, "AISSAT 2"),
+        (36797, "AISSAT 1"),
+        (49044, "ISS (NAUKA)"),
+        (20580, "HST"),
+    ]
+    index = Autocomplete(rows, lambda row: [row[1], row[0]])
+
+    names = [row[1] for row in index.search("iss")]
+    assert names == ["ISS (NAUKA)", "ISS (ZARYA)", "AISSAT 1", "AISSAT 2"]
+    assert index.search("ss", limit=1) == [[36797, "AISSAT 1"]]
+    assert index.search("2058") == [[20580, "HST"]]
+    assert index.search("zzz") == [] and index.search(" ") == []
+
+
+@patch("blueprints.search.get_autocomplete")
+def test_search_routes_use_autocomplete(mock_autocomplete, client):
+    """Test the autocomplete routes keep their JSON row shape"""
+    satellites = Autocomplete([(20580, "HST")], lambda row: [row[1]])
+    countries = Autocomplete(
+        [("GB", 55.4, -3.4, "UNITED KINGDOM", 94525.0, 20.0)],
+        lambda row: [row[3], row[0]],
+    )
+    mock_autocomplete.return_value = (satellites, countries)
+
+    assert client.get("/search?query=hs").get_json() == [[20580, "HST"]]
+    response = client.get("/country_search?query=gb").get_json()
+    assert response[0][3] == "UNITED KINGDOM"
+    assert client.get("/search").get_json() == []
+
+
+@patch("blueprints.utils.fetch_pool")
+def test_warm_autocomplete_queues_one_build(mock_pool):
+    """Test that requests arriving before the build share one build"""
+    mock_pool.submit.return_value.done.return_value = False
+    with patch("blueprints.utils._autocomplete", None), patch(
+        "blueprints.utils._autocomplete_warming", None
+    ):
+        for _ in range(3):
+            blueprint_utils.warm_autocomplete()
+        assert mock_pool.submit.call_count == 1
+
+        # A failed build is retried by the next request
+        mock_pool.submit.return_value.done.return_value = True
+        blueprint_utils.warm_autocomplete()
+        assert mock_pool.submit.call_count == 2
+
+
+def test_search_returns_id_name_pairs(tmp_path, client):
+    """Test /search serves [id, name] pairs, not full satellite rows"""
+    url = f"sqlite:///{tmp_path / 'autocomplete.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    read_and_insert_csv(
+        element_csv(
+            tmp_path / "hst.csv", [(20580, "HST", "2024-12-01T00:00:00", 1)]
+        ),
+        engine,
+    )
+    satellites = satellite_autocomplete(engine)
+    with patch(
+        "blueprints.search.get_autocomplete", return_value=(satellites, None)
+    ):
+        assert client.get("/search?query=hst").get_json() == [[20580, "HST"]]
+
+
+def test_ingestion_invalidates_autocomplete(engine, tmp_path):
+    """Test that ingesting satellites drops the built autocompletes"""
+    csv_path = tmp_path / "new.csv"
+    pl.DataFrame(
+        {"NORAD_CAT_ID": [20580], "OBJECT_NAME": ["HST"]}
+    ).write_csv(csv_path)
+    with patch("blueprints.utils._autocomplete", ("built", "built")):
+        read_and_insert_csv(csv_path, engine)
+        assert blueprint_utils._autocomplete is None
+
+
+def test_ingestion_invalidates_catalog(tmp_path):
+    """Test that ingesting satellites drops the loaded catalog"""
+    url = f"sqlite:///{tmp_path / 'catalog.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    csv_path = tmp_path / "new.csv"
+    pl.DataFrame(
+        {"NORAD_CAT_ID": [20580], "OBJECT_NAME": ["HST"]}
+    ).write_csv(csv_path)
+    with patch("blueprints.utils._catalog", "loaded"):
+        read_and_insert_csv(csv_path, engine)
+        assert blueprint_utils._catalog is None
+
+
+@patch("blueprints.utils.SatelliteCatalog.from_engine")
+@patch("blueprints.utils.catalog_version")
+def test_catalog_reloads_when_version_changes(mock_version, mock_load):
+    """Test the catalog is reloaded after another process ingests"""
+    mock_load.side_effect = ["first", "second"]
+    mock_version.return_value = 1
+    with patch("blueprints.utils._catalog", None):
+        assert blueprint_utils.get_catalog() == "first"
+        assert blueprint_utils.get_catalog() == "first"
+        mock_version.return_value = 2
+        assert blueprint_utils.get_catalog() == "second"
+
+
+def test_search_satellites_ranks_filters_and_pages(tmp_path):
+    """Test the ranked search API query, its filters and keyset pages"""
+    database = str(tmp_path / "search.db")
+    init_db(f"sqlite:///{database}")
+    engine = get_engine(f"sqlite:///{database}")
+    csv_path = tmp_path / "weather1.csv"
+    pl.DataFrame(
+        {
+            "NORAD_CAT_ID": [1, 2, 3, 4, 5],
+            "OBJECT_NAME": ["NOAA 15", "NOAA", "GOES 16", "NOAA, 2", "NOAA"],
+            "MEAN_MOTION": [14.26, 14.1, 1.0027, 14.2, 14.3],
+            "ECCENTRICITY": [0.001, 0.001, 0.0001, 0.001, 0.001],
+        }
+    ).write_csv(csv_path)
+    read_and_insert_csv(csv_path, engine, group="weather")
+
+    results, next_after = search_satellites("noaa", engine=engine)
+    assert [r["id"] for r in results] == [2, 5, 1, 4]
+    assert results[0] == {
+        "id": 2,
+        "name": "NOAA",
+        "orbit_class": "LEO",
+        "groups": ["weather"],
+    }
+    assert next_after is None
+
+    geo, _ = search_satellites(orbit_class="GEO", engine=engine)
+    assert [r["name"] for r in geo] == ["GOES 16"]
+    assert search_satellites(group="starlink", engine=engine)[0] == []
+
+    # Paging one at a time visits every match once, in order
+    pages, after = [], None
+    while True:
+        page, after = search_satellites(
+            "noaa", after=after, limit=1, engine=engine
+        )
+        pages += page
+        if after is None:
+            break
+    assert [r["id"] for r in pages] == [2, 5, 1, 4]
+
+
+def test_search_api_validates_and_returns_cursor(client):
+    """Test the search API parameters and its next page cursor"""
+    with patch("blueprints.search.search_satellites") as mock_search:
+        mock_search.return_value = (
+            [{"id": 4, "name": "NOAA, 2"}],
+            ("NOAA, 2", 4),
+        )
+        response = client.get("/api/satellites?q=noaa&after=NOAA, 1,3")
+        assert response.get_json()["next"] == "NOAA, 2,4"
+        assert mock_search.call_args.kwargs["after"] == ("NOAA, 1", 3)
+
+    assert client.get("/api/satellites?orbit_class=XEO").status_code == 400
+    assert client.get("/api/satellites?limit=0").status_code == 400
+    assert client.get("/api/countries?after=nocomma").status_code == 400
+
+
+def test_ingestion_bumps_catalog_version(tmp_path, sample_csv):
+    """Test that ingestions changing the catalog increment its version"""
+    database = str(tmp_path / "version.db")
+    init_db(f"sqlite:///{database}")
+    engine = get_engine(f"sqlite:///{database}")
+    assert get_catalog_version(engine) == 0
+
+    read_and_insert_csv(sample_csv, engine)
+    read_and_insert_csv(sample_csv, engine)
+    assert get_catalog_version(engine) == 1
+    read_and_insert_csv(sample_csv, engine, group="stations")
+    assert get_catalog_version(engine) == 2
+
+
+@patch("blueprints.search.get_autocomplete")
+@patch("blueprints.utils.catalog_version", return_value=7)
+def test_search_revalidates_with_catalog_etag(
+    mock_version, mock_autocomplete, client
+):
+    """Test ETag, Cache-Control and 304 handling of the search routes"""
+    satellites = Autocomplete([(20580, "HST")], lambda row: [row[1]])
+    mock_autocomplete.return_value = (satellites, None)
+
+    response = client.get("/search?query=hst")
+    assert response.headers["ETag"] == '"catalog-7"'
+    assert "max-age=" in response.headers["Cache-Control"]
+
+    headers = {"If-None-Match": '"catalog-7"'}
+    response = client.get("/search?query=hst", headers=headers)
+    assert response.status_code == 304 and response.data == b""
+    assert mock_autocomplete.call_count == 1
+
+    # A new ingestion changes the version and the response is rebuilt
+    mock_version.return_value = 8
+    response = client.get("/search?query=hst", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"catalog-8"'
+
+
+@pytest.fixture
+def account_engine(tmp_path, sample_csv):
+    """Engine of a temporary database with one user and two satellites"""
+    url = f"sqlite:///{tmp_path / 'accounts.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    read_and_insert_csv(sample_csv, engine, group="stations")
+    with engine.begin() as connection:
+        connection.execute(get_user_table.insert().values(user_name="ada"))
+        connection.execute(
+            get_country_table.insert().values(country="FR", name="FRANCE")
+        )
+    return engine
+
+
+def test_account_mutations_return_updated_lists(account_engine):
+    """Test that tracking changes return the lists they leave behind"""
+    tracked = add_satellite_to_user("ada", "ISS (ZARYA)", account_engine)
+    assert tracked == ([{"id": 25544, "name": "ISS (ZARYA)"}], None)
+    tracked, _ = add_satellite_to_user("ada", "STARLINK-1", account_engine)
+    assert len(tracked) == 2
+    assert add_country_to_user("ada", "FRANCE", account_engine) == [
+        {"name": "FRANCE"}
+    ]
+
+    tracked = delete_satellite_from_user("ada", "STARLINK-1", account_engine)
+    assert tracked == ([{"id": 25544, "name": "ISS (ZARYA)"}], None)
+    assert delete_country_from_user("ada", "FRANCE", account_engine) == []
+
+
+def test_account_mutations_keep_error_messages(account_engine):
+    """Test the errors reported when a tracking change does nothing"""
+    add_satellite_to_user("ada", "ISS (ZARYA)", account_engine)
+    add_country_to_user("ada", "FRANCE", account_engine)
+
+    cases = [
+        (("bob", "ISS (ZARYA)"), "User 'bob' not found"),
+        (("ada", "HST"), "Satellite not found"),
+        (("ada", "ISS (ZARYA)"), "Satellite already tracked by user"),
+    ]
+    for args, message in cases:
+        with pytest.raises(ValueError, match=message):
+            add_satellite_to_user(*args, engine=account_engine)
+    with pytest.raises(ValueError, match="Country already tracked by user"):
+        add_country_to_user("ada", "FRANCE", account_engine)
+
+    # Deletions report the error and change nothing
+    assert delete_satellite_from_user("ada", "HST", account_engine) is None
+    assert delete_satellite_from_user("bob", "ISS", account_engine) is None
+    assert delete_country_from_user("ada", "SPAIN", account_engine) is None
+
+
+def test_account_view_is_one_query(account_engine):
+    """Test the joined account view, its users and empty lists"""
+    add_satellite_to_user("ada", "ISS (ZARYA)", account_engine)
+    add_country_to_user("ada", "FRANCE", account_engine)
+
+    assert get_account("ADA", account_engine) == {
+        "user_name": "ada",
+        "satellites": [{"id": 25544, "name": "ISS (ZARYA)"}],
+        "next": None,
+        "groups": [],
+        "countries": [{"name": "FRANCE"}],
+    }
+    delete_satellite_from_user("ada", "ISS (ZARYA)", account_engine)
+    assert get_account("ada", account_engine)["satellites"] == []
+    assert get_account("bob", account_engine) is None
+
+
+@patch("blueprints.account.add_satellite_to_user")
+@patch("blueprints.utils.get_account")
+def test_account_page_served_from_cache(mock_account, mock_add, client):
+    """Test repeat account page loads and invalidation on changes"""
+    mock_account.return_value = {
+        "user_name": "ada",
+        "satellites": [{"id": 20580, "name": "HST"}],
+        "next": None,
+        "groups": [],
+        "countries": [],
+    }
+    assert b"HST" in client.get("/account/ada").data
+    assert b"HST" in client.get("/account/ADA").data
+    assert mock_account.call_count == 1
+
+    mock_add.return_value = (
+        [{"id": 20580, "name": "HST"}, {"id": 25544, "name": "ISS (ZARYA)"}],
+        None,
+    )
+    response = client.post(
+        "/add_satellite", json={"username": "ada", "satellite_name": "ISS"}
+    )
+    assert response.status_code == 200
+    mock_account.return_value = dict(
+        mock_account.return_value, satellites=mock_add.return_value[0]
+    )
+    assert b"ISS (ZARYA)" in client.get("/account/ada").data
+    assert mock_account.call_count == 2
+
+
+def test_cache_drops_loads_racing_an_invalidation():
+    """Test a value loaded before an invalidation is not cached"""
+    cache = TTLCache()
+
+    def load():
+        cache.invalidate("key")  # a write lands while loading
+        return "stale"
+
+    assert cache.get_or_set("key", load) == "stale"
+    assert cache.get("key") is None
+    assert cache.get_or_set("key", lambda: "fresh") == "fresh"
+    assert cache.get("key") == "fresh"
+
+
+def test_bulk_tracking_by_name_and_id(account_engine):
+    """Test bulk tracking in one call, skipping unknown and repeats"""
+    added, (tracked, _) = track_satellites(
+        "ada", ["ISS (ZARYA)", 43205, "UNKNOWN", "43205"], account_engine
+    )
+    assert added == 2
+    assert [s["id"] for s in tracked] == [25544, 43205]
+    assert track_satellites("ada", ["ISS (ZARYA)"], account_engine)[0] == 0
+
+    removed, (tracked, _) = untrack_satellites(
+        "ada", ["25544", "UNKNOWN"], account_engine
+    )
+    assert removed == 1 and tracked == [{"id": 43205, "name": "STARLINK-1"}]
+    with pytest.raises(ValueError, match="User 'bob' not found"):
+        track_satellites("bob", ["ISS (ZARYA)"], account_engine)
+
+    # Empty lists change nothing, ids beyond SQLite's range are rejected
+    assert track_satellites("ada", [], account_engine)[0] == 0
+    removed, (tracked, _) = untrack_satellites("ada", [], account_engine)
+    assert removed == 0 and len(tracked) == 1
+    with pytest.raises(ValueError, match="Invalid NORAD id"):
+        track_satellites("ada", ["9" * 20], account_engine)
+
+
+def test_group_tracking_expands_lazily_and_pages(account_engine, tmp_path):
+    """Test that a tracked group follows ingestion and pages by name"""
+    track_group("ada", "stations", account_engine)
+    assert get_account("ada", account_engine)["groups"] == ["stations"]
+    with pytest.raises(ValueError, match="Group already tracked by user"):
+        track_group("ada", "stations", account_engine)
+    with pytest.raises(ValueError, match="Group not found"):
+        track_group("ada", "gps", account_engine)
+
+    # Satellites ingested into the group later are tracked too
+    csv_path = tmp_path / "stations.csv"
+    pl.DataFrame(
+        {"NORAD_CAT_ID": [48274], "OBJECT_NAME": ["CSS (TIANHE)"]}
+    ).write_csv(csv_path)
+    read_and_insert_csv(csv_path, account_engine, group="stations")
+
+    pages, after = [], None
+    while True:
+        page, after = get_tracked_satellites(
+            "ada", after=after, limit=2, engine=account_engine
+        )
+        pages.append([s["name"] for s in page])
+        if after is None:
+            break
+    assert pages == [["CSS (TIANHE)", "ISS (ZARYA)"], ["STARLINK-1"]]
+
+    tracked, _ = untrack_group("ada", "stations", account_engine)
+    assert tracked == []
+
+
+def test_bulk_tracking_routes_validate(client):
+    """Test the bulk and group tracking routes and their responses"""
+    with patch("blueprints.account.track_satellites") as mock_track:
+        mock_track.return_value = (1, ([{"id": 1, "name": "A"}], ("A", 1)))
+        response = client.post(
+            "/add_satellites", json={"username": "ada", "satellites": ["A"]}
+        )
+        assert response.get_json() == {
+            "changed": 1,
+            "results": [{"id": 1, "name": "A"}],
+            "next": "A,1",
+        }
+
+    assert client.post("/add_satellites", json={}).status_code == 400
+    response = client.post(
+        "/delete_satellites", json={"username": "ada", "satellites": "A"}
+    )
+    assert response.status_code == 400
+    assert client.post("/add_group", json={"username": "a"}).status_code == (
+        400
+    )
+
+
+def test_migrations_bring_old_databases_up_to_date(tmp_path):
+    """Test that migrations bring a baseline database to the schema of a
+    new one, once"""
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = get_engine(url)
+    with engine.begin() as connection:
+        for statement in [
+            "CREATE TABLE satellite (id INTEGER PRIMARY KEY, name TEXT)",
+            "CREATE TABLE country (country VARCHAR PRIMARY KEY, "
+            "latitude FLOAT, longitude FLOAT, name VARCHAR, area FLOAT, "
+            "above_angle FLOAT)",
+            "CREATE TABLE user (id INTEGER PRIMARY KEY, "
+            "user_name VARCHAR NOT NULL UNIQUE)",
+        ]:
+            connection.execute(text(statement))
+    init_db(url)
+    new_url = f"sqlite:///{tmp_path / 'new.db'}"
+    init_db(new_url)
+
+    def schema(engine):
+        inspector = inspect(engine)
+        with engine.connect() as connection:
+            indexes = set(
+                connection.exec_driver_sql(
+                    "SELECT tbl_name, name FROM sqlite_master "
+                    "WHERE type = 'index' AND name LIKE 'ix_%'"
+                )
+            )
+        columns = {
+            table: {c["name"] for c in inspector.get_columns(table)}
+            for table in ("satellite", "country", "user", "satellite_group")
+        }
+        return columns, indexes
+
+    assert schema(engine) == schema(get_engine(new_url))
+    with engine.connect() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+    assert version == len(MIGRATIONS)
+    assert migrate(engine) == len(MIGRATIONS)
+
+
+# Tables that hot lookups must reach through an index
+HOT_TABLES = {
+    "satellite", "s", "country", "c", "user", "satellite_group", "g",
+    "user_satellite", "user_country", "uc", "user_group", "ug",
+}
+
+
+def test_hot_queries_use_indexes(account_engine):
+    """Test with EXPLAIN QUERY PLAN that no lookup scans a table"""
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters[0] if many else parameters))
+
+    event.listen(account_engine, "before_cursor_execute", record)
+    try:
+        get_satellite_id_by_name("ISS (ZARYA)", account_engine)
+        assert get_satellite_by_id("25544", account_engine) == 25544
+        get_country_by_name("FRANCE", account_engine)
+        track_satellites("ada", ["ISS (ZARYA)", "43205"], account_engine)
+        track_group("ada", "stations", account_engine)
+        get_account("ADA", account_engine)
+        get_tracked_satellites("ada", ("ISS", 1), engine=account_engine)
+        delete_satellite_from_user("ada", "ISS (ZARYA)", account_engine)
+        with patch("database.Session", account_engine.connect):
+            assert check_username_exists("ADA")["user_name"] == "ada"
+    finally:
+        event.remove(account_engine, "before_cursor_execute", record)
+
+    scans = []
+    with account_engine.connect() as connection:
+        for statement, parameters in statements:
+            if statement.lstrip().upper().startswith("PRAGMA"):
+                continue
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            )
+            scans += [
+                (detail, statement)
+                for *_, detail in plan
+                if detail.startswith("SCAN ")
+                and detail.split()[1] in HOT_TABLES
+            ]
+    assert scans == []
+
+
+def element_csv(path, rows):
+    """Writes a catalog csv of (id, name, epoch, element_set_no) rows"""
+    ids, names, epochs, set_numbers = zip(*rows)
+    pl.DataFrame(
+        {
+            "NORAD_CAT_ID": ids,
+            "OBJECT_NAME": names,
+            "EPOCH": epochs,
+            "MEAN_MOTION": [15.5] * len(rows),
+            "ELEMENT_SET_NO": set_numbers,
+        }
+    ).write_csv(path)
+    return str(path)
+
+
+def test_refresh_writes_only_newer_element_sets(tmp_path):
+    """Test manifest skips, cross-file dedupe and newer-only upserts"""
+    url = f"sqlite:///{tmp_path / 'refresh.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    active = element_csv(
+        tmp_path / "active1.csv",
+        [(1, "A", "2024-12-01T00:00:00", 10), (2, "B", "2024-12-01", 5)],
+    )
+    # The group file has a newer set for 1 and an older one for 2
+    starlink = element_csv(
+        tmp_path / "starlink1.csv",
+        [(1, "A", "2024-12-02T00:00:00", 11), (2, "B", "2024-11-30", 4)],
+    )
+
+    summary = process_multiple_csv([active, starlink], engine)
+    assert summary == {"files": 2, "skipped": 0, "written": 2}
+    with engine.connect() as connection:
+        rows = dict(
+            connection.execute(
+                select(
+                    get_satellite_table.c.id,
+                    get_satellite_table.c.element_set_no,
+                )
+            ).all()
+        )
+    assert rows == {1: 11, 2: 5}
+    assert search_satellites(group="starlink", engine=engine)[0]
+
+    # Unchanged files are skipped, and a forced refresh writes nothing
+    assert process_multiple_csv([active, starlink], engine)["skipped"] == 2
+    summary = process_multiple_csv([active, starlink], engine, force=True)
+    assert summary["written"] == 0
+
+    # Only the satellite with a newer element set is written
+    element_csv(
+        tmp_path / "active1.csv",
+        [(1, "A", "2024-12-01T00:00:00", 10), (2, "B", "2024-12-03", 6)],
+    )
+    summary = process_multiple_csv([active, starlink], engine)
+    assert summary == {"files": 1, "skipped": 1, "written": 1}
+
+
+def test_parallel_refresh_matches_serial_refresh(tmp_path):
+    """Test files parsed by a worker pool are written like serial ones"""
+    files = [
+        element_csv(
+            tmp_path / f"group{n}.csv",
+            [
+                (i, f"SAT {i}", f"2024-12-0{n}T00:00:00", n)
+                for i in range(n, 40, n)
+            ],
+        )
+        for n in range(1, 5)
+    ]
+    assert pool_size(files, workers=4) == 1  # too small to be worth it
+    tables = []
+    for workers in (1, 2):
+        url = f"sqlite:///{tmp_path / f'parallel{workers}.db'}"
+        init_db(url)
+        engine = get_engine(url)
+        with patch("catalog_feed.PARALLEL_BYTES_PER_WORKER", 1):
+            assert pool_size(files, workers) == workers
+            summary = process_multiple_csv(files, engine, workers=workers)
+        assert summary == {"files": 4, "skipped": 0, "written": 39}
+        with engine.connect() as connection:
+            tables.append(
+                connection.execute(
+                    select(
+                        get_satellite_table.c.id,
+                        get_satellite_table.c.element_set_no,
+                    ).order_by(get_satellite_table.c.id)
+                ).all()
+            )
+    assert tables[0] == tables[1]
+    # Each satellite keeps the set from the latest file listing it
+    assert dict(tables[0])[12] == 4 and dict(tables[0])[35] == 1
+
+
+OMM_XML = """<?xml version="1.0"?>
+<ndm xmlns="urn:ccsds:schema:ndmxml">{}</ndm>"""
+OMM_SEGMENT = (
+    "<omm><body><segment><metadata><OBJECT_NAME>{1}</OBJECT_NAME>"
+    "</metadata><data><meanElements><EPOCH>{2}</EPOCH>"
+    "<MEAN_MOTION>15.5</MEAN_MOTION></meanElements><tleParameters>"
+    "<NORAD_CAT_ID>{0}</NORAD_CAT_ID><ELEMENT_SET_NO>{3}</ELEMENT_SET_NO>"
+    "</tleParameters></data></segment></body></omm>"
+)
+
+
+def test_catalog_feeds_are_read_in_chunks(tmp_path):
+    """Test every feed format yields the same typed rows in chunks"""
+    rows = [(i, f"SAT {i}", "2024-12-01T00:00:00", i) for i in range(1, 8)]
+    csv_path = element_csv(tmp_path / "feed.csv", rows)
+    with open(csv_path, "rb") as file, gzip.open(
+        tmp_path / "feed.csv.gz", "wb"
+    ) as compressed:
+        compressed.write(file.read())
+    records = [
+        {
+            "NORAD_CAT_ID": i,
+            "OBJECT_NAME": name,
+            "EPOCH": epoch,
+            "MEAN_MOTION": 15.5,
+            "ELEMENT_SET_NO": set_no,
+        }
+        for i, name, epoch, set_no in rows
+    ]
+    with gzip.open(tmp_path / "feed.json.gz", "wt") as file:
+        json.dump(records, file, indent=1)
+    (tmp_path / "feed.xml").write_text(
+        OMM_XML.format("".join(OMM_SEGMENT.format(*row) for row in rows))
+    )
+
+    expected = pl.DataFrame(records).select(sorted(records[0]))
+    for name in ("feed.csv", "feed.csv.gz", "feed.json.gz", "feed.xml"):
+        chunks = list(iter_chunks(str(tmp_path / name), chunk_rows=3))
+        assert [chunk.height for chunk in chunks] == [3, 3, 1]
+        df = pl.concat(chunks)
+        assert df.select(sorted(df.columns)).equals(expected), name
+
+    with pytest.raises(ValueError):
+        list(iter_chunks(str(tmp_path / "feed.txt")))
+
+
+def test_xml_feed_memory_does_not_grow_with_size(tmp_path):
+    """Test read <omm> elements are released while parsing XML"""
+
+    def peak_memory(count):
+        path = tmp_path / f"feed{count}.xml"
+        row = (1, "SAT", "2024-12-01T00:00:00", 1)
+        path.write_text(OMM_XML.format(OMM_SEGMENT.format(*row) * count))
+        tracemalloc.start()
+        try:
+            for _ in iter_chunks(str(path), chunk_rows=100):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert peak_memory(10000) < 2 * peak_memory(1000)
+
+
+def test_csv_feed_columns_use_omm_types(tmp_path):
+    """Test integer-looking leading values don't fix a column's type"""
+    path = tmp_path / "feed.csv"
+    bstar = ["0"] * 200 + ["-.115E-5"]
+    pl.DataFrame(
+        {"NORAD_CAT_ID": range(1, 202), "BSTAR": bstar}
+    ).write_csv(path)
+    df = pl.concat(iter_chunks(str(path), chunk_rows=50))
+    assert df.schema["BSTAR"] == pl.Float64
+    assert df["BSTAR"][-1] == pytest.approx(-0.115e-5)
+
+
+def test_stream_catalog_rejects_rows_without_a_valid_id(tmp_path, capsys):
+    """Test malformed ids are dropped and bad values reported"""
+    url = f"sqlite:///{tmp_path / 'invalid.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    path = tmp_path / "feed.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"NORAD_CAT_ID": "1", "OBJECT_NAME": "A", "MEAN_MOTION": "x"},
+                {"NORAD_CAT_ID": "abc", "OBJECT_NAME": "B"},
+                {"NORAD_CAT_ID": "", "OBJECT_NAME": "C"},
+            ]
+        )
+    )
+
+    stats = stream_catalog(str(path), engine)
+    assert (stats["rows"], stats["rejected"], stats["written"]) == (1, 2, 1)
+    output = capsys.readouterr().out
+    assert "Skipped 1 invalid NORAD_CAT_ID values" in output
+    assert "Skipped 1 invalid MEAN_MOTION values" in output
+    assert "Skipped 2 rows without a NORAD id" in output
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(
+                get_satellite_table.c.id, get_satellite_table.c.mean_motion
+            )
+        ).all()
+    assert rows == [(1, None)]
+
+
+def test_stream_catalog_writes_only_newer_element_sets(tmp_path):
+    """Test streamed chunks are written and compared chunk by chunk"""
+    url = f"sqlite:///{tmp_path / 'stream.db'}"
+    init_db(url)
+    engine = get_engine(url)
+    rows = [(i, f"SAT {i}", "2024-12-01T00:00:00", 1) for i in range(1, 6)]
+    path = element_csv(tmp_path / "feed.csv", rows)
+
+    stats = stream_catalog(path, engine, group="feed", chunk_rows=2)
+    assert (stats["rows"], stats["written"]) == (5, 5)
+    assert stats["rows_per_sec"] > 0 and stats["peak_rss_mb"] > 0
+    assert len(search_satellites(group="feed", engine=engine)[0]) == 5
+
+    # A newer set for one satellite in the last chunk is all that changes
+    rows[4] = (5, "SAT 5", "2024-12-02T00:00:00", 2)
+    (tmp_path / "feed.xml").write_text(
+        OMM_XML.format("".join(OMM_SEGMENT.format(*row) for row in rows))
+    )
+    version = get_catalog_version(engine)
+    stats = stream_catalog(
+        str(tmp_path / "feed.xml"), engine, group="feed", chunk_rows=2
+    )
+    assert (stats["rows"], stats["written"]) == (5, 1)
+    assert get_catalog_version(engine) == version + 1
@@ -0,0 +1,133 @@
+from bisect import bisect_left
+import numpy as np
+from sqlalchemy import select
+
+from models import country_table, satellite_table
+
+# Gram sizes indexed for substring matches; shorter queries only match
+# as prefixes
+GRAM_SIZES = (2, 3)
+
+
+class Autocomplete:
+    """In-memory autocomplete over rows searchable by one or more keys.
+
+    Keys are held in a sorted array, so prefix matches are a binary
+    search, and in n-gram postings lists, so substring matches only
+    visit keys sharing every trigram of the query. Matches are ranked
+    like the database search: prefix matches first, then shorter keys,
+    then alphabetically."""
+
+    def __init__(self, rows, keys):
+        """`rows` are returned as results, `keys(row)` lists the strings
+        each row can be found by"""
+        self.rows = [list(row) for row in rows]
+        pairs = sorted(
+            (str(key).strip().lower(), i)
+            for i, row in enumerate(self.rows)
+            for key in keys(row)
+            if key is not None and str(key).strip()
+        )
+        self.keys = [key for key, _ in pairs]
+        self.key_rows = np.array([i for _, i in pairs], dtype=np.int64)
+        self.keys_per_row = int(
+            np.bincount(self.key_rows).max() if len(self.key_rows) else 1
+        )
+
+        # Shorter keys rank first, then the alphabetical position
+        lengths = np.array([len(key) for key in self.keys], dtype=np.int64)
+        self.scores = (lengths << 32) | np.arange(len(self.keys))
+
+        postings = {}
+        for k, key in enumerate(self.keys):
+            for gram in {
+                key[i:i + n]
+                for n in GRAM_SIZES
+                for i in range(len(key) - n + 1)
+            }:
+                postings.setdefault(gram, []).append(k)
+        self.postings = {
+            gram: np.array(keys, dtype=np.int64)
+            for gram, keys in postings.items()
+        }
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query, limit=5):
+        """Best `limit` rows with a key containing `query`"""
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+
+        found = []
+        seen = set()
+
+        def collect(candidates, check=None):
+            for k in candidates[np.argsort(self.scores[candidates])]:
+                row = int(self.key_rows[k])
+                if row in seen or (check and not check(self.keys[k])):
+                    continue
+                seen.add(row)
+                found.append(self.rows[row])
+                if len(found) == limit:
+                    return
+
+        # Prefix matches are a contiguous run of the sorted keys
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + "\uffff")
+        collect(
+            _smallest(
+                self.scores,
+                np.arange(start, end),
+                limit * self.keys_per_row,
+            )
+        )
+
+        if len(found) < limit and len(query) >= min(GRAM_SIZES):
+            candidates = self._substring_candidates(query)
+            collect(
+                candidates,
+                lambda key: query in key and not key.startswith(query),
+            )
+        return found
+
+    def _substring_candidates(self, query):
+        """Keys containing every n-gram of the query, a superset of the
+        keys containing the query"""
+        n = min(len(query), max(GRAM_SIZES))
+        grams = {query[i:i + n] for i in range(len(query) - n + 1)}
+        lists = sorted(
+            (self.postings.get(gram, np.empty(0, np.int64)) for gram in grams),
+            key=len,
+        )
+        candidates = lists[0]
+        for keys in lists[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, keys, assume_unique=True)
+        return candidates
+
+
+def _smallest(scores, candidates, count):
+    """The `count` candidates with the lowest scores, in no order"""
+    if len(candidates) <= count:
+        return candidates
+    return candidates[np.argpartition(scores[candidates], count)[:count]]
+
+
+def satellite_autocomplete(engine):
+    """Autocomplete over satellites by name and NORAD id, returning
+    [id, name] rows"""
+    stmt = select(satellite_table.c.id, satellite_table.c.name)
+    with engine.connect() as connection:
+        rows = connection.execute(stmt).fetchall()
+    return Autocomplete(rows, lambda row: [row[1], row[0]])
+
+
+def country_autocomplete(engine):
+    """Autocomplete over countries by name and ISO code, returning full
+    country rows"""
+    with engine.connect() as connection:
+        rows = connection.execute(select(country_table)).fetchall()
+    return Autocomplete(rows, lambda row: [row[3], row[0]])
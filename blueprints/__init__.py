@@ -3,6 +3,8 @@ from .login import login_bp
 from .satellites import satellites_bp
 from .search import search_bp
 from .account import account_bp
+from .above import above_bp
+from .metrics import metrics_bp
 
 
 def register_blueprints(app):
@@ -11,3 +13,5 @@ def register_blueprints(app):
     app.register_blueprint(satellites_bp)
     app.register_blueprint(search_bp)
     app.register_blueprint(account_bp)
+    app.register_blueprint(above_bp)
+    app.register_blueprint(metrics_bp)
@@ -0,0 +1,35 @@
+from flask import Blueprint, request, jsonify
+
+from blueprints.utils import overhead_table
+
+above_bp = Blueprint("above", __name__)
+
+
+@above_bp.route("/above", methods=["GET"])
+def satellites_near():
+    """
+    List the satellites whose sub-satellite point is within radius_deg
+    great-circle degrees of an arbitrary observer.
+    """
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius_deg = float(request.args["radius_deg"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat, lon and radius_deg are required"}), 400
+
+    # Comparisons with nan are false, so non-finite values are rejected
+    if (
+        not -90 <= lat <= 90
+        or not -180 <= lon <= 180
+        or not 0 <= radius_deg <= 180
+    ):
+        return jsonify({"error": "lat, lon or radius_deg out of range"}), 400
+
+    satellites = overhead_table.near(lat, lon, radius_deg)
+    if satellites is None:
+        # No tick has completed yet, so compute the index now
+        overhead_table.refresh()
+        satellites = overhead_table.near(lat, lon, radius_deg)
+
+    return jsonify(satellites)
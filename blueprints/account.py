@@ -6,43 +6,76 @@ from flask import (
     redirect,
     url_for,
 )
+from blueprints.search import format_cursor, page_args, page_response
+from blueprints.utils import (
+    get_account_view,
+    invalidate_account_view,
+)
 from database import (
     add_country_to_user,
     add_satellite_to_user,
-    get_user_satellites,
+    get_tracked_satellites,
     get_user_countries,
-    check_username_exists,
     delete_satellite_from_user,
     delete_country_from_user,
+    track_group,
+    track_satellites,
+    untrack_group,
+    untrack_satellites,
 )
 
 account_bp = Blueprint("account", __name__)
 
 
+# Most satellites one bulk tracking request may name
+MAX_BULK_SATELLITES = 10000
+
+
 @account_bp.route("/account/<username>")
 def account(username):
-    user = check_username_exists(username)
+    # The user and their tracked satellites and countries, from the cache
+    # when the page has been viewed before
+    user = get_account_view(username)
     if not user:
         return redirect(
             url_for("login.login")
         )  # redirect to home page if no account found
 
-    username = user["user_name"]
-    # convert satellites id to satellite name
-    satellites = get_user_satellites(username)
-
-    # get country names
-    countries = get_user_countries(username)
+    # Later pages of tracked satellites are read on demand
+    satellites, next_after = user["satellites"], user["next"]
+    if request.args.get("after"):
+        try:
+            _, after = page_args(int)
+        except ValueError as e:
+            return str(e), 400
+        satellites, next_after = get_tracked_satellites(
+            user["user_name"], after=after
+        )
 
     # Return the account page for hte user if the account exists
     return render_template(
         "account.html",
         username=user["user_name"],
         satellites=satellites,
-        countries=countries,
+        next_page=format_cursor(next_after),
+        groups=user["groups"],
+        countries=user["countries"],
     )
 
 
+# Page of the satellites a user tracks, directly or through groups
+@account_bp.route("/account/<username>/satellites", methods=["GET"])
+def account_satellites(username):
+    try:
+        limit, after = page_args(int)
+        results, next_after = get_tracked_satellites(
+            username, after=after, limit=limit
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return page_response(results, next_after)
+
+
 @account_bp.route("/add_satellite", methods=["POST"])
 def add_satellite():
     print("Received form data")
@@ -60,11 +93,11 @@ def add_satellite():
     if not username or not satellite_name:
         return "Invalid data", 400
     try:
-        # Call the function to add the satellite to the user
-        add_satellite_to_user(username, satellite_name)
-
-        # Get the updated list of satellites for the user
-        updated_satellites = get_user_satellites(username)
+        # Add the satellite, getting back the updated list for the user
+        updated_satellites, next_after = add_satellite_to_user(
+            username, satellite_name
+        )
+        invalidate_account_view(username)
 
         # Return the updated list of satellites as JSON
         return jsonify(updated_satellites)
@@ -91,11 +124,9 @@ def add_country():
     if not username or not country_name:
         return "Invalid data", 400
     try:
-        # Call the function to add the satellite to the user
-        add_country_to_user(username, country_name)
-
-        # Get the updated list of satellites for the user
-        updated_countries = get_user_countries(username)
+        # Add the country, getting back the updated list for the user
+        updated_countries = add_country_to_user(username, country_name)
+        invalidate_account_view(username)
 
         # Return the updated list of satellites as JSON
         return jsonify(updated_countries)
@@ -125,11 +156,14 @@ def delete_satellite():
     if not username or not satellite_name:
         return "Invalid data", 400
     try:
-        # Call the function to add the satellite to the user
-        delete_satellite_from_user(username, satellite_name)
+        # Delete the satellite, getting back the updated list for the user
+        tracked = delete_satellite_from_user(username, satellite_name)
 
-        # Get the updated list of satellites for the user
-        updated_satellites = get_user_satellites(username)
+        # Nothing was deleted, so read the list as it stands
+        if tracked is None:
+            tracked = get_tracked_satellites(username)
+        updated_satellites, next_after = tracked
+        invalidate_account_view(username)
 
         # Return the updated list of satellites as JSON
         return jsonify(updated_satellites)
@@ -155,11 +189,13 @@ def delete_country():
         return "Invalid data", 400
 
     try:
-        # Call the function to delete the country from the user's tracking list
-        delete_country_from_user(username, country_name)
+        # Delete the country, getting back the updated list for the user
+        updated_countries = delete_country_from_user(username, country_name)
 
-        # Get the updated list of countries for the user
-        updated_countries = get_user_countries(username)
+        # Nothing was deleted, so read the list as it stands
+        if updated_countries is None:
+            updated_countries = get_user_countries(username)
+        invalidate_account_view(username)
 
         # Return the updated list of countries as JSON
         return jsonify(updated_countries)
@@ -168,3 +204,94 @@ def delete_country():
         return str(ve), 400
     except Exception as e:
         return f"Error: {e}", 500
+
+
+def bulk_args():
+    """Parses the username and list of satellite names or NORAD ids of a
+    bulk tracking request, raising ValueError for invalid data"""
+    data = request.get_json(silent=True) or {}
+    username = data.get("username")
+    satellites = data.get("satellites")
+    if (
+        not username
+        or not isinstance(satellites, list)
+        or not all(isinstance(s, (str, int)) for s in satellites)
+    ):
+        raise ValueError("Invalid data")
+    if len(satellites) > MAX_BULK_SATELLITES:
+        raise ValueError(
+            f"At most {MAX_BULK_SATELLITES} satellites per request"
+        )
+    return username, satellites
+
+
+def bulk_response(username, changed, tracked):
+    """Number of satellites changed and the first page of those tracked,
+    dropping the cached account view so the next page load reads it"""
+    satellites, next_after = tracked
+    invalidate_account_view(username)
+    return jsonify(
+        {
+            "changed": changed,
+            "results": satellites,
+            "next": format_cursor(next_after),
+        }
+    )
+
+
+# Track many satellites, by name or NORAD id, in one request
+@account_bp.route("/add_satellites", methods=["POST"])
+def add_satellites():
+    try:
+        username, satellites = bulk_args()
+        added, tracked = track_satellites(username, satellites)
+    except ValueError as ve:
+        return str(ve), 400
+    except Exception as e:
+        return f"Error: {e}", 500
+    return bulk_response(username, added, tracked)
+
+
+@account_bp.route("/delete_satellites", methods=["POST"])
+def delete_satellites():
+    try:
+        username, satellites = bulk_args()
+        removed, tracked = untrack_satellites(username, satellites)
+    except ValueError as ve:
+        return str(ve), 400
+    except Exception as e:
+        return f"Error: {e}", 500
+    return bulk_response(username, removed, tracked)
+
+
+# Track or stop tracking a whole group, e.g. "starlink"
+@account_bp.route("/add_group", methods=["POST"])
+def add_group():
+    data = request.get_json(silent=True) or {}
+    username, group_name = data.get("username"), data.get("group_name")
+    if not username or not group_name:
+        return "Invalid data", 400
+    try:
+        satellites, next_after = track_group(username, group_name)
+    except ValueError as ve:
+        return str(ve), 400
+    except Exception as e:
+        return f"Error: {e}", 500
+    invalidate_account_view(username)
+    return page_response(satellites, next_after)
+
+
+@account_bp.route("/delete_group", methods=["POST"])
+def delete_group():
+    data = request.get_json(silent=True) or {}
+    username, group_name = data.get("username"), data.get("group_name")
+    if not username or not group_name:
+        return "Invalid data", 400
+    try:
+        satellites, next_after = untrack_group(username, group_name)
+    except ValueError as ve:
+        return str(ve), 400
+    except Exception as e:
+        return f"Error: {e}", 500
+    invalidate_account_view(username)
+    return page_response(satellites, next_after)
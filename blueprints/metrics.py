@@ -0,0 +1,22 @@
+from flask import Blueprint, jsonify
+
+import upstream
+from blueprints.utils import account_cache, orbit_cache, pass_cache, tle_cache
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Operational counters for the shared clients and caches"""
+    return jsonify(
+        {
+            "upstream": upstream.metrics(),
+            "caches": {
+                "tle": tle_cache.stats(),
+                "orbit": orbit_cache.stats(),
+                "passes": pass_cache.entries.stats(),
+                "accounts": account_cache.stats(),
+            },
+        }
+    )
@@ -1,21 +1,38 @@
 from flask import (
     Blueprint,
+    make_response,
     render_template,
     request,
     jsonify,
 )
-import requests
-import sqlite3
 import os
 
+import upstream
 from blueprints.utils import (
+    UpstreamError,
     get_observer_location,
+    parse_observer,
     generateSatData,
+    fetch_concurrently,
     fetch_satellite_image,
+    get_local_tle_data,
+    get_local_passes,
+    get_local_orbit,
+    orbit_cache,
+    tle_cache,
+    tle_cache_ttl,
 )
+from database import get_satellite_id_by_name
+from passes import snap_to_cell
 
 satellites_bp = Blueprint("satellites", __name__, url_prefix="/satellites")
 
+NY20_API_BASE = "https://api.n2yo.com/rest/v1/satellite/"
+
+# Cookie holding "lat:lon" of the coordinates a client last gave
+OBSERVER_COOKIE = "observer"
+OBSERVER_COOKIE_MAX_AGE = 30 * 86400
+
 
 @satellites_bp.route("/", methods=["GET"])
 def satellite():
@@ -30,86 +47,13 @@ def satellite():
             400,
         )
 
-    # Connect to the database and fetch corresponding satellite ID
+    # Look up the satellite ID based on the name
     try:
-        # Get observer location
-        observer_location = get_observer_location()
-        if not observer_location:
-            return "Could not determine observer location", 500
-
-        observer_lat, observer_lng = observer_location
-        observer_alt = 0  # set observer altitude to sea level
-
-        connection = sqlite3.connect("app_database.db")
-        cursor = connection.cursor()
-
-        # Query to get the satellite ID based on the name
-        query = "SELECT * FROM satellite WHERE name = ?"
-        cursor.execute(query, (input_satellite,))
-        result = cursor.fetchone()  # Fetch first result
-
-        connection.close()
+        satellite_id = get_satellite_id_by_name(input_satellite)
 
         # Check if result was found
-        if result:
-            satellite_id = result[0]
-            satellite_name = result[1]
-            API_KEY = os.getenv("API_KEY")
-            NY20_API_BASE = "https://api.n2yo.com/rest/v1/satellite/"
-
-            # Fetch TLE data
-            tle_url = f"{NY20_API_BASE}tle/{satellite_id}&apiKey={API_KEY}"
-            tle_response = requests.get(tle_url)
-            if tle_response.status_code != 200:
-                return "Failed to fetch TLE data", 500
-            tle_data = tle_response.json()
-
-            # Fetch orbit data
-            orbit_url = (
-                f"{NY20_API_BASE}positions/{satellite_id}/"
-                f"{observer_lat}/{observer_lng}/"
-                f"{observer_alt}/10&apiKey={API_KEY}"
-            )
-            orbit_response = requests.get(orbit_url)
-            if orbit_response.status_code != 200:
-                return "Failed to fetch Orbit data", 500
-            orbit_data = orbit_response.json()
-
-            # Fetch visible passes
-            days = 10  # Max prediction range
-            min_visibility = 300  # min visibility in seconds
-            passes_url = (
-                f"{NY20_API_BASE}visualpasses/{satellite_id}/"
-                f"{observer_lat}/{observer_lng}/{observer_alt}/"
-                f"{days}/{min_visibility}&apiKey={API_KEY}"
-            )
-            passes_response = requests.get(passes_url)
-            if passes_response.status_code != 200:
-                return "Failed to fetch visible passes data", 500
-            passes_data = passes_response.json()
-
-            # Extract next visible pass
-            next_pass = None
-            if passes_data.get("passes"):
-                next_pass = passes_data["passes"][0][
-                    "startUTC"
-                ]  # Get pass time
-
-            # Fetch satellite image
-            image_url = fetch_satellite_image(satellite_name)
-
-            # Generate satellite data for template
-            data = generateSatData(image_url, tle_data)
-
-            # Render template with all the data
-            return render_template(
-                "satellite.html",
-                satellite=data,
-                observer_lat=observer_lat,
-                observer_lng=observer_lng,
-                orbit_data=orbit_data,
-                next_pass=next_pass,
-            )
+        if satellite_id is not None:
+            return satellite_page(satellite_id, input_satellite)
         else:
             error_message = (
                 f"Sorry we can't find the satellite, f{input_satellite}"
@@ -132,68 +76,174 @@ def satellite():
 )
 def satellite_by_id(satellite_id, satellite_name):
     try:
-        # Fetch observer location
-        observer_location = get_observer_location()
-        if not observer_location:
-            return "Could not determine observer location", 500
+        return satellite_page(satellite_id, satellite_name)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        observer_lat, observer_lng = observer_location
-        observer_alt = 0  # set observer altitude to sea level
 
-        API_KEY = os.getenv("API_KEY")
-        NY20_API_BASE = "https://api.n2yo.com/rest/v1/satellite/"
-
-        # Fetch TLE data
-        tle_url = f"{NY20_API_BASE}tle/{satellite_id}&apiKey={API_KEY}"
-        tle_response = requests.get(tle_url)
-        if tle_response.status_code != 200:
-            return "Failed to fetch TLE data", 500
-        tle_data = tle_response.json()
-
-        # Fetch orbit data
-        orbit_url = (
-            f"{NY20_API_BASE}positions/{satellite_id}/"
-            f"{observer_lat}/{observer_lng}/"
-            f"{observer_alt}/10&apiKey={API_KEY}"
+def satellite_page(satellite_id, satellite_name):
+    """Render satellite.html, running the upstream calls concurrently.
+
+    Each call starts as soon as its inputs are ready, so the page takes
+    as long as the slowest chain of calls rather than their sum. Per-call
+    durations are reported in the Server-Timing header."""
+    # Explicit coordinates, then remembered ones, then the client's IP
+    explicit = parse_observer(request.args.get("lat"), request.args.get("lon"))
+    cookie = request.cookies.get(OBSERVER_COOKIE, "")
+    cookie_lat, _, cookie_lng = cookie.partition(":")
+    remembered = parse_observer(cookie_lat, cookie_lng)
+    # X-Forwarded-For is only trusted through ProxyFix (see app.py)
+    client_ip = request.remote_addr
+
+    try:
+        results, timings = fetch_concurrently(
+            {
+                "observer": (
+                    lambda: fetch_observer_location(
+                        explicit or remembered, client_ip
+                    ),
+                    [],
+                ),
+                "tle_data": (lambda: fetch_tle_data(satellite_id), []),
+                "image_url": (
+                    lambda: fetch_satellite_image(satellite_name),
+                    [],
+                ),
+                "orbit_data": (
+                    lambda observer: fetch_orbit_data(satellite_id, observer),
+                    ["observer"],
+                ),
+                "next_pass": (
+                    lambda observer: fetch_next_pass(satellite_id, observer),
+                    ["observer"],
+                ),
+                # Reverse geocoding needs the satellite's current position
+                "satellite": (
+                    lambda tle_data: generateSatData(None, tle_data),
+                    ["tle_data"],
+                ),
+            }
+        )
+    except UpstreamError as e:
+        return str(e), 500
+
+    # Generate satellite data for template
+    data = results["satellite"]
+    if results["image_url"] is not None:
+        data["image_url"] = results["image_url"]
+    observer_lat, observer_lng = results["observer"]
+
+    # Render template with all the data
+    response = make_response(
+        render_template(
+            "satellite.html",
+            satellite=data,
+            observer_lat=observer_lat,
+            observer_lng=observer_lng,
+            orbit_data=results["orbit_data"],
+            next_pass=results["next_pass"],
+        )
+    )
+    if explicit:
+        response.set_cookie(
+            OBSERVER_COOKIE,
+            f"{observer_lat}:{observer_lng}",
+            max_age=OBSERVER_COOKIE_MAX_AGE,
         )
-        orbit_response = requests.get(orbit_url)
-        if orbit_response.status_code != 200:
-            return "Failed to fetch Orbit data", 500
-        orbit_data = orbit_response.json()
-
-        # Fetch visible passes
-        days = 10  # Max prediction range
-        min_visibility = 300  # min visibility in seconds
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={duration:.1f}" for name, duration in timings.items()
+    )
+    return response
+
+
+def fetch_observer_location(coordinates, client_ip):
+    """Get the observer location from the given coordinates, or the
+    client's cached IP location, or fail the page without one"""
+    if coordinates:
+        return coordinates
+    observer_location = get_observer_location(client_ip)
+    if not observer_location:
+        raise UpstreamError("Could not determine observer location")
+    return observer_location
+
+
+def fetch_tle_data(satellite_id):
+    """Get the cached TLE data for a satellite, loading it on a miss"""
+    return tle_cache.get_or_set(
+        satellite_id, lambda: load_tle_data(satellite_id), tle_cache_ttl
+    )
+
+
+def load_tle_data(satellite_id):
+    """Build TLE data from the stored elements, falling back to N2YO for
+    satellites ingested without them"""
+    tle_data = get_local_tle_data(satellite_id)
+    if tle_data is not None:
+        return tle_data
+
+    API_KEY = os.getenv("API_KEY")
+    tle_url = f"{NY20_API_BASE}tle/{satellite_id}&apiKey={API_KEY}"
+    tle_response = upstream.get(tle_url)
+    if tle_response.status_code != 200:
+        raise UpstreamError("Failed to fetch TLE data")
+    return tle_response.json()
+
+
+def fetch_orbit_data(satellite_id, observer):
+    """Get the cached orbit for a satellite and observer cell, loading it
+    on a miss"""
+    observer_lat, observer_lng = map(snap_to_cell, observer)
+    return orbit_cache.get_or_set(
+        (satellite_id, observer_lat, observer_lng),
+        lambda: load_orbit_data(satellite_id, observer_lat, observer_lng),
+    )
+
+
+def load_orbit_data(satellite_id, observer_lat, observer_lng):
+    """Generate a full orbit of positions locally, falling back to N2YO
+    for satellites without usable elements"""
+    orbit_data = get_local_orbit(satellite_id, observer_lat, observer_lng)
+    if orbit_data is not None:
+        return orbit_data
+
+    API_KEY = os.getenv("API_KEY")
+    observer_alt = 0  # set observer altitude to sea level
+    orbit_url = (
+        f"{NY20_API_BASE}positions/{satellite_id}/"
+        f"{observer_lat}/{observer_lng}/"
+        f"{observer_alt}/10&apiKey={API_KEY}"
+    )
+    orbit_response = upstream.get(orbit_url)
+    if orbit_response.status_code != 200:
+        raise UpstreamError("Failed to fetch Orbit data")
+    return orbit_response.json()
+
+
+def fetch_next_pass(satellite_id, observer):
+    """Predict the start of the next visible pass locally, falling back
+    to N2YO for satellites without usable elements"""
+    observer_lat, observer_lng = observer
+    days = 10  # Max prediction range
+    min_visibility = 300  # min visibility in seconds
+    passes = get_local_passes(
+        satellite_id, observer_lat, observer_lng, days, min_visibility
+    )
+    if passes is not None:
+        passes_data = {"passes": passes}
+    else:
+        API_KEY = os.getenv("API_KEY")
+        observer_alt = 0  # set observer altitude to sea level
         passes_url = (
             f"{NY20_API_BASE}visualpasses/{satellite_id}/"
             f"{observer_lat}/{observer_lng}/{observer_alt}/"
             f"{days}/{min_visibility}&apiKey={API_KEY}"
         )
-        passes_response = requests.get(passes_url)
+        passes_response = upstream.get(passes_url)
         if passes_response.status_code != 200:
-            return "Failed to fetch visible passes data", 500
+            raise UpstreamError("Failed to fetch visible passes data")
         passes_data = passes_response.json()
 
-        # Extract next visible pass
-        next_pass = None
-        if passes_data.get("passes"):
-            next_pass = passes_data["passes"][0]["startUTC"]  # Get pass time
-
-        # Fetch satellite image
-        image_url = fetch_satellite_image(satellite_name)
-
-        # Generate satellite data for template
-        data = generateSatData(image_url, tle_data)
-
-        # Render template with all the data
-        return render_template(
-            "satellite.html",
-            satellite=data,
-            observer_lat=observer_lat,
-            observer_lng=observer_lng,
-            orbit_data=orbit_data,
-            next_pass=next_pass,
-        )
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # Extract next visible pass
+    if passes_data.get("passes"):
+        return passes_data["passes"][0]["startUTC"]  # Get pass time
+    return None
@@ -1,29 +1,31 @@
 from flask import Blueprint, request, jsonify, redirect, url_for
 
-from database import (
-    find_satellites_by_name,
-    find_country_by_name,
-)
+from blueprints.utils import catalog_cached, get_autocomplete
+from database import ORBIT_CLASSES, search_countries, search_satellites
 
 search_bp = Blueprint("search", __name__)
 
 
 # route to implement the suggested search in index.html
 @search_bp.route("/search", methods=["GET"])
+@catalog_cached
 def search():
     query = request.args.get("query")
     if query:
-        results = find_satellites_by_name(query)
+        satellites, _ = get_autocomplete()
+        results = satellites.search(query)
         return jsonify(results)  # return the results as JSON
     return jsonify([])  # return an empty list if no query
 
 
 # route to implement the suggested search for countries
 @search_bp.route("/country_search", methods=["GET"])
+@catalog_cached
 def country_search():
     query = request.args.get("query")
     if query:
-        results = find_country_by_name(query)
+        _, countries = get_autocomplete()
+        results = countries.search(query)
         return jsonify(results)
     return jsonify([])  # return empty list if no query
 
@@ -34,3 +36,72 @@ def country_details(country_name):
     return redirect(
         url_for("country.get_satellites_over_country", country=country_name)
     )
+
+
+# Largest page the search API returns
+MAX_PAGE_SIZE = 100
+
+
+def page_args(key_type):
+    """Parses the limit and after=<name,key> cursor of a search API
+    request, raising ValueError for invalid values"""
+    limit = int(request.args.get("limit", 20))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    after = request.args.get("after")
+    if after:
+        # Names may contain commas, the key never does
+        name, comma, key = after.rpartition(",")
+        if not comma:
+            raise ValueError("after must be <name>,<key>")
+        after = (name, key_type(key))
+    return limit, after
+
+
+def format_cursor(next_after):
+    """The after=<name,key> cursor of a page's last row, or None"""
+    return ",".join(map(str, next_after)) if next_after else None
+
+
+def page_response(results, next_after):
+    """Search API page, with the cursor of the next page if there is one"""
+    return jsonify({"results": results, "next": format_cursor(next_after)})
+
+
+# Ranked, paginated satellite search
+@search_bp.route("/api/satellites", methods=["GET"])
+@catalog_cached
+def api_satellites():
+    orbit_class = request.args.get("orbit_class")
+    if orbit_class:
+        orbit_class = orbit_class.upper()
+        if orbit_class not in ORBIT_CLASSES:
+            return jsonify({"error": "Unknown orbit class"}), 400
+    try:
+        limit, after = page_args(int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results, next_after = search_satellites(
+        request.args.get("q", "").strip(),
+        group=request.args.get("group"),
+        orbit_class=orbit_class,
+        after=after,
+        limit=limit,
+    )
+    return page_response(results, next_after)
+
+
+# Ranked, paginated country search
+@search_bp.route("/api/countries", methods=["GET"])
+@catalog_cached
+def api_countries():
+    try:
+        limit, after = page_args(str)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results, next_after = search_countries(
+        request.args.get("q", "").strip(), after=after, limit=limit
+    )
+    return page_response(results, next_after)
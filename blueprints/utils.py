@@ -1,9 +1,112 @@
 import requests
-import sqlite3
+from flask import make_response, request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from functools import wraps
+import ipaddress
 import os
+import threading
+import time
 import ephem
 import math
-import pycountry
+import numpy as np
+
+import upstream
+from autocomplete import country_autocomplete, satellite_autocomplete
+from cache import TTLCache
+from geocoder import ReverseGeocoder
+import database
+from database import (
+    get_account,
+    get_catalog_version,
+    get_countries,
+    get_satellite_elements,
+    ingest_listeners,
+    get_names_without_image,
+    get_satellite_image,
+    save_satellite_image,
+)
+from overhead import OverheadTable
+from passes import PassCache, PassPredictor
+from propagation import (
+    SatelliteCatalog,
+    has_elements,
+    is_stale,
+    satrec_from_elements,
+    tle_epoch,
+    tle_from_elements,
+)
+
+# Catalog of stored element sets, loaded on first use and reloaded once
+# the catalog version changes
+_catalog = None
+_catalog_loaded_version = None
+_catalog_lock = threading.Lock()
+
+# Country polygons used to name satellite subpoints, loaded on first use
+_geocoder = None
+
+# Satellite and country autocompletes, built on first use and rebuilt
+# once the catalog version changes
+_autocomplete = None
+_autocomplete_version = None
+# Background build started by warm_autocomplete, so it is only queued once
+_autocomplete_warming = None
+_autocomplete_lock = threading.Lock()
+
+# The catalog version is re-read at most this often, so ingestion by
+# another process is noticed within this many seconds
+CATALOG_VERSION_TTL = 5
+_catalog_version = None
+_catalog_version_read_at = 0.0
+
+# How long clients may reuse catalog responses before revalidating
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "60"))
+
+# Visual passes per satellite, observer cell and day
+pass_cache = PassCache()
+
+# A new element set is usually published within this long of the last one
+ELEMENT_REFRESH_SECONDS = 12 * 3600
+TLE_MIN_TTL = 15 * 60
+TLE_MAX_TTL = 6 * 3600
+
+# TLE data per NORAD id, optionally persisted so restarts start warm
+tle_cache = TTLCache(
+    maxsize=4096, ttl=TLE_MIN_TTL, path=os.getenv("TLE_CACHE_FILE")
+)
+
+# Orbit positions per NORAD id and observer cell; the ground track is
+# still accurate enough to draw a minute later
+orbit_cache = TTLCache(maxsize=1024, ttl=60)
+
+# Image shown for satellites without a curated or searched image
+FALLBACK_IMAGE_URL = (
+    "https://wmo.int/sites/default/files/2023-03/AdobeStock_580430822.jpeg"
+)
+# How long a searched image URL, or the lack of one, is trusted
+IMAGE_TTL = float(os.getenv("IMAGE_CACHE_TTL_DAYS", "90")) * 86400
+IMAGE_NOT_FOUND_TTL = 7 * 86400
+# Failed searches are retried after this long
+IMAGE_ERROR_TTL = 5 * 60
+
+# Image URLs per satellite name, in front of the satellite_image table
+image_cache = TTLCache(maxsize=16384, ttl=IMAGE_TTL)
+_image_engine = None
+
+# Observer locations per client IP address, looked up once per client
+observer_cache = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+# Account page views per lower-cased user name, kept up to date by the
+# tracking endpoints; the TTL bounds staleness across processes
+account_cache = TTLCache(maxsize=4096, ttl=10 * 60)
+
+# Shared pool for the blocking calls made while building a page
+fetch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fetch")
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream API call needed by a page fails"""
 
 
 def process_query(query):
@@ -15,7 +118,7 @@ def get_satellite_data(satellite_id):
     start_url = "https://api.n2yo.com/rest/v1/satellite/tle/"
     end_url = "&apiKey=LMFEWE-UWEWBT-WF7CWC-5DK0"
     url = f"{start_url}{satellite_id}{end_url}"
-    response = requests.get(url)
+    response = upstream.get(url)
     if response.status_code == 200:
         return response.json()
         # change to return to the render template satellite.html
@@ -23,12 +126,6 @@ def get_satellite_data(satellite_id):
         return None
 
 
-def dms_to_decimal(dms_str):
-    d, m, s = map(float, dms_str.split(":"))
-    decimal = float(d) + (float(m) / 60) + (float(s) / 3600)
-    return str(round(decimal, 6))
-
-
 def pyephem(tle):
 
     RADIUS = 6371.0
@@ -65,29 +162,30 @@ def pyephem(tle):
     return data
 
 
+def get_geocoder():
+    """Returns the reverse geocoder, loading the country polygons on
+    first use"""
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = ReverseGeocoder()
+    return _geocoder
+
+
 def getlocation(lat, long):
-    WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
-    url_start = "https://api.openweathermap.org/geo/1.0/reverse?"
-    url_lat_long = f"lat={dms_to_decimal(lat)}&lon={dms_to_decimal(long)}"
-    url_end = f"&limit=5&appid={WEATHER_API_KEY}"
-    response = requests.get(url_start + url_lat_long + url_end)
-    if response.status_code == 200:
-        location = response.json()
-        if len(location) == 0:
-            return "Currently flying over the ocean"
-        location_string = "No location found"
-        if "country" in location[0]:
-            code = location[0]["country"].upper()
-            country = pycountry.countries.get(alpha_2=code)
-            location_string = country.name if country else code
-            if "state" in location[0]:
-                state = location[0]["state"]
-                location_string = location_string + ", " + state
-                if "name" in location[0]:
-                    name = location[0]["name"]
-                    location_string = location_string + ", " + name
-        return location_string
-    return "No location Found"
+    """Names the country below a subpoint given in decimal degrees"""
+    return get_geocoder().locate(lat, long)
+
+
+def catalog_locations(when=None):
+    """Maps the id of every propagated satellite to the country below it,
+    looked up for the whole catalog at once"""
+    catalog = get_catalog()
+    state = catalog.propagate(when)
+    valid = np.flatnonzero(state["valid"])
+    locations = get_geocoder().locate_many(
+        state["lat"][valid], state["lon"][valid]
+    )
+    return dict(zip(catalog.ids[valid].tolist(), locations))
 
 
 def generateSatData(image_url, satellite_data):
@@ -98,9 +196,9 @@ def generateSatData(image_url, satellite_data):
         tle_lines = tle_data.split("\r\n")
         tle = [name, tle_lines[0], tle_lines[1]]
         data = pyephem(tle)
-        lat = str(data["lat"])
-        long = str(data["long"])
-        data["location"] = getlocation(lat, long)
+        data["location"] = getlocation(
+            math.degrees(data["lat"]), math.degrees(data["long"])
+        )
     if image_url is not None:
         data["image_url"] = image_url
     data["name"] = satellite_data["info"]["satname"]
@@ -110,28 +208,218 @@ def generateSatData(image_url, satellite_data):
 
 # Helper function to get satellite name by id.
 def get_satellite_by_id(satellite_id):
-    connection = sqlite3.connect("app_database.db")
-    cursor = connection.cursor()
-    query = "SELECT * FROM satellite WHERE id = ?"
-    cursor.execute(query, (satellite_id,))
-    result = cursor.fetchone()
-    connection.close()
-    if result:
+    elements = get_satellite_elements(satellite_id)
+    if elements:
         # Return a dictionary or an object with the necessary details
-        return {
-            "id": result[0],  # Assuming the id is in the first column
-            "name": result[1],  # Assuming the name is in the second column
-        }
+        return {"id": elements["id"], "name": elements["name"]}
     return None
 
 
-def fetch_satellite_image(satellite_name):
-    """Fetch a satellite image URL dynamically using Google custom
-    search API"""
+def get_local_elements(satellite_id):
+    """Returns the element set stored for a satellite, or None if it
+    has no usable elements"""
+    elements = get_satellite_elements(satellite_id)
+    if not elements or not has_elements(elements) or is_stale(elements):
+        return None
+    return elements
 
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    CX = os.getenv("GOOGLE_CX")
 
+def get_local_tle_data(satellite_id):
+    """Builds N2YO-style TLE data from the element set stored in the
+    database, or returns None if the satellite has no usable elements"""
+    elements = get_local_elements(satellite_id)
+    if elements is None:
+        return None
+
+    tle = tle_from_elements(elements)
+    return {
+        "info": {"satid": elements["id"], "satname": elements["name"]},
+        "tle": f"{tle[1]}\r\n{tle[2]}",
+    }
+
+
+def get_local_passes(satellite_id, lat, lng, days=10, min_visibility=300):
+    """Predicts the visual passes of a satellite over an observer from its
+    stored elements, or returns None if it has no usable elements"""
+    elements = get_local_elements(satellite_id)
+    if elements is None:
+        return None
+
+    return pass_cache.visual_passes(
+        satellite_id,
+        satrec_from_elements(elements),
+        lat,
+        lng,
+        days=days,
+        min_visibility=min_visibility,
+    )
+
+
+def get_local_orbit(satellite_id, lat, lng, orbits=1, step=60):
+    """Builds N2YO-style positions data covering `orbits` revolutions of
+    a satellite from its stored elements, or returns None if it has no
+    usable elements"""
+    elements = get_local_elements(satellite_id)
+    if elements is None:
+        return None
+
+    period = 86400 / elements["mean_motion"]  # seconds per revolution
+    predictor = PassPredictor(satrec_from_elements(elements), lat, lng)
+    now = datetime.now(timezone.utc).timestamp()
+    return {
+        "info": {"satid": elements["id"], "satname": elements["name"]},
+        "positions": predictor.timeline(int(now), orbits * period, step),
+    }
+
+
+def tle_cache_ttl(tle_data, now=None):
+    """How long to cache TLE data: until a newer element set is likely to
+    have been published, rechecking at least every TLE_MIN_TTL seconds
+    once it is due and never keeping it longer than TLE_MAX_TTL"""
+    now = now or time.time()
+    if not tle_data.get("tle"):
+        return TLE_MIN_TTL
+    epoch = tle_epoch(tle_data["tle"].split("\r\n")[0])
+    ttl = epoch + ELEMENT_REFRESH_SECONDS - now
+    return min(max(ttl, TLE_MIN_TTL), TLE_MAX_TTL)
+
+
+def get_autocomplete():
+    """Returns the (satellites, countries) autocompletes, building them
+    from the database when needed"""
+    global _autocomplete, _autocomplete_version
+    with _autocomplete_lock:
+        version = catalog_version()
+        if _autocomplete is None or _autocomplete_version != version:
+            _autocomplete = (
+                satellite_autocomplete(database.read_engine),
+                country_autocomplete(database.read_engine),
+            )
+            _autocomplete_version = version
+        return _autocomplete
+
+
+def warm_autocomplete():
+    """Builds the autocompletes in the background if they aren't built,
+    queueing at most one build however many requests arrive meanwhile"""
+    global _autocomplete_warming
+    if _autocomplete is not None:
+        return
+    # A held lock means a build is already running
+    if not _autocomplete_lock.acquire(blocking=False):
+        return
+    try:
+        if _autocomplete_warming is None or _autocomplete_warming.done():
+            _autocomplete_warming = fetch_pool.submit(get_autocomplete)
+    finally:
+        _autocomplete_lock.release()
+
+
+def invalidate_autocomplete():
+    """Drops the autocompletes and the cached catalog version, so the next
+    search rebuilds them"""
+    global _autocomplete, _catalog_version
+    _autocomplete = None
+    _catalog_version = None
+
+
+def catalog_version():
+    """Returns the catalog version, re-reading it from the database at
+    most every CATALOG_VERSION_TTL seconds"""
+    global _catalog_version, _catalog_version_read_at
+    now = time.time()
+    if (
+        _catalog_version is None
+        or now - _catalog_version_read_at > CATALOG_VERSION_TTL
+    ):
+        _catalog_version = get_catalog_version()
+        _catalog_version_read_at = now
+    return _catalog_version
+
+
+def catalog_cached(view):
+    """Decorates a view whose response only changes with the catalog.
+
+    Responses carry an ETag of the catalog version and a Cache-Control
+    max-age, and requests whose If-None-Match holds the current version
+    get an empty 304 without running the view."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = f"catalog-{catalog_version()}"
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = CATALOG_MAX_AGE
+        return response
+
+    return wrapper
+
+
+def invalidate_catalog():
+    """Drops the satellite catalog, so the next use reloads it"""
+    global _catalog
+    _catalog = None
+
+
+ingest_listeners.append(invalidate_autocomplete)
+ingest_listeners.append(invalidate_catalog)
+
+
+def get_catalog():
+    """Returns the satellite catalog, loading it from the database on
+    first use and again whenever the catalog version changes"""
+    global _catalog, _catalog_loaded_version
+    with _catalog_lock:
+        version = catalog_version()
+        if _catalog is None or _catalog_loaded_version != version:
+            _catalog = SatelliteCatalog.from_engine(database.read_engine)
+            _catalog_loaded_version = version
+        return _catalog
+
+
+def satellites_above(lat, lng, search_radius, alt=0.0):
+    """Lists the satellites currently within `search_radius` degrees of
+    the observer's zenith, matching N2YO's /above/ endpoint"""
+    # Use the spatial index from the last tick when there is one
+    satellites = overhead_table.above(lat, lng, search_radius, alt)
+    if satellites is not None:
+        return satellites
+
+    catalog = get_catalog()
+    return [
+        {"id": int(catalog.ids[i]), "name": catalog.names[i]}
+        for i in catalog.above(lat, lng, search_radius, alt)
+    ]
+
+
+def load_countries():
+    """Loads the coordinates and search radius of every country"""
+    return get_countries()
+
+
+# Satellites above every country, refreshed in the background
+overhead_table = OverheadTable(
+    get_catalog,
+    load_countries,
+    interval=float(os.getenv("OVERHEAD_REFRESH_SECONDS", "30")),
+)
+
+
+def get_image_engine():
+    """Returns the engine of the image URL store, the shared pool unless
+    one has been set"""
+    return _image_engine or database.engine
+
+
+def fetch_satellite_image(satellite_name):
+    """Fetch a satellite image URL, from the cache when possible and
+    otherwise dynamically using Google custom search API"""
     satellite_name = satellite_name.strip().upper()
 
     curated_images = {
@@ -148,11 +436,33 @@ def fetch_satellite_image(satellite_name):
     if satellite_name in curated_images:
         return curated_images[satellite_name]
 
+    image_url = image_cache.get(satellite_name)
+    if image_url is None:
+        image_url = load_satellite_image(satellite_name)
+    return image_url
+
+
+def load_satellite_image(satellite_name):
+    """Loads the image URL of a satellite from the image store, searching
+    for it when it is missing or expired, and caches it in memory"""
+    now = time.time()
+    try:
+        stored = get_satellite_image(satellite_name, get_image_engine())
+    except Exception as e:
+        print(f"Error reading stored image: {e}")
+        stored = None
+    if stored is not None:
+        ttl = IMAGE_TTL if stored["found"] else IMAGE_NOT_FOUND_TTL
+        remaining = stored["fetched_at"] + ttl - now
+        if remaining > 0:
+            image_url = stored["url"] or FALLBACK_IMAGE_URL
+            image_cache.set(satellite_name, image_url, ttl=remaining)
+            return image_url
+
+    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    CX = os.getenv("GOOGLE_CX")
     if not GOOGLE_API_KEY or not CX:
-        return (
-            "https://wmo.int/sites/default/files/2023-03/"
-            "AdobeStock_580430822.jpeg"
-        )
+        return FALLBACK_IMAGE_URL
 
     search_query = f"{satellite_name} satellite"
     url = "https://www.googleapis.com/customsearch/v1"
@@ -165,32 +475,134 @@ def fetch_satellite_image(satellite_name):
     }
 
     try:
-        response = requests.get(url, params=params)
+        response = upstream.get(url, params=params)
         response.raise_for_status()
         data = response.json()
-
-        # Extract the image URL
-        items = data.get("items", [])
-        if items:
-            return items[0]["link"]  # return first image url
-
     except requests.RequestException as e:
+        # Don't store transient failures, but don't retry them on every
+        # page view either
         print(f"Error fetching image: {e}")
+        image_cache.set(satellite_name, FALLBACK_IMAGE_URL, IMAGE_ERROR_TTL)
+        return FALLBACK_IMAGE_URL
 
-    return (
-        "https://wmo.int/sites/default/files/2023-03/AdobeStock_580430822.jpeg"
+    # Extract the image URL, remembering searches without a result too
+    items = data.get("items", [])
+    found = bool(items)
+    image_url = items[0]["link"] if found else FALLBACK_IMAGE_URL
+    try:
+        save_satellite_image(
+            satellite_name, image_url, found, now, get_image_engine()
+        )
+    except Exception as e:
+        print(f"Error storing image: {e}")
+    ttl = IMAGE_TTL if found else IMAGE_NOT_FOUND_TTL
+    image_cache.set(satellite_name, image_url, ttl)
+    return image_url
+
+
+def prewarm_images(limit=None, delay=0.0):
+    """Looks up the image of every satellite without a fresh stored image,
+    at most `limit` of them, pausing `delay` seconds between searches to
+    stay within the search API quota. Returns the number looked up."""
+    now = time.time()
+    names = get_names_without_image(
+        get_image_engine(),
+        found_after=now - IMAGE_TTL,
+        not_found_after=now - IMAGE_NOT_FOUND_TTL,
     )
+    if limit is not None:
+        names = names[:limit]
+    for count, name in enumerate(names, start=1):
+        fetch_satellite_image(name)
+        if delay and count < len(names):
+            time.sleep(delay)
+    return len(names)
+
+
+def parse_observer(lat, lon):
+    """Parses explicit observer coordinates, or returns None if they are
+    missing or out of range"""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def get_account_view(username):
+    """Returns the account page view of a user, or None if there is no
+    such user, querying the database only on a cache miss"""
+    return account_cache.get_or_set(
+        username.lower(), lambda: get_account(username)
+    )
+
 
+def invalidate_account_view(username):
+    """Drops a user's cached account view, so the next page load reads it
+    from the database"""
+    account_cache.invalidate(username.lower())
 
-def get_observer_location():
-    """Fetches the observer's latitude and longitude based on
-    their public API"""
 
+def get_observer_location(client_ip=None):
+    """Fetches the latitude and longitude of a client from its IP
+    address, looking each address up only once while it is cached"""
+    return observer_cache.get_or_set(
+        client_ip or "", lambda: lookup_ip_location(client_ip)
+    )
+
+
+def lookup_ip_location(client_ip=None):
+    """Looks up the location of an IP address with ip-api. Private and
+    missing addresses fall back to the server's own public address."""
+    url = "http://ip-api.com/json"
     try:
-        response = requests.get("http://ip-api.com/json")
+        if client_ip and ipaddress.ip_address(client_ip).is_global:
+            url = f"{url}/{client_ip}"
+    except ValueError:
+        pass
+
+    try:
+        response = upstream.get(url, params={"fields": "status,lat,lon"})
         response.raise_for_status()
         data = response.json()
+        if data.get("status") == "fail":
+            return None
         return data.get("lat"), data.get("lon")
     except Exception as e:
         print(f"Error fetching location: {e}")
         return None
+
+
+def fetch_concurrently(tasks):
+    """Runs named tasks on the shared pool, starting each one as soon as
+    the tasks it depends on have finished.
+
+    `tasks` maps a name to a (function, dependencies) pair, and each
+    function is called with its dependencies' results as keyword
+    arguments. Returns the results and how long each task took in ms."""
+    results, timings = {}, {}
+    pending = dict(tasks)
+    running = {}
+    while pending or running:
+        for name, (function, dependencies) in list(pending.items()):
+            if all(dependency in results for dependency in dependencies):
+                del pending[name]
+                kwargs = {dep: results[dep] for dep in dependencies}
+                future = fetch_pool.submit(_timed, function, kwargs)
+                running[future] = name
+        if not running:
+            raise ValueError(f"Unresolvable dependencies: {list(pending)}")
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            results[name], timings[name] = future.result()
+    return results, timings
+
+
+def _timed(function, kwargs):
+    start = time.perf_counter()
+    result = function(**kwargs)
+    return result, (time.perf_counter() - start) * 1000
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL.
+
+    When `path` is given, entries are also written through to a SQLite
+    file and reloaded on start-up, so a restarted process starts warm.
+    Keys and values must be JSON serializable to be persisted."""
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so loads that raced one are dropped
+        self._generation = 0
+        self._db = None
+        if path:
+            self._open(path)
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, or `default` if it is
+        missing or has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Caches `value` for `ttl` seconds (defaults to the cache's TTL),
+        evicting the least recently used entries beyond `maxsize`"""
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def get_or_set(self, key, load, ttl=None):
+        """Returns the cached value for `key`, calling `load()` to fill the
+        cache on a miss. `ttl` may be a callable of the loaded value.
+        None results are not cached, nor are results loaded while an entry
+        was invalidated, since they may predate the change."""
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = load()
+            if value is not None:
+                ttl = ttl(value) if callable(ttl) else ttl
+                with self._lock:
+                    if generation == self._generation:
+                        self._store(key, value, ttl)
+        return value
+
+    def invalidate(self, key):
+        """Removes `key` from the cache"""
+        with self._lock:
+            self._generation += 1
+            self._remove(key)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self):
+        """Size and hit/miss/eviction counters of the cache"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, value, ttl):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        self._persist(key, value, expires_at)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM cache WHERE key = ?", (json.dumps(key),)
+            )
+            self._db.commit()
+
+    def _persist(self, key, value, expires_at):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) "
+            "VALUES (?, ?, ?)",
+            (json.dumps(key), json.dumps(value), expires_at),
+        )
+        self._db.commit()
+
+    def _open(self, path):
+        """Opens the SQLite file and reloads the entries still valid"""
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+        now = time.time()
+        self._db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        rows = self._db.execute(
+            "SELECT key, value, expires_at FROM cache "
+            "ORDER BY expires_at DESC LIMIT ?",
+            (self.maxsize,),
+        ).fetchall()
+        self._db.commit()
+        for key, value, expires_at in reversed(rows):
+            self._entries[_as_key(json.loads(key))] = (
+                json.loads(value),
+                expires_at,
+            )
+
+
+def _as_key(key):
+    """JSON turns tuple keys into lists, which are not hashable"""
+    if isinstance(key, list):
+        return tuple(_as_key(part) for part in key)
+    return key
@@ -0,0 +1,343 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import xml.etree.ElementTree as ElementTree
+
+import polars as pl
+
+# Rows read and written at a time when streaming a catalog feed
+CHUNK_ROWS = 5000
+
+# Parsed files waiting for the writer before workers are held back
+MAX_PENDING_PER_WORKER = 2
+
+# Input each parse worker must have to be worth starting: a worker takes
+# about 0.2s to spawn, while polars parses CelesTrak CSV at ~80 MB/s
+PARALLEL_BYTES_PER_WORKER = 64 * 1024 * 1024
+
+# Element columns needed to initialise SGP4, keyed by their OMM field name
+ELEMENT_FIELDS = {
+    "OBJECT_ID": "object_id",
+    "EPOCH": "epoch",
+    "MEAN_MOTION": "mean_motion",
+    "ECCENTRICITY": "eccentricity",
+    "INCLINATION": "inclination",
+    "RA_OF_ASC_NODE": "ra_of_asc_node",
+    "ARG_OF_PERICENTER": "arg_of_pericenter",
+    "MEAN_ANOMALY": "mean_anomaly",
+    "EPHEMERIS_TYPE": "ephemeris_type",
+    "CLASSIFICATION_TYPE": "classification_type",
+    "ELEMENT_SET_NO": "element_set_no",
+    "REV_AT_EPOCH": "rev_at_epoch",
+    "BSTAR": "bstar",
+    "MEAN_MOTION_DOT": "mean_motion_dot",
+    "MEAN_MOTION_DDOT": "mean_motion_ddot",
+}
+
+# Types of the OMM fields stored for each satellite
+OMM_SCHEMA = {
+    "NORAD_CAT_ID": pl.Int64,
+    "OBJECT_NAME": pl.String,
+    "OBJECT_ID": pl.String,
+    "EPOCH": pl.String,
+    "MEAN_MOTION": pl.Float64,
+    "ECCENTRICITY": pl.Float64,
+    "INCLINATION": pl.Float64,
+    "RA_OF_ASC_NODE": pl.Float64,
+    "ARG_OF_PERICENTER": pl.Float64,
+    "MEAN_ANOMALY": pl.Float64,
+    "EPHEMERIS_TYPE": pl.Int64,
+    "CLASSIFICATION_TYPE": pl.String,
+    "ELEMENT_SET_NO": pl.Int64,
+    "REV_AT_EPOCH": pl.Int64,
+    "BSTAR": pl.Float64,
+    "MEAN_MOTION_DOT": pl.Float64,
+    "MEAN_MOTION_DDOT": pl.Float64,
+}
+
+
+def feed_format(path):
+    """Format of a catalog feed from its file name: "csv", "json" or
+    "xml", and whether it is gzipped"""
+    name = os.path.basename(path).lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-3]
+    extension = os.path.splitext(name)[1].lstrip(".")
+    if extension not in ("csv", "json", "xml"):
+        raise ValueError(f"Unsupported catalog feed: {path}")
+    return extension, compressed
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Yields a catalog feed as dataframes of OMM fields holding at most
+    about `chunk_rows` rows each, so the whole feed is never in memory.
+
+    CSV, OMM JSON (a CelesTrak FORMAT=json array) and OMM XML are read,
+    each optionally gzipped."""
+    extension, compressed = feed_format(path)
+    if extension == "csv" and not compressed:
+        yield from _csv_batches(path, chunk_rows)
+        return
+
+    opener = gzip.open if compressed else open
+    if extension == "csv":
+        with opener(path, "rt", newline="") as file:
+            yield from _frames(csv.DictReader(file), chunk_rows)
+    elif extension == "json":
+        with opener(path, "rt") as file:
+            yield from _frames(_json_objects(file), chunk_rows)
+    else:
+        with opener(path, "rb") as file:
+            yield from _frames(_xml_segments(file), chunk_rows)
+
+
+def _csv_batches(path, chunk_rows):
+    """Batches of a plain CSV from polars' batched reader, split to
+    `chunk_rows` since the reader only takes its batch size as a hint.
+    Columns get their OMM types rather than ones inferred from the
+    first rows, which may look like integers."""
+    reader = pl.read_csv_batched(
+        path, batch_size=chunk_rows, schema_overrides=_csv_schema(path)
+    )
+    while True:
+        batches = reader.next_batches(1)
+        if not batches:
+            return
+        yield from batches[0].iter_slices(chunk_rows)
+
+
+def _csv_schema(path):
+    """OMM types of the columns in a CSV file's header"""
+    with open(path, newline="") as file:
+        header = next(csv.reader(file), [])
+    return {
+        field: dtype for field, dtype in OMM_SCHEMA.items() if field in header
+    }
+
+
+def _frames(records, chunk_rows):
+    """Groups dicts of OMM fields into typed dataframes"""
+    rows = []
+    for record in records:
+        rows.append(record)
+        if len(rows) >= chunk_rows:
+            yield _typed_frame(rows)
+            rows = []
+    if rows:
+        yield _typed_frame(rows)
+
+
+def _typed_frame(rows):
+    """Dataframe of the OMM fields present in `rows`, cast to their
+    stored types. Values that don't parse become null and are reported;
+    rows without a valid NORAD id are dropped by catalog_columns."""
+    columns = {}
+    for field in (field for field in OMM_SCHEMA if field in rows[0]):
+        text = pl.Series(
+            [_text(row.get(field)) for row in rows], dtype=pl.String
+        )
+        columns[field] = text.cast(OMM_SCHEMA[field], strict=False)
+        invalid = columns[field].null_count() - text.null_count()
+        if invalid:
+            print(f"Skipped {invalid} invalid {field} values")
+    return pl.DataFrame(columns)
+
+
+def _text(value):
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+# Characters around and between the objects of a JSON array
+SEPARATORS = " \t\r\n,[]"
+
+
+def _json_objects(file, block_size=1 << 16):
+    """Objects of a top-level JSON array, decoded one at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    while True:
+        block = file.read(block_size)
+        buffer += block
+        position = 0
+        while True:
+            # Skip the separators between objects
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                started = started or buffer[position] == "["
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not block:
+                    raise
+                break  # the object continues in the next block
+            if not started:
+                raise ValueError("OMM JSON must be an array of objects")
+            yield record
+            position = end
+        buffer = buffer[position:]
+        if not block:
+            return
+
+
+def _xml_segments(file):
+    """OMM fields of each <omm> element of an NDM/OMM XML document.
+
+    Each <omm> is detached from its parent once read, so the document
+    tree never holds more than the element being parsed."""
+    parents = []
+    for event, element in ElementTree.iterparse(
+        file, events=("start", "end")
+    ):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if _local_name(element.tag) != "omm":
+            continue
+        yield {
+            _local_name(child.tag): child.text.strip()
+            for child in element.iter()
+            if len(child) == 0 and child.text and child.text.strip()
+        }
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def _local_name(tag):
+    """Tag name without its XML namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024)
+
+
+def pool_size(paths, workers=None):
+    """Parse workers worth starting for `paths`: at most `workers`
+    (defaults to one per core), one per file and one per
+    PARALLEL_BYTES_PER_WORKER of input, so small loads stay in process"""
+    total = sum(os.path.getsize(path) for path in paths)
+    return max(
+        min(
+            workers or os.cpu_count() or 1,
+            len(paths),
+            total // PARALLEL_BYTES_PER_WORKER,
+        ),
+        1,
+    )
+
+
+def parallel_parse(parse, items, workers=None, max_pending=None):
+    """Yields `parse(item)` for every item, in completion order, from a
+    pool of worker processes.
+
+    At most `max_pending` results are parsed but not yet consumed, so a
+    slow consumer such as a single database writer holds back the
+    workers instead of letting results pile up in memory. `parse` must
+    be importable by the workers. With one worker the items are parsed
+    in this process."""
+    items = list(items)
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        for item in items:
+            yield parse(item)
+        return
+
+    max_pending = max_pending or workers * MAX_PENDING_PER_WORKER
+    # Forked children can deadlock on locks held by polars' thread pool
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        queued = iter(items)
+        pending = set()
+        try:
+            while True:
+                for item in queued:
+                    pending.add(pool.submit(parse, item))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def read_catalog_csv(file_path):
+    """Reads a CelesTrak csv file into a dataframe of satellite ids and
+    names, with whichever element columns the file provides"""
+    df = pl.read_csv(file_path, schema_overrides=_csv_schema(file_path))
+    return catalog_columns(df)
+
+
+def catalog_columns(df):
+    """Renames the OMM fields of a catalog dataframe to satellite
+    columns, keeping the id, name and whichever element columns it
+    provides. Rows without a NORAD id are dropped, since SQLite would
+    otherwise store them under an invented id."""
+    valid = df.filter(pl.col("NORAD_CAT_ID").is_not_null())
+    if valid.height < df.height:
+        print(f"Skipped {df.height - valid.height} rows without a NORAD id")
+    return valid.select(
+        [
+            pl.col("NORAD_CAT_ID").alias("id"),
+            pl.col("OBJECT_NAME").alias("name"),
+        ]
+        + [
+            pl.col(header).alias(column)
+            for header, column in ELEMENT_FIELDS.items()
+            if header in valid.columns
+        ]
+    )
+
+
+def newest_element_sets(frames):
+    """Combines catalog dataframes, keeping one row per satellite: the
+    one with the latest (epoch, element_set_no)"""
+    df = pl.concat(frames, how="diagonal_relaxed")
+    if "epoch" in df.columns:
+        keys = ["id", "epoch"]
+        if "element_set_no" in df.columns:
+            keys.append("element_set_no")
+        df = df.sort(keys, nulls_last=False)
+    return df.unique(subset=["id"], keep="last", maintain_order=True)
+
+
+def file_digest(file_path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_catalog_file(job):
+    """Worker half of database.process_multiple_csv: hashes a group file
+    and, if it changed or `force` is set, reads it into a deduplicated
+    dataframe. It lives here so that workers only import polars.
+
+    `job` is (path, sha256 last ingested, force). Returns (path, sha256,
+    dataframe), with no dataframe for unchanged files."""
+    path, ingested, force = job
+    sha256 = file_digest(path)
+    if not force and ingested == sha256:
+        return path, sha256, None
+    return path, sha256, newest_element_sets([read_catalog_csv(path)])
@@ -1,97 +1,819 @@
-from sqlalchemy import create_engine, insert, func, select
+from sqlalchemy import (
+    create_engine,
+    event,
+    insert,
+    func,
+    select,
+    inspect,
+    literal,
+    or_,
+    bindparam,
+    text,
+    String,
+    true,
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from models import (
     satellite_table,
+    catalog_meta_table,
+    ingest_manifest_table,
+    satellite_group_table,
+    satellite_image_table,
     Base,
     country_table,
     user_table,
     user_satellite_table,
     user_country_table,
+    user_group_table,
 )
 from sqlalchemy.orm import sessionmaker
+from catalog_feed import (
+    CHUNK_ROWS,
+    ELEMENT_FIELDS,
+    catalog_columns,
+    iter_chunks,
+    newest_element_sets,
+    parallel_parse,
+    parse_catalog_file,
+    peak_rss_mb,
+    pool_size,
+    read_catalog_csv,
+)
 import polars as pl
-import sqlite3
+import os
+import re
+import threading
+import time
 from math import acos, pi, degrees
 
 # Define the SQLite database file
 DATABASE_FILE = "app_database.db"  # SQLite database file name
 DATABASE_URL = f"sqlite:///{DATABASE_FILE}"
 
-engine = create_engine(DATABASE_URL, echo=True)  # echo=True for logging
-Session = sessionmaker(bind=engine)
+# Connections kept open by the read-write and read-only pools
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+
+# Pragmas applied to every pooled connection. WAL lets searches read
+# while ingestion writes, and NORMAL sync is durable enough under WAL.
+SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,  # ms to wait for the write lock
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # in KiB, so 64 MiB
+    "temp_store": "MEMORY",
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(database_url=None, read_only=False):
+    """Returns the pooled engine of a database, creating it on first use.
+
+    Read-only engines have their own pool, so searches never wait for a
+    connection held by a writer, and reject writes."""
+    key = (database_url or DATABASE_URL, read_only)
+    with _engines_lock:
+        if key not in _engines:
+            engine = create_engine(
+                key[0],
+                pool_size=READ_POOL_SIZE if read_only else POOL_SIZE,
+                max_overflow=2 * POOL_SIZE,
+            )
+            event.listen(
+                engine,
+                "connect",
+                _query_only_connection if read_only else _tune_connection,
+            )
+            _engines[key] = engine
+        return _engines[key]
+
 
+def _tune_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
 
-def get_engine(database_url=None):
-    """Returns database engine"""
-    return create_engine(database_url or DATABASE_URL)
+
+def _query_only_connection(dbapi_connection, connection_record):
+    _tune_connection(dbapi_connection, connection_record)
+    dbapi_connection.execute("PRAGMA query_only = ON")
+
+
+engine = get_engine()
+read_engine = get_engine(read_only=True)
+Session = sessionmaker(bind=engine)
 
 
 def init_db(database_url=None):
     """Initializes the database by creating all tables defined
-    in the metadata"""
-    engine = create_engine(database_url or DATABASE_URL)
+    in the metadata, then migrating it to the current schema"""
+    engine = get_engine(database_url)
     Base.metadata.create_all(bind=engine)  # recreate all tables
+    migrate(engine)
 
 
-# Use satellite_table defined in models
-def read_and_insert_csv(file_path, engine):
-    """Reads a csv file and inserts selected columns into the database"""
-    # Read the CSV file using Polars
-    schema_overrides = {
-        "MEAN_MOTION_DDOT": pl.Float64,
-        # treat scientific notation as a float to stop errors
+def migrate(engine):
+    """Applies the migrations a database has not had yet, recording the
+    schema version reached in PRAGMA user_version. Returns that
+    version."""
+    with engine.connect() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        migration(engine)
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+        version = number
+    return version
+
+
+# Element set columns added to the satellite table by the first
+# migration, with their SQLite types
+ELEMENT_SET_COLUMNS = [
+    ("object_id", "VARCHAR"),
+    ("epoch", "VARCHAR"),
+    ("mean_motion", "FLOAT"),
+    ("eccentricity", "FLOAT"),
+    ("inclination", "FLOAT"),
+    ("ra_of_asc_node", "FLOAT"),
+    ("arg_of_pericenter", "FLOAT"),
+    ("mean_anomaly", "FLOAT"),
+    ("ephemeris_type", "INTEGER"),
+    ("classification_type", "VARCHAR"),
+    ("element_set_no", "INTEGER"),
+    ("rev_at_epoch", "INTEGER"),
+    ("bstar", "FLOAT"),
+    ("mean_motion_dot", "FLOAT"),
+    ("mean_motion_ddot", "FLOAT"),
+]
+
+# Indexes behind the hot lookups by name, created by the third migration
+LOOKUP_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_satellite_name ON satellite (name, id)",
+    "CREATE INDEX IF NOT EXISTS ix_country_name ON country (name)",
+    "CREATE INDEX IF NOT EXISTS ix_user_name_lower "
+    "ON user (lower(user_name))",
+    "CREATE INDEX IF NOT EXISTS ix_satellite_group_name "
+    "ON satellite_group (group_name, satellite_id)",
+]
+
+
+def add_element_columns(engine):
+    """Adds the element set columns to a satellite table created before
+    element sets were stored"""
+    existing = {
+        column["name"] for column in inspect(engine).get_columns("satellite")
     }
+    with engine.begin() as connection:
+        for name, column_type in ELEMENT_SET_COLUMNS:
+            if name not in existing:
+                connection.execute(
+                    text(
+                        f'ALTER TABLE satellite ADD COLUMN "{name}" '
+                        f"{column_type}"
+                    )
+                )
 
-    df = pl.read_csv(file_path, schema_overrides=schema_overrides)
 
-    # Select the required columns and rename them
-    selected_df = df.select(
-        [
-            pl.col("NORAD_CAT_ID").alias("id"),
-            pl.col("OBJECT_NAME").alias("name"),
-        ]
+def create_lookup_indexes(engine):
+    """Creates the indexes used by the name, country, username and group
+    lookups on tables created before they were declared"""
+    with engine.begin() as connection:
+        for statement in LOOKUP_INDEXES:
+            connection.execute(text(statement))
+
+
+# Functions called after each ingestion, so that in-memory copies of the
+# catalog can be rebuilt
+ingest_listeners = []
+
+
+def notify_ingest():
+    """Tells every ingest listener that the catalog has changed"""
+    for listener in ingest_listeners:
+        listener()
+
+
+def bump_catalog_version(connection):
+    """Increments the catalog version, as part of the ingestion
+    transaction running on `connection`"""
+    stmt = sqlite_insert(catalog_meta_table).values(key="version", value=1)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"value": catalog_meta_table.c.value + 1},
+        )
+    )
+
+
+def get_catalog_version(engine=None):
+    """Returns the catalog version, 0 before the first ingestion"""
+    stmt = select(catalog_meta_table.c.value).where(
+        catalog_meta_table.c.key == "version"
+    )
+    try:
+        with (engine or read_engine).connect() as connection:
+            version = connection.execute(stmt).scalar()
+    except OperationalError:
+        version = None  # created by init_db
+    return version or 0
+
+
+# Names searched by trigram full text indexes, as (table, index) pairs
+SEARCH_INDEXES = [("satellite", "satellite_fts"), ("country", "country_fts")]
+
+# Shorter terms have no trigram to match, so are searched with LIKE
+MIN_TRIGRAM_LENGTH = 3
+
+
+def create_search_index(engine):
+    """Creates the FTS5 trigram indexes over satellite and country names,
+    with triggers keeping them in sync with every insert, rename and
+    delete. A newly created index is filled from its table."""
+    with engine.begin() as connection:
+        for table, index in SEARCH_INDEXES:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                {"name": index},
+            ).first()
+            connection.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+                    f"name, content='{table}', content_rowid='rowid', "
+                    "tokenize='trigram')"
+                )
+            )
+            for statement in [
+                f"CREATE TRIGGER IF NOT EXISTS {index}_insert "
+                f"AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {index} (rowid, name) "
+                "VALUES (new.rowid, new.name); END",
+                f"CREATE TRIGGER IF NOT EXISTS {index}_delete "
+                f"AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {index} ({index}, rowid, name) "
+                "VALUES ('delete', old.rowid, old.name); END",
+                f"CREATE TRIGGER IF NOT EXISTS {index}_update "
+                f"AFTER UPDATE OF name ON {table} BEGIN "
+                f"INSERT INTO {index} ({index}, rowid, name) "
+                "VALUES ('delete', old.rowid, old.name); "
+                f"INSERT INTO {index} (rowid, name) "
+                "VALUES (new.rowid, new.name); END",
+            ]:
+                connection.execute(text(statement))
+            if not exists:
+                connection.execute(
+                    text(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+                )
+
+
+# Schema migrations in the order they were added. A database at version
+# n has had the first n applied; append new ones, never reorder or edit
+# them. Each step makes a fixed change, so new columns or indexes in
+# models.py need a new step to reach existing databases. Each must also
+# be safe on a database just created from the metadata.
+MIGRATIONS = [
+    add_element_columns,
+    create_search_index,
+    create_lookup_indexes,
+]
+
+
+def search_by_name(table, index, search_term, limit=5, engine=None):
+    """Rows of `table` whose name contains `search_term`, names starting
+    with it first and then shorter names first"""
+    params = {"term": search_term, "limit": limit}
+    order = (
+        f"ORDER BY instr(lower({table}.name), lower(:term)) != 1, "
+        f"length({table}.name), {table}.name LIMIT :limit"
     )
+    if len(search_term) >= MIN_TRIGRAM_LENGTH:
+        # Quoted, so the term is matched as a string rather than parsed
+        params["match"] = '"' + search_term.replace('"', '""') + '"'
+        query = (
+            f"SELECT {table}.* FROM {index} "
+            f"JOIN {table} ON {table}.rowid = {index}.rowid "
+            f"WHERE {index} MATCH :match {order}"
+        )
+    else:
+        params["like"] = "%" + search_term + "%"
+        query = f"SELECT * FROM {table} WHERE name LIKE :like {order}"
+    with (engine or read_engine).connect() as connection:
+        results = connection.execute(text(query), params).fetchall()
+    return [tuple(row) for row in results]
+
+
+def group_from_path(file_path):
+    """Group name of a CelesTrak group file, e.g. csvfiles/noaa1.csv ->
+    noaa"""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return re.sub(r"\d+$", "", stem).lower()
+
+
+# Orbit class of a satellite from its mean motion (revolutions per day)
+# and eccentricity: LEO below ~2,000 km (periods under 128 minutes), GEO
+# at one revolution per sidereal day, HEO for highly elliptical orbits
+ORBIT_CLASS_SQL = (
+    "CASE WHEN {s}.mean_motion IS NULL THEN NULL "
+    "WHEN {s}.eccentricity >= 0.25 THEN 'HEO' "
+    "WHEN {s}.mean_motion >= 11.25 THEN 'LEO' "
+    "WHEN {s}.mean_motion BETWEEN 0.99 AND 1.01 THEN 'GEO' "
+    "ELSE 'MEO' END"
+)
+ORBIT_CLASSES = ("LEO", "MEO", "GEO", "HEO")
+
+# Exact names rank first, then names starting with the term, then names
+# merely containing it
+RANK_SQL = (
+    "CASE WHEN lower({name}) = lower(:term) THEN 0 "
+    "WHEN instr(lower({name}), lower(:term)) = 1 THEN 1 ELSE 2 END"
+)
 
-    # Convert to a list of dictionaries for insertion
-    data = selected_df.to_dicts()
+
+def match_rank(name, term):
+    """Python version of RANK_SQL, used to resume after a cursor"""
+    name, term = name.lower(), term.lower()
+    if name == term:
+        return 0
+    return 1 if name.startswith(term) else 2
+
+
+def _match_clause(table, index, alias, term, params):
+    """FROM and WHERE clauses matching names containing `term`, using the
+    trigram index when the term is long enough"""
+    if not term:
+        return f"FROM {table} {alias}", []
+    params["term"] = term
+    if len(term) >= MIN_TRIGRAM_LENGTH:
+        params["match"] = '"' + term.replace('"', '""') + '"'
+        return (
+            f"FROM {index} JOIN {table} {alias} "
+            f"ON {alias}.rowid = {index}.rowid",
+            [f"{index} MATCH :match"],
+        )
+    params["like"] = "%" + term + "%"
+    return f"FROM {table} {alias}", [f"{alias}.name LIKE :like"]
+
+
+def search_satellites(
+    term="", group=None, orbit_class=None, after=None, limit=20,
+    engine=None,
+):
+    """Page of satellites whose name contains `term`, ranked exact >
+    prefix > substring and then by name and id.
+
+    `after` is the (name, id) of the last satellite of the previous page.
+    Pages resume from it with a keyset condition instead of an OFFSET.
+    Returns the satellites as dicts, and the cursor of the next page or
+    None on the last page."""
+    params = {"limit": limit + 1}
+    source, where = _match_clause(
+        "satellite", "satellite_fts", "s", term, params
+    )
+    rank = RANK_SQL.format(name="s.name") if term else "0"
+    order = f"{rank}, s.name, s.id" if term else "s.name, s.id"
+    where.append("s.name IS NOT NULL")
+    if group:
+        params["group"] = group
+        where.append(
+            "EXISTS (SELECT 1 FROM satellite_group g WHERE "
+            "g.satellite_id = s.id AND g.group_name = :group)"
+        )
+    if orbit_class:
+        params["orbit_class"] = orbit_class
+        where.append(f"{ORBIT_CLASS_SQL.format(s='s')} = :orbit_class")
+    if after:
+        after_name, after_id = after
+        params.update(
+            after_rank=match_rank(after_name, term) if term else 0,
+            after_name=after_name,
+            after_id=after_id,
+        )
+        where.append(
+            f"({order}) > (:after_rank, :after_name, :after_id)"
+            if term
+            else "(s.name, s.id) > (:after_name, :after_id)"
+        )
+
+    # Rank and page first, so orbit classes and groups are only looked up
+    # for the satellites returned
+    query = (
+        f"SELECT p.id, p.name, {ORBIT_CLASS_SQL.format(s='p')}, "
+        "(SELECT group_concat(group_name) FROM satellite_group g "
+        "WHERE g.satellite_id = p.id) FROM ("
+        "SELECT s.id, s.name, s.mean_motion, s.eccentricity, "
+        f"{rank} AS rank {source} WHERE {' AND '.join(where)} "
+        f"ORDER BY {order} LIMIT :limit) p "
+        "ORDER BY p.rank, p.name, p.id"
+    )
+    with (engine or read_engine).connect() as connection:
+        rows = connection.execute(text(query), params).fetchall()
+
+    satellites = [
+        {
+            "id": id,
+            "name": name,
+            "orbit_class": orbit,
+            "groups": sorted(groups.split(",")) if groups else [],
+        }
+        for id, name, orbit, groups in rows[:limit]
+    ]
+    next_after = None
+    if len(rows) > limit:
+        next_after = (satellites[-1]["name"], satellites[-1]["id"])
+    return satellites, next_after
+
+
+def search_countries(term="", after=None, limit=20, engine=None):
+    """Page of countries whose name contains `term`, ranked like
+    search_satellites. `after` is the (name, code) of the last country
+    of the previous page."""
+    params = {"limit": limit + 1}
+    source, where = _match_clause("country", "country_fts", "c", term, params)
+    rank = RANK_SQL.format(name="c.name") if term else "0"
+    order = f"{rank}, c.name, c.country" if term else "c.name, c.country"
+    where.append("c.name IS NOT NULL")
+    if after:
+        after_name, after_code = after
+        params.update(
+            after_rank=match_rank(after_name, term) if term else 0,
+            after_name=after_name,
+            after_code=after_code,
+        )
+        where.append(
+            f"({order}) > (:after_rank, :after_name, :after_code)"
+            if term
+            else "(c.name, c.country) > (:after_name, :after_code)"
+        )
+
+    query = (
+        "SELECT c.country, c.name, c.latitude, c.longitude "
+        f"{source} WHERE {' AND '.join(where)} "
+        f"ORDER BY {order} LIMIT :limit"
+    )
+    with (engine or read_engine).connect() as connection:
+        rows = connection.execute(text(query), params).fetchall()
+
+    countries = [
+        {"code": code, "name": name, "latitude": lat, "longitude": lon}
+        for code, name, lat, lon in rows[:limit]
+    ]
+    next_after = None
+    if len(rows) > limit:
+        next_after = (countries[-1]["name"], countries[-1]["code"])
+    return countries, next_after
+
+
+# Most ids bound in one IN clause when comparing a chunk with what is
+# stored, under SQLite's limit on bound parameters
+LOOKUP_BATCH = 900
+
+
+def _element_key(row):
+    """Sort key of an element set, older sets first"""
+    set_no = row.get("element_set_no")
+    return (row.get("epoch") or "", -1 if set_no is None else set_no)
+
+
+def ingest_element_sets(connection, df, memberships=()):
+    """Inserts new satellites and replaces stored element sets with newer
+    ones from a deduplicated catalog dataframe, then records the
+    (satellite_id, group_name) `memberships` not stored yet.
+
+    Rows are compared with what is stored for the same ids on (id,
+    epoch, element_set_no) first, so only new and changed satellites are
+    written and the work is bounded by the size of `df`. Returns the ids
+    of the satellites written and the number of memberships written."""
+    sat = satellite_table.c
+    stored = {
+        row.id: {"epoch": row.epoch, "element_set_no": row.element_set_no}
+        for ids in _batches(df["id"].to_list())
+        for row in connection.execute(
+            select(sat.id, sat.epoch, sat.element_set_no).where(
+                sat.id.in_(ids)
+            )
+        )
+    }
+    has_epoch = "epoch" in df.columns
+    changed = [
+        row
+        for row in df.to_dicts()
+        if row["id"] not in stored
+        or (
+            has_epoch
+            and row["epoch"] is not None
+            and _element_key(row) > _element_key(stored[row["id"]])
+        )
+    ]
+
+    if changed:
+        stmt = sqlite_insert(satellite_table)
+        element_columns = [
+            column
+            for column in df.columns
+            if column in ELEMENT_FIELDS.values()
+        ]
+        if element_columns:
+            # Guards against a newer set written since the comparison
+            excluded = stmt.excluded
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={column: excluded[column] for column in element_columns},
+                where=sat.epoch.is_(None)
+                | (excluded.epoch > sat.epoch)
+                | (
+                    (excluded.epoch == sat.epoch)
+                    & (
+                        func.coalesce(excluded.element_set_no, -1)
+                        > func.coalesce(sat.element_set_no, -1)
+                    )
+                ),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+        connection.execute(stmt, changed)
+
+    memberships = list(dict.fromkeys(memberships))
+    group = satellite_group_table.c
+    existing = {
+        row
+        for ids in _batches(list({member[0] for member in memberships}))
+        for row in connection.execute(
+            select(group.satellite_id, group.group_name).where(
+                group.satellite_id.in_(ids)
+            )
+        )
+    }
+    new_memberships = [
+        {"satellite_id": satellite_id, "group_name": group_name}
+        for satellite_id, group_name in memberships
+        if (satellite_id, group_name) not in existing
+    ]
+    if new_memberships:
+        connection.execute(insert(satellite_group_table), new_memberships)
+
+    if changed or new_memberships:
+        bump_catalog_version(connection)
+    return [row["id"] for row in changed], len(new_memberships)
+
+
+def _batches(values, size=LOOKUP_BATCH):
+    """Splits values into lists short enough to bind in one IN clause"""
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def stream_catalog(path, engine=None, group=None, chunk_rows=CHUNK_ROWS):
+    """Ingests a catalog feed of any size in bounded chunks.
+
+    The feed (CSV, OMM JSON or OMM XML, optionally gzipped) is read
+    `chunk_rows` at a time and each chunk is written in its own
+    transaction, so memory stays flat however large the feed is. Only
+    new and newer element sets are written, and rows without a valid
+    NORAD id are rejected. Returns the rows read, rejected and written
+    with the throughput and peak RSS of the run."""
+    engine = engine or get_engine()
+    start = time.perf_counter()
+    rows = written = grouped = rejected = 0
+    for chunk in iter_chunks(path, chunk_rows):
+        df = catalog_columns(chunk)
+        rows += df.height
+        rejected += chunk.height - df.height
+        memberships = (
+            [(satellite_id, group) for satellite_id in df["id"]]
+            if group
+            else []
+        )
+        with engine.begin() as connection:
+            chunk_written, chunk_grouped = ingest_element_sets(
+                connection, newest_element_sets([df]), memberships
+            )
+        written += len(chunk_written)
+        grouped += chunk_grouped
+    if written or grouped:
+        notify_ingest()
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "rejected": rejected,
+        "written": written,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Use satellite_table defined in models
+def read_and_insert_csv(file_path, engine, group=None):
+    """Reads a csv file and inserts satellites with their orbital
+    elements into the database, recording them as members of `group`
+    when one is given. Returns the number of satellites written."""
+    df = read_catalog_csv(file_path)
+    if df.is_empty():
+        return 0
+    memberships = (
+        [(satellite_id, group) for satellite_id in df["id"]] if group else []
+    )
 
     # Insert data into database
     with engine.connect() as connection:
         transaction = connection.begin()
         try:
-            connection.execute(
-                satellite_table.insert().prefix_with("OR IGNORE"),
-                data,
+            written, grouped = ingest_element_sets(
+                connection, newest_element_sets([df]), memberships
             )
             transaction.commit()
         except Exception as e:
             transaction.rollback()
             raise e
+    if written or grouped:
+        notify_ingest()
+    return len(written)
 
 
-def process_multiple_csv(files):
-    """Processes multiple csv files and inserts data into database"""
-    for file in files:
-        read_and_insert_csv(file, engine)
+def get_satellite_image(name, engine):
+    """Returns the stored image row for a satellite name, or None"""
+    stmt = select(satellite_image_table).where(
+        satellite_image_table.c.name == name
+    )
+    with engine.connect() as connection:
+        return connection.execute(stmt).mappings().first()
 
 
-def find_satellites_by_name(search_term):
-    connection = sqlite3.connect("app_database.db")
-    cursor = connection.cursor()
-    query = "SELECT * FROM satellite WHERE name LIKE ? LIMIT 5"
-    cursor.execute(query, ("%" + search_term + "%",))  # Match partial input
-    results = cursor.fetchall()
-    connection.close()
-    return results
+def save_satellite_image(name, url, found, fetched_at, engine):
+    """Stores the image URL looked up for a satellite name"""
+    values = {
+        "name": name,
+        "url": url,
+        "found": int(found),
+        "fetched_at": fetched_at,
+    }
+    stmt = sqlite_insert(satellite_image_table).values(values)
+    stmt = stmt.on_conflict_do_update(index_elements=["name"], set_=values)
+    with engine.begin() as connection:
+        connection.execute(stmt)
 
 
-def find_country_by_name(country_search):
-    connection = sqlite3.connect("app_database.db")
-    cursor = connection.cursor()
-    query = "SELECT * FROM country WHERE name LIKE ? LIMIT 5"
-    cursor.execute(query, ("%" + country_search + "%",))
-    results = cursor.fetchall()
-    connection.close()
-    return results
+def get_names_without_image(engine, found_after=0, not_found_after=0):
+    """Satellite names with no fresh stored image, in catalog order.
+    Images are fresh when fetched after `found_after`, and searches
+    without a result when made after `not_found_after`."""
+    image = satellite_image_table.c
+    with engine.connect() as connection:
+        stored = set(
+            connection.execute(
+                select(image.name).where(
+                    ((image.found == 1) & (image.fetched_at >= found_after))
+                    | (
+                        (image.found == 0)
+                        & (image.fetched_at >= not_found_after)
+                    )
+                )
+            ).scalars()
+        )
+        names = connection.execute(
+            select(satellite_table.c.name)
+            .where(satellite_table.c.name.isnot(None))
+            .order_by(satellite_table.c.id)
+        ).scalars()
+
+        missing = []
+        for name in names:
+            name = name.strip().upper()
+            if name not in stored:
+                stored.add(name)
+                missing.append(name)
+    return missing
+
+
+def process_multiple_csv(files, engine=None, force=False, workers=None):
+    """Refreshes the catalog from CelesTrak group files.
+
+    Files are hashed and parsed by a pool of up to `workers` processes
+    (defaults to one per core) while this process, the only writer,
+    ingests each parsed file as it arrives. The pool is only started
+    for inputs large enough to repay starting it (see pool_size).
+    Parsed files wait in a bounded queue, so workers pause when the
+    writer falls behind. Files whose contents have not changed since
+    they were last ingested are skipped, unless `force` is set. Every
+    satellite keeps its newest element set, and the whole refresh is
+    written in one transaction. Returns counts of the files read and
+    skipped and of the satellites written."""
+    engine = engine or get_engine()
+    manifest = ingest_manifest_table.c
+    with engine.connect() as connection:
+        ingested = dict(
+            connection.execute(select(manifest.path, manifest.sha256)).all()
+        )
+    paths = [os.path.normpath(file) for file in files]
+    jobs = [(path, ingested.get(path), force) for path in paths]
+
+    written, grouped, entries = set(), 0, []
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            for path, sha256, df in parallel_parse(
+                parse_catalog_file, jobs, pool_size(paths, workers)
+            ):
+                if df is None:
+                    continue
+                group = group_from_path(path)
+                if not df.is_empty():
+                    file_written, file_grouped = ingest_element_sets(
+                        connection,
+                        df,
+                        [(satellite_id, group) for satellite_id in df["id"]],
+                    )
+                    written.update(file_written)
+                    grouped += file_grouped
+                entries.append(
+                    {
+                        "path": path,
+                        "sha256": sha256,
+                        "rows": df.height,
+                        "ingested_at": time.time(),
+                    }
+                )
+
+            if entries:
+                stmt = sqlite_insert(ingest_manifest_table)
+                connection.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["path"],
+                        set_={
+                            column: stmt.excluded[column]
+                            for column in ("sha256", "rows", "ingested_at")
+                        },
+                    ),
+                    entries,
+                )
+            transaction.commit()
+        except Exception as e:
+            transaction.rollback()
+            raise e
+    if written or grouped:
+        notify_ingest()
+
+    return {
+        "files": len(entries),
+        "skipped": len(files) - len(entries),
+        "written": len(written),
+    }
+
+
+def find_satellites_by_name(search_term, engine=None):
+    """Satellites whose name contains the search term, best matches
+    first"""
+    return search_by_name(
+        "satellite", "satellite_fts", search_term, engine=engine
+    )
+
+
+def find_country_by_name(country_search, engine=None):
+    """Countries whose name contains the search term, best matches
+    first"""
+    return search_by_name(
+        "country", "country_fts", country_search, engine=engine
+    )
+
+
+def get_country_by_name(country_name, engine=None):
+    """Returns the country row with this exact name, or None"""
+    stmt = select(country_table).where(country_table.c.name == country_name)
+    with (engine or read_engine).connect() as connection:
+        return connection.execute(stmt).fetchone()
+
+
+def get_countries(engine=None):
+    """Coordinates and search radius of every country"""
+    stmt = select(
+        country_table.c.name,
+        country_table.c.latitude,
+        country_table.c.longitude,
+        country_table.c.above_angle,
+    )
+    with (engine or read_engine).connect() as connection:
+        return [dict(row) for row in connection.execute(stmt).mappings()]
+
+
+# Columns returned by get_satellite_elements
+ELEMENT_COLUMNS = ["id", "name"] + list(ELEMENT_FIELDS.values())
+
+
+def get_satellite_elements(satellite_id, engine=None):
+    """Returns the id, name and element set columns of a satellite as a
+    dict, or None if it is not in the catalog"""
+    stmt = select(
+        *[satellite_table.c[column] for column in ELEMENT_COLUMNS]
+    ).where(satellite_table.c.id == satellite_id)
+    with (engine or read_engine).connect() as connection:
+        result = connection.execute(stmt).fetchone()
+    return dict(zip(ELEMENT_COLUMNS, result)) if result else None
 
 
 def calculate_above_angle(country_area):
@@ -165,7 +887,9 @@ def populate_country_table(csv_file_path, area_csv_file_path, engine):
             transaction = connection.begin()
             try:
                 connection.execute(insert(country_table), countries)
+                bump_catalog_version(connection)
                 transaction.commit()
+                notify_ingest()
             except Exception as e:
                 transaction.rollback()
                 print(f"Error committing to database: {e}")
@@ -185,42 +909,37 @@ if __name__ == "__main__":
         "csvfiles/galileo1.csv",
         "csvfiles/starlink1.csv",
     ]
-    process_multiple_csv(csv_files)
+    print(process_multiple_csv(csv_files))
 
     populate_country_table("csvfiles/countries.csv",
                            "csvfiles/country_area.csv", engine)
 
 
 # Helper function to get satellite name by id
-def get_satellite_by_id(satellite_id):
-    session = Session()  # Use SQLAlchemy session for consistency
+def get_satellite_by_id(satellite_id, engine=None):
+    """Returns the id of the satellite with this NORAD id if it is in
+    the catalog, or None"""
     try:
-        # Query the satellite by name (case-insensitive search)
-        stmt = select(satellite_table).where(
-            func.lower(satellite_table.c.id) == satellite_id.lower()
-        )
-        result = session.execute(stmt).fetchone()
-        if result:
-            return result.id  # Assuming result contains an 'id' field
+        satellite_id = int(satellite_id)
+    except (TypeError, ValueError):
         return None
-    except Exception as e:
-        print(f"Error finding satellite by name: {e}")
-        return None  # Return None if an error occurs
-    finally:
-        session.close()
-
-
-def get_satellite_id_by_name(satellite_name):
-    connection = sqlite3.connect("app_database.db")
-    cursor = connection.cursor()
+    # Compared as is, so the lookup stays on the primary key
+    stmt = select(satellite_table.c.id).where(
+        satellite_table.c.id == satellite_id
+    )
+    with (engine or read_engine).connect() as connection:
+        return connection.execute(stmt).scalar()
 
-    # Query to find the satellite by its name
-    query = "SELECT id FROM satellite WHERE name = ? LIMIT 1"
-    cursor.execute(query, (satellite_name,))  # Match exact name
-    result = cursor.fetchone()
 
-    # Close the connection
-    connection.close()
+def get_satellite_id_by_name(satellite_name, engine=None):
+    """Returns the id of the satellite with this exact name, or None"""
+    stmt = (
+        select(satellite_table.c.id)
+        .where(satellite_table.c.name == satellite_name)
+        .limit(1)
+    )
+    with (engine or read_engine).connect() as connection:
+        result = connection.execute(stmt).fetchone()
 
     # If a satellite is found, return its ID
     if result:
@@ -272,271 +991,404 @@ def check_username_exists(username):
         session.close()
 
 
-# Function to add a satellite to a user (by satellite name or ID)
-def add_satellite_to_user(username, satellite_name):
-    session = Session()
-    try:
-        # Find the user by username using raw user_table
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        user_result = session.execute(stmt).fetchone()
-        if not user_result:
-            raise ValueError(f"User '{username}' not found")
-
-        user_id = user_result.id  # Extract the user_id
-
-        # Find satellite by name
-        satellite_id = get_satellite_id_by_name(satellite_name)
-        print(f"Satellite ID found: {satellite_id}")
-        if not satellite_id:
-            raise ValueError("Satellite not found")
-
-        # Check if the user is already tracking this satellite
-        check_stmt = select(user_satellite_table).where(
-            user_satellite_table.c.user_id == user_id,
-            user_satellite_table.c.satellite_id == satellite_id,
-        )
-        is_tracking = session.execute(check_stmt).fetchone()
+def _user_id(username):
+    """Scalar subquery of the id of the user with this name"""
+    return (
+        select(user_table.c.id)
+        .where(user_table.c.user_name == username)
+        .scalar_subquery()
+    )
 
-        if is_tracking:
-            raise ValueError("Satellite already tracked by user")
 
-        # Insert the relationship into the user_satellite table
-        insert_stmt = insert(user_satellite_table).values(
-            user_id=user_id, satellite_id=satellite_id
-        )
-        session.execute(insert_stmt)
-        session.commit()
+def _satellite_id(satellite_name):
+    """Scalar subquery of the id of the first satellite with this name"""
+    return (
+        select(satellite_table.c.id)
+        .where(satellite_table.c.name == satellite_name)
+        .limit(1)
+        .scalar_subquery()
+    )
 
-        print(
-            f"Satellite '{satellite_name}' successfully "
-            f"added to user '{username}'"
-        )
 
-    except ValueError as ve:
-        print(f"Error: {ve}")
-        raise  # Re-raise for higher-level error handling if needed
-    except Exception as e:
-        session.rollback()
-        print(f"Error: {e}")
-        raise  # Re-raise for higher-level error handling if needed
-    finally:
-        session.close()
+def _exists(connection, column, value):
+    """Whether any row has `value` in `column`"""
+    stmt = select(select(column).where(column == value).exists())
+    return connection.execute(stmt).scalar()
 
 
-def add_country_to_user(username, country_name):
-    session = Session()
-    try:
-        # Find the user by username using raw user_table
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        user_result = session.execute(stmt).fetchone()
-        if not user_result:
-            raise ValueError(f"User '{username}' not found")
+# Tracked satellites listed per account page
+TRACKED_PAGE_SIZE = 60
 
-        user_id = user_result.id  # Extract the user_id
+# Satellites tracked by :user_id, directly or through a group. CROSS JOIN
+# makes SQLite start from the user's few groups and look their members up
+# by index, rather than scan every group membership.
+TRACKED_IDS_SQL = (
+    "SELECT satellite_id FROM user_satellite WHERE user_id = :user_id "
+    "UNION SELECT g.satellite_id FROM user_group ug "
+    "CROSS JOIN satellite_group g ON g.group_name = ug.group_name "
+    "WHERE ug.user_id = :user_id"
+)
 
-        # Check if the user is already tracking this country
-        check_stmt = select(user_country_table).where(
-            user_country_table.c.user_id == user_id,
-            user_country_table.c.country_name == country_name,
-        )
-        is_tracking = session.execute(check_stmt).fetchone()
 
-        if is_tracking:
-            raise ValueError("Country already tracked by user")
+def _tracked_satellites(
+    connection, user_id, after=None, limit=TRACKED_PAGE_SIZE
+):
+    """Page of the satellites tracked by a user, directly or through a
+    group, ordered by name and id. `after` is the (name, id) of the last
+    satellite of the previous page. Returns the satellites as dicts of id
+    and name, and the cursor of the next page or None."""
+    params = {"user_id": user_id, "limit": limit + 1}
+    where = ""
+    if after:
+        params.update(after_name=after[0], after_id=after[1])
+        where = "AND (ifnull(s.name, ''), s.id) > (:after_name, :after_id) "
+    query = (
+        f"SELECT s.id, s.name FROM satellite s "
+        f"WHERE s.id IN ({TRACKED_IDS_SQL}) {where}"
+        "ORDER BY ifnull(s.name, ''), s.id LIMIT :limit"
+    )
+    rows = connection.execute(text(query), params).fetchall()
+    return _satellite_page(rows, limit)
+
+
+def _satellite_page(rows, limit):
+    """Splits (id, name) rows fetched with `limit + 1` into a page and the
+    cursor of the next page"""
+    satellites = [{"id": id, "name": name} for id, name in rows[:limit]]
+    next_after = None
+    if len(rows) > limit:
+        next_after = (satellites[-1]["name"] or "", satellites[-1]["id"])
+    return satellites, next_after
+
+
+def get_tracked_satellites(
+    username, after=None, limit=TRACKED_PAGE_SIZE, engine=None
+):
+    """Page of the satellites a user tracks, see _tracked_satellites"""
+    with (engine or read_engine).connect() as connection:
+        user_id = connection.execute(select(_user_id(username))).scalar()
+        if user_id is None:
+            raise ValueError("User not found")
+        return _tracked_satellites(connection, user_id, after, limit)
 
-        # Insert the relationship into the user_country table
-        insert_stmt = insert(user_country_table).values(
-            user_id=user_id, country_name=country_name
-        )
-        session.execute(insert_stmt)
-        session.commit()
 
-        print(
-            f"Country '{country_name}' successfully added to user '{username}'"
+def _tracked_countries(connection, user_id):
+    """Countries tracked by a user, as dicts of their name"""
+    stmt = (
+        select(country_table.c.name)
+        .join(
+            user_country_table,
+            user_country_table.c.country_name == country_table.c.name,
         )
+        .where(user_country_table.c.user_id == user_id)
+    )
+    return [{"name": country[0]} for country in connection.execute(stmt)]
+
+
+# Function to add a satellite to a user (by satellite name)
+def add_satellite_to_user(username, satellite_name, engine=None):
+    """Starts tracking a satellite for a user and returns the first page
+    of the satellites they now track, with the next page cursor.
+
+    The pair is inserted by one INSERT ... SELECT that resolves both ids,
+    so the usual case is a single statement. Only when nothing is
+    inserted are the lookups run, to report why."""
+    insert_stmt = (
+        sqlite_insert(user_satellite_table)
+        .from_select(
+            ["user_id", "satellite_id"],
+            select(user_table.c.id, satellite_table.c.id)
+            .select_from(user_table.join(satellite_table, true()))
+            .where(
+                user_table.c.user_name == username,
+                satellite_table.c.name == satellite_name,
+            )
+            .limit(1),
+        )
+        .on_conflict_do_nothing()
+        .returning(user_satellite_table.c.user_id)
+    )
+    try:
+        with (engine or get_engine()).begin() as connection:
+            inserted = connection.execute(insert_stmt).fetchone()
+            if not inserted:
+                if not _exists(connection, user_table.c.user_name, username):
+                    raise ValueError(f"User '{username}' not found")
+                name = satellite_table.c.name
+                if not _exists(connection, name, satellite_name):
+                    raise ValueError("Satellite not found")
+                raise ValueError("Satellite already tracked by user")
+            return _tracked_satellites(connection, inserted.user_id)
 
     except ValueError as ve:
         print(f"Error: {ve}")
         raise  # Re-raise for higher-level error handling if needed
     except Exception as e:
-        session.rollback()
         print(f"Error: {e}")
         raise  # Re-raise for higher-level error handling if needed
-    finally:
-        session.close()
-
 
-def delete_satellite_from_user(username, satellite_name):
-    session = Session()
-    try:
-        # Find the user by username
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        user_result = session.execute(stmt).fetchone()
-        if not user_result:
-            raise ValueError(f"User '{username}' not found")
 
-        user_id = user_result.id  # Extract the user_id
-
-        # Find satellite by name
-        satellite_id = get_satellite_id_by_name(satellite_name)
-        if not satellite_id:
-            raise ValueError("Satellite not found")
-
-        # Check if the user is tracking this satellite
-        check_stmt = select(user_satellite_table).where(
-            user_satellite_table.c.user_id == user_id,
-            user_satellite_table.c.satellite_id == satellite_id,
+def add_country_to_user(username, country_name, engine=None):
+    """Starts tracking a country for a user and returns the countries
+    they now track"""
+    insert_stmt = (
+        sqlite_insert(user_country_table)
+        .from_select(
+            ["user_id", "country_name"],
+            select(user_table.c.id, literal(country_name, String)).where(
+                user_table.c.user_name == username
+            ),
         )
-        is_tracking = session.execute(check_stmt).fetchone()
+        .on_conflict_do_nothing()
+        .returning(user_country_table.c.user_id)
+    )
+    try:
+        with (engine or get_engine()).begin() as connection:
+            inserted = connection.execute(insert_stmt).fetchone()
+            if not inserted:
+                if not _exists(connection, user_table.c.user_name, username):
+                    raise ValueError(f"User '{username}' not found")
+                raise ValueError("Country already tracked by user")
+            return _tracked_countries(connection, inserted.user_id)
 
-        if not is_tracking:
-            raise ValueError("Satellite is not currently tracked by user")
+    except ValueError as ve:
+        print(f"Error: {ve}")
+        raise  # Re-raise for higher-level error handling if needed
+    except Exception as e:
+        print(f"Error: {e}")
+        raise  # Re-raise for higher-level error handling if needed
 
-        # Delete the relationship from the user_satellite table
-        delete_stmt = user_satellite_table.delete().where(
-            user_satellite_table.c.user_id == user_id,
-            user_satellite_table.c.satellite_id == satellite_id,
-        )
-        session.execute(delete_stmt)
-        session.commit()
 
-        print(
-            f"Satellite '{satellite_name}' successfully "
-            f"deleted from user '{username}'"
+def delete_satellite_from_user(username, satellite_name, engine=None):
+    """Stops tracking a satellite for a user and returns the first page
+    of the satellites they still track with the next page cursor, or None
+    if nothing was deleted"""
+    delete_stmt = (
+        user_satellite_table.delete()
+        .where(
+            user_satellite_table.c.user_id == _user_id(username),
+            user_satellite_table.c.satellite_id
+            == _satellite_id(satellite_name),
         )
+        .returning(user_satellite_table.c.user_id)
+    )
+    try:
+        with (engine or get_engine()).begin() as connection:
+            deleted = connection.execute(delete_stmt).fetchone()
+            if not deleted:
+                if not _exists(connection, user_table.c.user_name, username):
+                    raise ValueError(f"User '{username}' not found")
+                name = satellite_table.c.name
+                if not _exists(connection, name, satellite_name):
+                    raise ValueError("Satellite not found")
+                raise ValueError("Satellite is not currently tracked by user")
+            return _tracked_satellites(connection, deleted.user_id)
     except Exception as e:
-        session.rollback()
         print(f"Error deleting satellite: {e}")
-    finally:
-        session.close()
-
-
-def delete_country_from_user(username, country_name):
-    session = Session()
-    try:
-        # Find the user by username
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        user_result = session.execute(stmt).fetchone()
-        if not user_result:
-            raise ValueError(f"User '{username}' not found")
-
-        user_id = user_result.id  # Extract user_id
-
-        # Find country by name directly (no need for country_id)
-        country_stmt = select(country_table).filter(
-            country_table.c.name == country_name
-        )
-        country_result = session.execute(country_stmt).fetchone()
-
-        if not country_result:
-            raise ValueError("Country not found")
-
-        # Assuming the country name is unique, we don't need the country_id.
-        # Check if the user is tracking this country
-        check_stmt = select(user_country_table).where(
-            user_country_table.c.user_id == user_id,
-            user_country_table.c.country_name
-            == country_name,  # Use country_name directly
-        )
-        is_tracking = session.execute(check_stmt).fetchone()
+        return None
 
-        if not is_tracking:
-            raise ValueError("Country is not currently tracked by user")
 
-        # Delete the relationship from the user_country table
-        delete_stmt = user_country_table.delete().where(
-            user_country_table.c.user_id == user_id,
-            user_country_table.c.country_name
-            == country_name,  # Use country_name directly
-        )
-        session.execute(delete_stmt)
-        session.commit()
-
-        print(
-            f"Country '{country_name}' successfully deleted from user "
-            f"'{username}'"
+def delete_country_from_user(username, country_name, engine=None):
+    """Stops tracking a country for a user and returns the countries
+    they still track, or None if nothing was deleted"""
+    delete_stmt = (
+        user_country_table.delete()
+        .where(
+            user_country_table.c.user_id == _user_id(username),
+            user_country_table.c.country_name == country_name,
+            select(country_table)
+            .where(country_table.c.name == country_name)
+            .exists(),
         )
+        .returning(user_country_table.c.user_id)
+    )
+    try:
+        with (engine or get_engine()).begin() as connection:
+            deleted = connection.execute(delete_stmt).fetchone()
+            if not deleted:
+                if not _exists(connection, user_table.c.user_name, username):
+                    raise ValueError(f"User '{username}' not found")
+                if not _exists(connection, country_table.c.name, country_name):
+                    raise ValueError("Country not found")
+                raise ValueError("Country is not currently tracked by user")
+            return _tracked_countries(connection, deleted.user_id)
     except Exception as e:
-        session.rollback()
         print(f"Error deleting country: {e}")
-    finally:
-        session.close()
+        return None
 
 
-def get_user_satellites(username):
-    session = Session()
-    try:
-        # Find the user by username using the raw user_table, not a User object
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        result = session.execute(stmt).first()
+# Largest integer SQLite can bind
+MAX_SQLITE_INTEGER = 2**63 - 1
 
-        if not result:
-            raise ValueError("User not found")
-
-        user_id = result.id  # Extract the user_id
 
-        # Query to get all satellites for the user
-        satellites_stmt = (
-            select(satellite_table)
-            .join(user_satellite_table)
-            .filter(user_satellite_table.c.user_id == user_id)
+def _satellite_keys(satellites):
+    """Bind parameters matching each satellite by NORAD id or by name,
+    raising ValueError for ids SQLite can't hold"""
+    params = []
+    for satellite in satellites:
+        key = str(satellite).strip()
+        if key.isascii() and key.isdigit():
+            if int(key) > MAX_SQLITE_INTEGER:
+                raise ValueError(f"Invalid NORAD id: {key}")
+            params.append({"id": int(key), "name": None})
+        else:
+            params.append({"id": None, "name": key})
+    return params
+
+
+def _resolve_user(connection, username):
+    user_id = connection.execute(select(_user_id(username))).scalar()
+    if user_id is None:
+        raise ValueError(f"User '{username}' not found")
+    return user_id
+
+
+def track_satellites(username, satellites, engine=None):
+    """Starts tracking many satellites, given by name or NORAD id, for a
+    user in one transaction. Unknown and already tracked satellites are
+    skipped.
+
+    Returns the number of satellites added, and the first page of the
+    tracked satellites with the next page cursor."""
+    keys = _satellite_keys(satellites)
+    with (engine or get_engine()).begin() as connection:
+        user_id = _resolve_user(connection, username)
+        if not keys:
+            return 0, _tracked_satellites(connection, user_id)
+        insert_stmt = (
+            sqlite_insert(user_satellite_table)
+            .from_select(
+                ["user_id", "satellite_id"],
+                select(literal(user_id), satellite_table.c.id)
+                .where(
+                    or_(
+                        satellite_table.c.id == bindparam("id"),
+                        satellite_table.c.name == bindparam("name"),
+                    )
+                )
+                .limit(1),
+            )
+            .on_conflict_do_nothing()
         )
-        satellites = session.execute(satellites_stmt).all()
-
-        # Return the satellites as a list of dicts
-        return [
-            {"id": satellite.id, "name": satellite.name}
-            for satellite in satellites
-        ]
+        # One executemany over every name, with one row per satellite
+        added = connection.execute(insert_stmt, keys).rowcount
+        return added, _tracked_satellites(connection, user_id)
+
+
+def untrack_satellites(username, satellites, engine=None):
+    """Stops tracking many satellites, given by name or NORAD id, for a
+    user in one transaction. Returns the number removed, and the first
+    page of the tracked satellites with the next page cursor."""
+    keys = _satellite_keys(satellites)
+    with (engine or get_engine()).begin() as connection:
+        user_id = _resolve_user(connection, username)
+        if not keys:
+            return 0, _tracked_satellites(connection, user_id)
+        delete_stmt = user_satellite_table.delete().where(
+            user_satellite_table.c.user_id == user_id,
+            user_satellite_table.c.satellite_id.in_(
+                select(satellite_table.c.id).where(
+                    or_(
+                        satellite_table.c.id == bindparam("id"),
+                        satellite_table.c.name == bindparam("name"),
+                    )
+                )
+            ),
+        )
+        removed = connection.execute(delete_stmt, keys).rowcount
+        return removed, _tracked_satellites(connection, user_id)
+
+
+def track_group(username, group_name, engine=None):
+    """Tracks every satellite of a group for a user with one membership
+    row. Returns the first page of the tracked satellites with the next
+    page cursor."""
+    with (engine or get_engine()).begin() as connection:
+        user_id = _resolve_user(connection, username)
+        if not _exists(
+            connection, satellite_group_table.c.group_name, group_name
+        ):
+            raise ValueError("Group not found")
+        inserted = connection.execute(
+            sqlite_insert(user_group_table)
+            .values(user_id=user_id, group_name=group_name)
+            .on_conflict_do_nothing()
+        ).rowcount
+        if not inserted:
+            raise ValueError("Group already tracked by user")
+        return _tracked_satellites(connection, user_id)
+
+
+def untrack_group(username, group_name, engine=None):
+    """Stops tracking a group for a user. Satellites they also track
+    directly stay tracked."""
+    with (engine or get_engine()).begin() as connection:
+        user_id = _resolve_user(connection, username)
+        deleted = connection.execute(
+            user_group_table.delete().where(
+                user_group_table.c.user_id == user_id,
+                user_group_table.c.group_name == group_name,
+            )
+        ).rowcount
+        if not deleted:
+            raise ValueError("Group is not currently tracked by user")
+        return _tracked_satellites(connection, user_id)
+
+
+# The account page of a user, matched ignoring case: their name, groups,
+# countries and first page of tracked satellites, tagged by kind
+ACCOUNT_SQL = (
+    "WITH u AS (SELECT id, user_name FROM user "
+    "WHERE lower(user_name) = lower(:username) LIMIT 1) "
+    "SELECT 'user', NULL, u.user_name FROM u "
+    "UNION ALL SELECT 'group', NULL, ug.group_name FROM u "
+    "JOIN user_group ug ON ug.user_id = u.id "
+    "UNION ALL SELECT 'country', NULL, c.name FROM u "
+    "JOIN user_country uc ON uc.user_id = u.id "
+    "JOIN country c ON c.name = uc.country_name "
+    "UNION ALL SELECT * FROM (SELECT 'satellite', s.id, s.name "
+    "FROM u JOIN satellite s ON s.id IN ("
+    + TRACKED_IDS_SQL.replace(":user_id", "u.id")
+    + ") ORDER BY ifnull(s.name, ''), s.id LIMIT :limit)"
+)
 
-    except Exception as e:
-        print(f"Error: {e}")
-        raise
-    finally:
-        session.close()
 
+def get_account(username, engine=None):
+    """Returns the user's name as stored with the groups and countries
+    they track and the first page of their tracked satellites, or None
+    if there is no such user (matched ignoring case).
+
+    Everything comes from one UNION ALL query, so the account page needs
+    a single round trip."""
+    params = {"username": username, "limit": TRACKED_PAGE_SIZE + 1}
+    with (engine or read_engine).connect() as connection:
+        rows = connection.execute(text(ACCOUNT_SQL), params).fetchall()
+
+    account = {"groups": [], "countries": []}
+    satellites = []
+    for kind, satellite_id, name in rows:
+        if kind == "user":
+            account["user_name"] = name
+        elif kind == "group":
+            account["groups"].append(name)
+        elif kind == "country":
+            account["countries"].append({"name": name})
+        else:
+            satellites.append((satellite_id, name))
+    if "user_name" not in account:
+        return None
 
-def get_user_countries(username):
-    session = Session()
-    try:
-        # Find the user by username
-        stmt = select(user_table).filter(user_table.c.user_name == username)
-        result = session.execute(stmt).fetchone()
+    satellites.sort(key=lambda row: (row[1] or "", row[0]))
+    account["satellites"], account["next"] = _satellite_page(
+        satellites, TRACKED_PAGE_SIZE
+    )
+    return account
 
-        # Debugging output
-        print(f"User query result: {result}")  # Check if the user exists
 
-        if not result:
+def get_user_countries(username, engine=None):
+    """Countries tracked by a user, as dicts of their name"""
+    with (engine or read_engine).connect() as connection:
+        user_id = connection.execute(select(_user_id(username))).scalar()
+        if user_id is None:
             raise ValueError("User not found")
-
-        user_id = result.id  # Extract the user_id
-
-        # Debugging output
-        print(f"User ID: {user_id}")  # Check the extracted user_id
-
-        # Query to get all countries for the user
-        countries_stmt = (
-            select(
-                country_table.c.name
-            )  # We want the 'name' column from country_table
-            .join(
-                user_country_table,
-                user_country_table.c.country_name == country_table.c.name,
-            )  # Join on the country_name and name
-            .filter(
-                user_country_table.c.user_id == user_id
-            )  # Filter by the user_id
-        )
-        countries = session.execute(countries_stmt).all()
-
-        # Debugging output
-        print(f"Countries found: {countries}")  # Check the countries retrieved
-
-        # Return the countries as a list of dicts
-        return [{"name": country[0]} for country in countries]
-
-    except Exception as e:
-        print(f"Error: {e}")
-        raise
-    finally:
-        session.close()
+        return _tracked_countries(connection, user_id)
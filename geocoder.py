@@ -0,0 +1,70 @@
+import os
+
+import geopandas
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# Natural Earth 1:110m country polygons, named after pycountry
+COUNTRIES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "geodata", "countries.geojson"
+)
+
+# Points this close (in degrees) to a country count as over it, making up
+# for coastlines simplified at the 1:110m scale
+COAST_TOLERANCE_DEG = 0.25
+
+OCEAN = "Currently flying over the ocean"
+
+
+class ReverseGeocoder:
+    """Offline reverse geocoder over bundled country polygons.
+
+    The polygons are held in an STRtree, so a batch of points is matched
+    against only the countries whose bounding boxes contain them, in one
+    vectorized query."""
+
+    def __init__(self, path=COUNTRIES_FILE):
+        countries = geopandas.read_file(path)
+        self.names = countries["country"].tolist()
+        self.geometries = np.asarray(countries.geometry)
+        self.tree = STRtree(self.geometries)
+
+    def countries(self, lat, lon):
+        """Name of the country containing each lat/lon point in degrees,
+        or None for points over the ocean"""
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.mod(np.atleast_1d(np.asarray(lon, dtype=float)) + 180, 360)
+        points = shapely.points(lon - 180, lat)
+        point_index, country_index = self.tree.query(
+            points, predicate="intersects"
+        )
+
+        names = [None] * len(points)
+        for i, j in zip(point_index, country_index):
+            if names[i] is None:
+                names[i] = self.names[j]
+
+        # Snap points just off a simplified coastline to the nearest country
+        offshore = np.array(
+            [i for i, name in enumerate(names) if name is None], dtype=int
+        )
+        point_index, country_index = self.tree.query(
+            points[offshore], predicate="dwithin", distance=COAST_TOLERANCE_DEG
+        )
+        # GEOS flags spurious floating point errors for a few polygons
+        with np.errstate(invalid="ignore"):
+            distance = shapely.distance(
+                points[offshore][point_index], self.geometries[country_index]
+            )
+        for k in np.argsort(-distance):
+            names[offshore[point_index[k]]] = self.names[country_index[k]]
+        return names
+
+    def locate(self, lat, lon):
+        """Location string of one point, as shown on the satellite page"""
+        return self.locate_many([lat], [lon])[0]
+
+    def locate_many(self, lat, lon):
+        """Location strings of many points at once"""
+        return [name or OCEAN for name in self.countries(lat, lon)]
@@ -6,6 +6,8 @@ from sqlalchemy import (
     MetaData,
     Float,
     ForeignKey,
+    Index,
+    func,
 )
 from sqlalchemy.orm import declarative_base
 
@@ -19,6 +21,64 @@ satellite_table = Table(
     Base.metadata,
     Column("id", Integer, primary_key=True),
     Column("name", String),
+    # Orbital element set (OMM) used for local SGP4 propagation
+    Column("object_id", String),
+    Column("epoch", String),
+    Column("mean_motion", Float),
+    Column("eccentricity", Float),
+    Column("inclination", Float),
+    Column("ra_of_asc_node", Float),
+    Column("arg_of_pericenter", Float),
+    Column("mean_anomaly", Float),
+    Column("ephemeris_type", Integer),
+    Column("classification_type", String),
+    Column("element_set_no", Integer),
+    Column("rev_at_epoch", Integer),
+    Column("bstar", Float),
+    Column("mean_motion_dot", Float),
+    Column("mean_motion_ddot", Float),
+)
+
+# Groups a satellite was ingested from, named after the CelesTrak group
+# files (e.g. "starlink", "weather")
+satellite_group_table = Table(
+    "satellite_group",
+    Base.metadata,
+    Column(
+        "satellite_id", Integer, ForeignKey("satellite.id"), primary_key=True
+    ),
+    Column("group_name", String, primary_key=True),
+)
+
+# SHA-256 of each catalog file when it was last ingested, so a refresh
+# can skip files that have not changed
+ingest_manifest_table = Table(
+    "ingest_manifest",
+    Base.metadata,
+    Column("path", String, primary_key=True),
+    Column("sha256", String),
+    Column("rows", Integer),
+    Column("ingested_at", Float),
+)
+
+# Key/value metadata about the catalog. "version" is incremented by every
+# ingestion and versions the responses cached by clients.
+catalog_meta_table = Table(
+    "catalog_meta",
+    Base.metadata,
+    Column("key", String, primary_key=True),
+    Column("value", Integer),
+)
+
+# Image URL looked up for each satellite name. Names without a search
+# result are stored with found = 0 and the fallback image URL.
+satellite_image_table = Table(
+    "satellite_image",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("url", String),
+    Column("found", Integer),
+    Column("fetched_at", Float),
 )
 
 country_table = Table(
@@ -59,3 +119,25 @@ user_country_table = Table(
         "country_name", String, ForeignKey("country.name"), primary_key=True
     ),
 )
+
+# Satellite groups a user tracks as a whole, e.g. every "starlink"
+# satellite. Members are looked up when the tracked list is read, so the
+# group follows later ingestions.
+user_group_table = Table(
+    "user_group",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("user.id"), primary_key=True),
+    Column("group_name", String, primary_key=True),
+)
+
+# Indexes behind the exact-match lookups. Names are looked up to find a
+# satellite's id and paged in (name, id) order, so that index covers both.
+# Users are found ignoring case, through an index on lower(user_name).
+Index("ix_satellite_name", satellite_table.c.name, satellite_table.c.id)
+Index("ix_country_name", country_table.c.name)
+Index("ix_user_name_lower", func.lower(user_table.c.user_name))
+Index(
+    "ix_satellite_group_name",
+    satellite_group_table.c.group_name,
+    satellite_group_table.c.satellite_id,
+)
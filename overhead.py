@@ -0,0 +1,274 @@
+import threading
+import time
+
+import numpy as np
+
+from propagation import RADIUS, look_angles, observer_position
+
+# Number of countries whose elevations are computed in one matrix product,
+# bounding the temporary arrays to a few MB for the full catalog
+COUNTRY_BATCH = 32
+
+# Size in degrees of the lat/lon grid cells used by SubpointIndex
+CELL_DEG = 2.0
+N_LAT_CELLS = int(180 / CELL_DEG)
+N_LON_CELLS = int(360 / CELL_DEG)
+
+
+class SubpointIndex:
+    """Lat/lon grid over sub-satellite points for radius queries.
+
+    Points are sorted by grid cell with an offsets array per cell, so a
+    query only visits the cells overlapping its spherical cap. Passing
+    the previous tick's index reuses its ordering: points barely move
+    between ticks, so the stable re-sort runs on nearly sorted input."""
+
+    def __init__(self, lat, lon, members, previous=None):
+        self.members = members
+        self.unit = _unit_vectors(lat, lon)
+
+        rows = np.clip(
+            ((lat + 90) // CELL_DEG).astype(np.int64), 0, N_LAT_CELLS - 1
+        )
+        cols = np.clip(
+            (np.mod(lon + 180, 360) // CELL_DEG).astype(np.int64),
+            0,
+            N_LON_CELLS - 1,
+        )
+        cells = rows * N_LON_CELLS + cols
+
+        if previous is not None and np.array_equal(
+            previous.members, members
+        ):
+            order = previous.order
+            self.order = order[np.argsort(cells[order], kind="stable")]
+        else:
+            self.order = np.argsort(cells, kind="stable")
+        counts = np.bincount(cells, minlength=N_LAT_CELLS * N_LON_CELLS)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def query(self, lat, lon, radius_deg):
+        """Positions (into `members`) of the points within `radius_deg`
+        great-circle degrees of lat/lon"""
+        radius_deg = min(max(radius_deg, 0.0), 180.0)
+        row_lo = int(max(lat - radius_deg + 90, 0) // CELL_DEG)
+        row_hi = int(min(lat + radius_deg + 90, 179.999) // CELL_DEG)
+
+        # Longitude half-width of the cap, or the whole row near a pole
+        if abs(lat) + radius_deg >= 90:
+            half_width = 180.0
+        else:
+            half_width = np.degrees(
+                np.arcsin(
+                    np.sin(np.radians(radius_deg)) / np.cos(np.radians(lat))
+                )
+            )
+
+        if half_width >= 180:
+            col_ranges = [(0, N_LON_CELLS - 1)]
+        else:
+            col_lo = int(np.mod(lon - half_width + 180, 360) // CELL_DEG)
+            col_hi = int(np.mod(lon + half_width + 180, 360) // CELL_DEG)
+            if col_lo <= col_hi:
+                col_ranges = [(col_lo, col_hi)]
+            else:
+                col_ranges = [(col_lo, N_LON_CELLS - 1), (0, col_hi)]
+
+        slices = [
+            self.order[
+                self.offsets[row * N_LON_CELLS + lo]:self.offsets[
+                    row * N_LON_CELLS + hi + 1
+                ]
+            ]
+            for row in range(row_lo, row_hi + 1)
+            for lo, hi in col_ranges
+        ]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(slices)
+
+        centre = _unit_vectors(np.array(lat), np.array(lon))
+        inside = self.unit[candidates] @ centre >= np.cos(
+            np.radians(radius_deg)
+        )
+        return candidates[inside]
+
+
+class OverheadTable:
+    """Materialized map of country name -> satellites currently above it.
+
+    A background tick propagates the catalog once and recomputes every
+    country in one batch. Each tick builds a fresh map and swaps it in,
+    so readers always see a complete snapshot without locking."""
+
+    def __init__(self, load_catalog, load_countries, interval=30):
+        self.load_catalog = load_catalog
+        self.load_countries = load_countries
+        self.interval = interval
+        self.updated_at = None
+        self._snapshot = {}
+        self._current = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def get(self, country_name):
+        """Returns the satellites above a country as of the last tick, or
+        None if the country has not been computed yet"""
+        return self._snapshot.get(country_name)
+
+    def near(self, lat, lon, radius_deg):
+        """Satellites whose subpoint is within `radius_deg` great-circle
+        degrees of lat/lon as of the last tick, nearest first, or None if
+        no tick has completed yet"""
+        current = self._current
+        if current is None:
+            return None
+        catalog, state, valid, index = current
+        hits = index.query(lat, lon, radius_deg)
+        cos_distance = index.unit[hits] @ _unit_vectors(
+            np.array(lat), np.array(lon)
+        )
+        hits = hits[np.argsort(-cos_distance, kind="stable")]
+        return [
+            {
+                "id": int(catalog.ids[valid[i]]),
+                "name": catalog.names[valid[i]],
+                "lat": round(float(state["lat"][valid[i]]), 4),
+                "lon": round(float(state["lon"][valid[i]]), 4),
+                "alt": round(float(state["alt"][valid[i]]), 1),
+            }
+            for i in hits
+        ]
+
+    def above(self, lat, lon, radius, alt=0.0):
+        """Satellites within `radius` degrees of the zenith of an
+        arbitrary observer as of the last tick, highest first, or None if
+        no tick has completed yet"""
+        current = self._current
+        if current is None:
+            return None
+        catalog, state, valid, index = current
+
+        # Only subpoints close enough to be seen at the minimum elevation
+        # from the highest satellite can qualify. The margin covers the
+        # spherical approximation made by the index.
+        min_elevation = max(90.0 - radius, 0.0)
+        max_alt = state["alt"][valid].max() if len(valid) else 0.0
+        hits = index.query(
+            lat, lon, footprint_radius(max_alt, min_elevation) + 1.0
+        )
+
+        _, elevation, _ = look_angles(
+            state["position"][valid[hits]], lat, lon, alt
+        )
+        keep = elevation >= min_elevation
+        hits, elevation = hits[keep], elevation[keep]
+        hits = hits[np.argsort(-elevation, kind="stable")]
+        return [
+            {"id": int(catalog.ids[valid[i]]), "name": catalog.names[valid[i]]}
+            for i in hits
+        ]
+
+    def refresh(self, when=None):
+        """Recomputes the satellites above every country and the subpoint
+        index"""
+        catalog = self.load_catalog()
+        countries = self.load_countries()
+        state = catalog.propagate(when)
+        valid = np.flatnonzero(state["valid"])
+        positions = state["position"][valid]
+
+        previous = self._current
+        index = SubpointIndex(
+            state["lat"][valid],
+            state["lon"][valid],
+            catalog.ids[valid],
+            previous=previous[3] if previous else None,
+        )
+
+        snapshot = {}
+        for start in range(0, len(countries), COUNTRY_BATCH):
+            batch = countries[start:start + COUNTRY_BATCH]
+            visible = _visible_from(
+                positions,
+                np.array([c["latitude"] for c in batch]),
+                np.array([c["longitude"] for c in batch]),
+                np.array([c["above_angle"] for c in batch]),
+            )
+            for country, sin_elevation, mask in zip(batch, *visible):
+                order = np.flatnonzero(mask)
+                order = order[np.argsort(-sin_elevation[order])]
+                snapshot[country["name"]] = [
+                    {
+                        "id": int(catalog.ids[valid[i]]),
+                        "name": catalog.names[valid[i]],
+                    }
+                    for i in order
+                ]
+
+        self._snapshot = snapshot
+        self._current = (catalog, state, valid, index)
+        self.updated_at = time.time()
+
+    def start(self):
+        """Starts the background refresh thread if it is not running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="overhead-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background refresh thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing overhead table: {e}")
+            self._stop.wait(self.interval)
+
+
+def footprint_radius(alt, min_elevation):
+    """Great-circle radius in degrees around a satellite's subpoint from
+    which it appears at least `min_elevation` degrees above the horizon"""
+    elevation = np.radians(min_elevation)
+    nadir = np.arcsin(RADIUS * np.cos(elevation) / (RADIUS + alt))
+    return float(np.degrees(np.pi / 2 - elevation - nadir))
+
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+        axis=-1,
+    )
+
+
+def _visible_from(positions, lat, lon, radius):
+    """Sine of the elevation of every satellite from each observer, and
+    which satellites are within `radius` degrees of that observer's
+    zenith. Both arrays are (observers, satellites)."""
+    observers = observer_position(lat, lon)  # (C, 3)
+    up = _unit_vectors(lat, lon)
+
+    # |p - o|^2 and (p - o) . up expanded into matrix products
+    distance_sq = (
+        np.einsum("ij,ij->i", positions, positions)[None, :]
+        - 2 * observers @ positions.T
+        + np.einsum("ij,ij->i", observers, observers)[:, None]
+    )
+    height = up @ positions.T - np.einsum("ij,ij->i", up, observers)[:, None]
+    sin_elevation = height / np.sqrt(distance_sq)
+
+    min_elevation = np.radians(np.maximum(90.0 - radius, 0.0))
+    return sin_elevation, sin_elevation >= np.sin(min_elevation)[:, None]
@@ -0,0 +1,268 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from cache import TTLCache
+from propagation import (
+    RADIUS,
+    ecef_to_geodetic,
+    gmst,
+    julian_dates,
+    look_angles,
+    observer_position,
+    teme_to_ecef,
+)
+
+# Coarse sampling step used to bracket rises and sets, in seconds
+COARSE_STEP = 60
+# Bisection / golden-section iterations used to refine each event
+REFINE_ITERATIONS = 12
+# Sampling step used to measure how long a pass is visible, in seconds
+VISIBILITY_STEP = 10
+# The sun must be this far below the observer's horizon for a visual pass
+TWILIGHT_ELEVATION = -6.0
+
+# Observer coordinates are snapped to cells this size for caching
+OBSERVER_CELL_DEG = 0.5
+
+
+def sun_direction(timestamps):
+    """Earth-fixed unit vectors (n, 3) towards the sun, from the
+    low-precision solar coordinates of the Astronomical Almanac"""
+    jd, fr = julian_dates(timestamps)
+    n = jd - 2451545.0 + fr
+    mean_longitude = np.radians(280.460 + 0.9856474 * n)
+    anomaly = np.radians(357.528 + 0.9856003 * n)
+    ecliptic_longitude = (
+        mean_longitude
+        + np.radians(1.915) * np.sin(anomaly)
+        + np.radians(0.020) * np.sin(2 * anomaly)
+    )
+    obliquity = np.radians(23.439 - 0.0000004 * n)
+    inertial = np.stack(
+        [
+            np.cos(ecliptic_longitude),
+            np.cos(obliquity) * np.sin(ecliptic_longitude),
+            np.sin(obliquity) * np.sin(ecliptic_longitude),
+        ],
+        axis=-1,
+    )
+    return teme_to_ecef(inertial, jd, fr)
+
+
+def is_sunlit(positions, sun):
+    """Whether Earth-fixed positions (n, 3) are outside the Earth's
+    cylindrical shadow for the matching sun directions"""
+    along = np.einsum("ij,ij->i", positions, sun)
+    across = np.linalg.norm(positions - along[:, None] * sun, axis=1)
+    return (along > 0) | (across > RADIUS)
+
+
+def sun_elevation(sun, lat, lon):
+    """Elevation in degrees of the sun seen from an observer"""
+    far = sun * 1.496e8  # km, far enough that parallax is irrelevant
+    _, elevation, _ = look_angles(
+        far + observer_position(lat, lon), lat, lon
+    )
+    return elevation
+
+
+class PassPredictor:
+    """Finds passes and position timelines of one satellite for an
+    observer"""
+
+    def __init__(self, satrec, lat, lon, alt=0.0):
+        self.satrec = satrec
+        self.lat, self.lon, self.alt = lat, lon, alt
+
+    def positions(self, timestamps):
+        """Earth-fixed positions (n, 3) at unix timestamps"""
+        jd, fr = julian_dates(timestamps)
+        _, teme, _ = self.satrec.sgp4_array(jd, fr)
+        return teme_to_ecef(teme, jd, fr)
+
+    def look(self, timestamps):
+        """Azimuth and elevation in degrees at unix timestamps"""
+        azimuth, elevation, _ = look_angles(
+            self.positions(timestamps), self.lat, self.lon, self.alt
+        )
+        return azimuth, np.nan_to_num(elevation, nan=-90.0)
+
+    def timeline(self, start, seconds, step=1):
+        """Positions every `step` seconds over `seconds` from `start`,
+        shaped like the entries of N2YO's /positions/ endpoint.
+
+        Every time step is propagated in a single vectorized call."""
+        times = start + np.arange(0, seconds, step)
+        jd, fr = julian_dates(times)
+        _, teme, _ = self.satrec.sgp4_array(jd, fr)
+        positions = teme_to_ecef(teme, jd, fr)
+        lat, lon, alt = ecef_to_geodetic(positions)
+        azimuth, elevation, _ = look_angles(
+            positions, self.lat, self.lon, self.alt
+        )
+        sunlit = is_sunlit(positions, sun_direction(times))
+
+        # Topocentric right ascension and declination in the inertial frame
+        theta = gmst(jd, fr)
+        observer = observer_position(self.lat, self.lon, self.alt)
+        offset = teme - np.stack(
+            [
+                np.cos(theta) * observer[0] - np.sin(theta) * observer[1],
+                np.sin(theta) * observer[0] + np.cos(theta) * observer[1],
+                np.full_like(theta, observer[2]),
+            ],
+            axis=-1,
+        )
+        ra = np.mod(np.degrees(np.arctan2(offset[:, 1], offset[:, 0])), 360)
+        dec = np.degrees(
+            np.arcsin(offset[:, 2] / np.linalg.norm(offset, axis=1))
+        )
+
+        return [
+            {
+                "satlatitude": round(float(lat[i]), 5),
+                "satlongitude": round(float(lon[i]), 5),
+                "sataltitude": round(float(alt[i]), 2),
+                "azimuth": round(float(azimuth[i]), 2),
+                "elevation": round(float(elevation[i]), 2),
+                "ra": round(float(ra[i]), 5),
+                "dec": round(float(dec[i]), 5),
+                "timestamp": int(times[i]),
+                "eclipsed": not sunlit[i],
+            }
+            for i in range(len(times))
+        ]
+
+    def passes(self, start, seconds, min_elevation=0.0):
+        """Complete passes between `start` and `start + seconds` (unix
+        timestamps) that rise above `min_elevation`.
+
+        Rises and sets are bracketed on a coarse time grid and refined by
+        bisection, and culminations by golden-section search; each step
+        evaluates every pass at once."""
+        times = start + np.arange(0, seconds + COARSE_STEP, COARSE_STEP)
+        above = self.look(times)[1] >= min_elevation
+        rising = np.flatnonzero(~above[:-1] & above[1:])
+        setting = np.flatnonzero(above[:-1] & ~above[1:])
+
+        # Pair each rise with the next set, dropping partial passes
+        if len(setting) and len(rising) and setting[0] < rising[0]:
+            setting = setting[1:]
+        count = min(len(rising), len(setting))
+        if not count:
+            return []
+        rising, setting = rising[:count], setting[:count]
+
+        rise = self._crossing(times[rising], times[rising + 1], min_elevation)
+        set_ = self._crossing(
+            times[setting + 1], times[setting], min_elevation
+        )
+        peak = self._culmination(rise, set_)
+
+        rise_az, _ = self.look(rise)
+        peak_az, peak_el = self.look(peak)
+        set_az, _ = self.look(set_)
+        return [
+            {
+                "startUTC": int(rise[i]),
+                "startAz": round(float(rise_az[i]), 2),
+                "maxUTC": int(peak[i]),
+                "maxAz": round(float(peak_az[i]), 2),
+                "maxEl": round(float(peak_el[i]), 2),
+                "endUTC": int(set_[i]),
+                "endAz": round(float(set_az[i]), 2),
+                "duration": int(set_[i] - rise[i]),
+            }
+            for i in range(count)
+        ]
+
+    def visual_passes(self, start, seconds, min_visibility=0):
+        """Passes during which the satellite is sunlit while the observer
+        is in darkness for at least `min_visibility` seconds. The start of
+        each pass is moved to when it first becomes visible."""
+        visual = []
+        for info in self.passes(start, seconds):
+            times = np.arange(
+                info["startUTC"], info["endUTC"] + 1, VISIBILITY_STEP
+            )
+            sun = sun_direction(times)
+            visible = is_sunlit(self.positions(times), sun) & (
+                sun_elevation(sun, self.lat, self.lon) < TWILIGHT_ELEVATION
+            )
+            duration = int(visible.sum()) * VISIBILITY_STEP
+            if not visible.any() or duration < min_visibility:
+                continue
+            first = int(times[np.argmax(visible)])
+            info = dict(info, duration=duration)
+            if first > info["startUTC"]:
+                info["startUTC"] = first
+                info["startAz"] = round(float(self.look([first])[0][0]), 2)
+            visual.append(info)
+        return visual
+
+    def _crossing(self, below, above, min_elevation):
+        """Bisects each [below, above] bracket to where the elevation
+        crosses `min_elevation`"""
+        below = np.asarray(below, dtype=np.float64)
+        above = np.asarray(above, dtype=np.float64)
+        for _ in range(REFINE_ITERATIONS):
+            middle = (below + above) / 2
+            up = self.look(middle)[1] >= min_elevation
+            above = np.where(up, middle, above)
+            below = np.where(up, below, middle)
+        return np.round(above)
+
+    def _culmination(self, start, end):
+        """Golden-section search for the highest point of each pass"""
+        ratio = (np.sqrt(5) - 1) / 2
+        start, end = start.copy(), end.copy()
+        for _ in range(REFINE_ITERATIONS):
+            left = end - ratio * (end - start)
+            right = start + ratio * (end - start)
+            higher_left = self.look(left)[1] >= self.look(right)[1]
+            end = np.where(higher_left, right, end)
+            start = np.where(higher_left, start, left)
+        return np.round((start + end) / 2)
+
+
+class PassCache:
+    """Bounded LRU cache of visual passes per satellite, observer grid
+    cell and UTC day. Passes are predicted from the start of the day for
+    the cell's centre, so every observer in a cell shares the result."""
+
+    def __init__(self, maxsize=2048):
+        self.entries = TTLCache(maxsize=maxsize, ttl=2 * 86400)
+
+    def visual_passes(
+        self, satellite_id, satrec, lat, lon, days=10, min_visibility=0,
+        now=None,
+    ):
+        """Upcoming visual passes, served from the cache when possible"""
+        now = now or datetime.now(timezone.utc)
+        day = int(now.timestamp() // 86400)
+        lat, lon = snap_to_cell(lat), snap_to_cell(lon)
+        key = (satellite_id, lat, lon, day, days, min_visibility)
+
+        def predict():
+            predictor = PassPredictor(satrec, lat, lon)
+            return predictor.visual_passes(
+                day * 86400, (days + 1) * 86400, min_visibility
+            )
+
+        passes = self.entries.get_or_set(key, predict)
+
+        # Drop passes that have ended and those beyond the window
+        current = now.timestamp()
+        return [
+            p
+            for p in passes
+            if p["endUTC"] >= current
+            and p["startUTC"] <= current + days * 86400
+        ]
+
+
+def snap_to_cell(degrees):
+    """Snaps a coordinate to the centre of its observer cell"""
+    cell = np.floor(degrees / OBSERVER_CELL_DEG)
+    return float((cell + 0.5) * OBSERVER_CELL_DEG)
@@ -0,0 +1,252 @@
+from datetime import datetime, timezone
+import numpy as np
+from sgp4.api import Satrec, SatrecArray
+from sgp4.exporter import export_tle
+from sgp4 import omm
+from sqlalchemy import select
+
+from catalog_feed import ELEMENT_FIELDS
+from models import satellite_table
+
+# Constants shared with pyephem() so batch and single results agree
+RADIUS = 6371.0  # km
+GRAVITY = 398600.4418  # km^3/s^2
+
+# WGS84 ellipsoid used to convert positions into geodetic subpoints
+WGS84_A = 6378.137  # km
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# Element columns held as numeric arrays by SatelliteCatalog
+NUMERIC_COLUMNS = [
+    "mean_motion",
+    "eccentricity",
+    "inclination",
+    "ra_of_asc_node",
+    "arg_of_pericenter",
+    "mean_anomaly",
+    "bstar",
+    "mean_motion_dot",
+    "mean_motion_ddot",
+]
+
+# Element sets older than this are too inaccurate to propagate, so callers
+# should fetch a fresh TLE instead
+MAX_ELEMENT_AGE_DAYS = 30
+
+
+def has_elements(elements):
+    """Checks that a satellite row carries a complete element set"""
+    return all(
+        elements.get(column) is not None for column in ELEMENT_FIELDS.values()
+    )
+
+
+def is_stale(elements, when=None):
+    """Checks whether a stored element set is too old to propagate to
+    `when` (defaults to now)"""
+    when = when or datetime.now(timezone.utc)
+    epoch = datetime.fromisoformat(elements["epoch"])
+    if epoch.tzinfo is None:
+        epoch = epoch.replace(tzinfo=timezone.utc)
+    return abs((when - epoch).total_seconds()) > MAX_ELEMENT_AGE_DAYS * 86400
+
+
+def tle_epoch(line1):
+    """Unix timestamp of the epoch in the first line of a TLE"""
+    year = int(line1[18:20])
+    year += 2000 if year < 57 else 1900
+    day = float(line1[20:32])
+    start = datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+    return start + (day - 1) * 86400
+
+
+def satrec_from_elements(elements):
+    """Builds an SGP4 satellite record from a satellite row holding
+    its stored element set"""
+    fields = {
+        field: str(elements[column])
+        for field, column in ELEMENT_FIELDS.items()
+    }
+    fields["NORAD_CAT_ID"] = str(elements["id"])
+    sat = Satrec()
+    omm.initialize(sat, fields)
+    return sat
+
+
+def tle_from_elements(elements):
+    """Returns the [name, line1, line2] TLE for a stored element set,
+    in the format expected by ephem.readtle"""
+    line1, line2 = export_tle(satrec_from_elements(elements))
+    return [elements["name"], line1, line2]
+
+
+def julian_dates(timestamps):
+    """Splits unix timestamps into the whole and fractional Julian date
+    arrays expected by SGP4"""
+    days = np.asarray(timestamps, dtype=np.float64) / 86400.0
+    whole = np.floor(days)
+    return 2440587.5 + whole, days - whole
+
+
+def gmst(jd, fr):
+    """Greenwich mean sidereal time in radians (IAU 1982 model)"""
+    t = (jd - 2451545.0 + fr) / 36525.0
+    seconds = (
+        67310.54841
+        + (876600.0 * 3600 + 8640184.812866) * t
+        + 0.093104 * t**2
+        - 6.2e-6 * t**3
+    )
+    return np.mod(np.radians(seconds / 240.0), 2 * np.pi)
+
+
+def teme_to_ecef(positions, jd, fr):
+    """Rotates TEME positions (..., 3) into the Earth-fixed frame"""
+    theta = gmst(jd, fr)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    x, y, z = positions[..., 0], positions[..., 1], positions[..., 2]
+    return np.stack(
+        [cos_t * x + sin_t * y, -sin_t * x + cos_t * y, z], axis=-1
+    )
+
+
+def ecef_to_geodetic(positions):
+    """Converts Earth-fixed positions (..., 3) in km into geodetic
+    latitude and longitude in degrees and altitude in km"""
+    x, y, z = positions[..., 0], positions[..., 1], positions[..., 2]
+    p = np.hypot(x, y)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z, p * (1 - WGS84_E2))
+    for _ in range(3):
+        sin_lat = np.sin(lat)
+        n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat**2)
+        lat = np.arctan2(z + WGS84_E2 * n * sin_lat, p)
+    sin_lat = np.sin(lat)
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat**2)
+    alt = p / np.cos(lat) - n
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+def observer_position(lat, lon, alt=0.0):
+    """Earth-fixed position in km of an observer at geodetic `lat`/`lon`
+    in degrees and `alt` in km"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+    return np.stack(
+        [
+            (n + alt) * np.cos(lat) * np.cos(lon),
+            (n + alt) * np.cos(lat) * np.sin(lon),
+            (n * (1 - WGS84_E2) + alt) * np.sin(lat),
+        ],
+        axis=-1,
+    )
+
+
+def look_angles(positions, lat, lon, alt=0.0):
+    """Azimuth and elevation in degrees and range in km of Earth-fixed
+    positions (..., 3) as seen by an observer"""
+    offset = positions - observer_position(lat, lon, alt)
+    lat, lon = np.radians(lat), np.radians(lon)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    x, y, z = offset[..., 0], offset[..., 1], offset[..., 2]
+    east = -sin_lon * x + cos_lon * y
+    north = -sin_lat * cos_lon * x - sin_lat * sin_lon * y + cos_lat * z
+    up = cos_lat * cos_lon * x + cos_lat * sin_lon * y + sin_lat * z
+    azimuth = np.mod(np.degrees(np.arctan2(east, north)), 360.0)
+    elevation = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    return azimuth, elevation, np.linalg.norm(offset, axis=-1)
+
+
+def ground_speed(alt):
+    """Ground speed in km/s of a circular orbit at altitude `alt`"""
+    orbital_velocity = np.sqrt(GRAVITY / (RADIUS + alt))
+    return orbital_velocity * (RADIUS / (RADIUS + alt))
+
+
+class SatelliteCatalog:
+    """Struct-of-arrays view of every stored element set, propagated
+    together in a single vectorized SGP4 call"""
+
+    def __init__(self, rows):
+        rows = [row for row in rows if has_elements(row)]
+        self.ids = np.array([row["id"] for row in rows], dtype=np.int64)
+        self.names = [row["name"] for row in rows]
+        self.elements = {
+            column: np.array([row[column] for row in rows], dtype=float)
+            for column in NUMERIC_COLUMNS
+        }
+        self.epochs = np.array(
+            [
+                datetime.fromisoformat(row["epoch"])
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+                for row in rows
+            ],
+            dtype=np.float64,
+        )
+        self._satrecs = SatrecArray(
+            [satrec_from_elements(row) for row in rows]
+        )
+
+    @classmethod
+    def from_engine(cls, engine):
+        """Loads every satellite with stored elements from the database"""
+        stmt = select(satellite_table).where(
+            satellite_table.c.epoch.isnot(None)
+        )
+        with engine.connect() as connection:
+            rows = connection.execute(stmt).mappings().all()
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def propagate(self, when=None):
+        """Propagates the whole catalog to `when` (defaults to now).
+
+        Returns a dict of arrays aligned with `ids`: subpoint `lat`/`lon`
+        in degrees, `alt` in km, `ground_speed` in km/s, Earth-fixed
+        `position` in km and a `valid` mask for SGP4 failures and for
+        element sets too stale to propagate to `when`."""
+        when = when or datetime.now(timezone.utc)
+        jd, fr = julian_dates([when.timestamp()])
+        if not len(self):
+            empty = np.empty(0)
+            return {
+                "lat": empty,
+                "lon": empty,
+                "alt": empty,
+                "ground_speed": empty,
+                "position": np.empty((0, 3)),
+                "valid": np.empty(0, dtype=bool),
+            }
+
+        errors, teme, _ = self._satrecs.sgp4(jd, fr)
+        # Same rule as is_stale, so stale sets are never shown as positions
+        fresh = (
+            np.abs(when.timestamp() - self.epochs)
+            <= MAX_ELEMENT_AGE_DAYS * 86400
+        )
+        position = teme_to_ecef(teme[:, 0, :], jd[0], fr[0])
+        lat, lon, alt = ecef_to_geodetic(position)
+        return {
+            "lat": lat,
+            "lon": lon,
+            "alt": alt,
+            "ground_speed": ground_speed(alt),
+            "position": position,
+            "valid": (errors[:, 0] == 0) & np.isfinite(alt) & fresh,
+        }
+
+    def above(self, lat, lon, radius, alt=0.0, when=None):
+        """Indices of satellites within `radius` degrees of the
+        observer's zenith, i.e. at least 90 - radius degrees above the
+        horizon, ordered from highest to lowest elevation"""
+        state = self.propagate(when)
+        _, elevation, _ = look_angles(state["position"], lat, lon, alt)
+        min_elevation = max(90.0 - radius, 0.0)
+        visible = state["valid"] & (elevation >= min_elevation)
+        indices = np.flatnonzero(visible)
+        return indices[np.argsort(-elevation[indices], kind="stable")]
@@ -0,0 +1,109 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds applied to every upstream call
+DEFAULT_TIMEOUT = (3.05, 10)
+# Idle keep-alive connections kept per upstream host
+POOL_MAXSIZE = 16
+# Number of upstream hosts whose pools are kept open
+POOL_HOSTS = 8
+
+
+class UpstreamClient:
+    """Shared HTTP client for the upstream APIs (N2YO, Google, OpenWeather,
+    ip-api).
+
+    One session keeps a pool of keep-alive connections per host, so
+    repeat calls skip the TCP and TLS handshakes. Every call gets a
+    connect/read timeout, and idempotent requests are retried a bounded
+    number of times with exponential backoff."""
+
+    def __init__(
+        self,
+        timeout=DEFAULT_TIMEOUT,
+        retries=2,
+        backoff_factor=0.3,
+        pool_maxsize=POOL_MAXSIZE,
+    ):
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=POOL_HOSTS,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        """GET a url through the pooled session, with the default timeout
+        unless one is given"""
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).hostname
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self._record(host, start, failed=True)
+            raise
+        self._record(host, start, failed=response.status_code >= 400)
+        return response
+
+    def metrics(self):
+        """Per-host request counts, failures and latency, together with the
+        state of each host's connection pool"""
+        with self._lock:
+            metrics = {
+                host: dict(stats) for host, stats in self._stats.items()
+            }
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats = metrics.setdefault(pool.host, {})
+            stats["connections_opened"] = pool.num_connections
+            stats["pool_requests"] = pool.num_requests
+            # The pool's queue is padded with None for unopened slots
+            idle = list(pool.pool.queue) if pool.pool else []
+            stats["idle_connections"] = sum(c is not None for c in idle)
+        return metrics
+
+    def _record(self, host, start, failed):
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(
+                host, {"requests": 0, "failures": 0, "total_ms": 0.0}
+            )
+            stats["requests"] += 1
+            stats["failures"] += int(failed)
+            stats["total_ms"] = round(stats["total_ms"] + elapsed, 1)
+
+
+# Client shared by every blueprint
+client = UpstreamClient()
+
+
+def get(url, **kwargs):
+    """GET a url through the shared upstream client"""
+    return client.get(url, **kwargs)
+
+
+def metrics():
+    """Metrics of the shared upstream client"""
+    return client.metrics()